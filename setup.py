@@ -75,5 +75,7 @@ setup(name = 'collective.solr',
         target = plone
         [zopectl.command]
         solr_clear_index = collective.solr.commands:solr_clear_index
+        solr_reindex = collective.solr.commands:solr_reindex
+        solr_sync = collective.solr.commands:solr_sync
       ''',
 )
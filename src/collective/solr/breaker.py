@@ -0,0 +1,81 @@
+from logging import getLogger
+from threading import Lock
+from time import time
+
+logger = getLogger('collective.solr.breaker')
+
+CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half-open'
+
+
+class CircuitBreaker(object):
+    """ a circuit breaker for searches:  after `threshold` consecutive
+        failed or slow searches it "opens", so that searches aren't sent
+        to solr for `cooldown` seconds;  after that a single search is let
+        through as a probe ("half-open") and depending on its outcome the
+        breaker either closes again or stays open for another period """
+
+    def __init__(self, threshold=5, cooldown=30, slow=0):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.slow = slow            # response time counted as failure (ms)
+        self.state = CLOSED
+        self.failures = 0           # consecutive failures
+        self.opened = None
+        self.lock = Lock()
+        self.stats = dict(trips=0, rejected=0, failures=0, slow=0)
+
+    def change(self, state):
+        logger.warning('circuit breaker for searches changes from %s to %s',
+            self.state, state)
+        self.state = state
+        self.opened = time()
+        if state == OPEN:
+            self.stats['trips'] += 1
+        elif state == CLOSED:
+            self.failures = 0
+
+    def allow(self):
+        """ returns `True` if a search should be sent to solr """
+        self.lock.acquire()
+        try:
+            if self.state == CLOSED:
+                return True
+            if time() >= self.opened + self.cooldown:
+                # the current search is the probe;  another one is let
+                # through in case it doesn't return within the cool-down
+                self.change(HALF_OPEN)
+                return True
+            self.stats['rejected'] += 1
+            return False
+        finally:
+            self.lock.release()
+
+    def success(self, elapsed=0):
+        """ record a search that was answered after `elapsed` ms """
+        if self.slow and elapsed >= self.slow:
+            self.stats['slow'] += 1
+            return self.failure()
+        self.lock.acquire()
+        try:
+            if self.state != CLOSED:
+                self.change(CLOSED)
+            self.failures = 0
+        finally:
+            self.lock.release()
+
+    def failure(self):
+        """ record a failed search """
+        self.lock.acquire()
+        try:
+            self.failures += 1
+            self.stats['failures'] += 1
+            if self.state == HALF_OPEN or (self.state == CLOSED and
+                    self.threshold and self.failures >= self.threshold):
+                self.change(OPEN)
+        finally:
+            self.lock.release()
+
+    def statistics(self):
+        """ returns the state of the breaker as well as the number of trips,
+            rejected searches, failures and slow responses """
+        return dict(self.stats, state=self.state)
@@ -1,6 +1,11 @@
 from logging import getLogger
-from time import time, clock, strftime
+from Queue import Queue
+from threading import Lock, Thread
+from os.path import join
+from tempfile import gettempdir
+from time import time, clock, localtime, strftime
 
+from App.config import getConfiguration
 from BTrees.IIBTree import IITreeSet
 from Products.CMFCore.utils import getToolByName
 from Products.Five.browser import BrowserView
@@ -9,6 +14,7 @@ from zope.interface import implements
 from zope.component import queryUtility, queryAdapter
 from collective.solr.indexer import DefaultAdder
 from collective.solr.flare import PloneFlare
+from collective.solr.interfaces import ISolrConnectionConfig
 from collective.solr.interfaces import ISolrConnectionManager
 from collective.solr.interfaces import ISolrMaintenanceView
 from collective.solr.interfaces import ISolrAddHandler
@@ -16,9 +22,12 @@ from collective.solr.interfaces import ICheckIndexable
 from collective.solr.indexer import SolrIndexProcessor
 from collective.solr.indexer import boost_values
 from collective.solr.parser import parse_date_as_datetime
-from collective.solr.parser import SolrResponse
 from collective.solr.parser import unmarshallers
+from collective.solr.solr import SolrException
+from collective.solr.utils import countCatalogObjects
+from collective.solr.utils import findCatalogObjects
 from collective.solr.utils import findObjects
+from collective.solr.utils import loadState, saveState
 from collective.solr.utils import prepareData
 
 logger = getLogger('collective.solr.maintenance')
@@ -58,6 +67,66 @@ def notimeout(func):
     return wrapper
 
 
+class RecordingConnection(object):
+    """ stands in for the connection passed to the add handlers during a
+        pipelined reindex:  update requests get collected as usual, while
+        ones posted directly, e.g. by `BinaryAdder`, are recorded, so that
+        all of them are sent by the sender threads """
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.posts = []
+
+    def __getattr__(self, name):
+        return getattr(self.conn, name)
+
+    def doPost(self, url, body, headers, idempotent=True):
+        self.posts.append((url, body, headers))
+
+    def flush(self):
+        return []               # the requests will be sent later on
+
+
+def sendUpdates(conn, queue, stats, lock):
+    """ send the lists of update requests taken from `queue` using the
+        given connection until `None` is received;  the requests are
+        queued along with the ones to be posted directly and a function
+        to be called once all of them have been sent successfully;  this
+        runs in the sender threads of a reindex """
+    while True:
+        item = queue.get()
+        if item is None:
+            break
+        requests, posts, done = item
+        start = time()
+        failures = conn.failures
+        conn.xmlbody.extend(requests)
+        try:
+            for url, body, headers in posts:
+                try:
+                    conn.doPost(url, body, headers).read()
+                except SolrException:
+                    logger.exception('exception during request to %s', url)
+                    conn.failures += 1
+            batches = len(conn.flush())
+            errors = conn.failures - failures
+        except Exception:
+            logger.exception('exception while sending updates')
+            del conn.xmlbody[:]
+            conn.close()            # it'll get reopened on next use
+            batches, errors = 0, 1
+        if not errors and done is not None:
+            done()
+        lock.acquire()
+        try:
+            stats['batches'] += batches
+            stats['errors'] += errors
+            stats['bytes'] += sum([len(request) for request in requests])
+            stats['elapsed'] += time() - start
+        finally:
+            lock.release()
+
+
 class SolrMaintenanceView(BrowserView):
     """ helper view for indexing all portal content in Solr """
     implements(ISolrMaintenanceView)
@@ -92,17 +161,50 @@ class SolrMaintenanceView(BrowserView):
         conn.commit()
         return 'solr index cleared.'
 
-    def reindex(self, batch=1000, skip=0):
+    def checkpointPath(self):
+        """ returns the path of the file holding the checkpoint of the last
+            reindex run for the current context """
+        home = getattr(getConfiguration(), 'clienthome', None)
+        name = '-'.join(self.context.getPhysicalPath()[1:]) or 'root'
+        return join(home or gettempdir(), 'solr-reindex-%s.state' % name)
+
+    def progress(self):
+        """ report the progress of the current or last reindex run """
+        state = loadState(self.checkpointPath())
+        if state is None:
+            return 'no reindex checkpoint found.'
+        rate = state['processed'] / max(state['elapsed'], 0.001)
+        msg = '%d of %s items processed in %.3fs (%.1f items/s)' % (
+            state['processed'], state['total'] or '?', state['elapsed'], rate)
+        if state['done']:
+            msg += ', reindex finished'
+        elif state['total'] and rate:
+            eta = max(state['total'] - state['processed'], 0) / rate
+            msg += ', eta %ds' % eta
+        msg += ';  last checkpoint at %s after %r.' % (
+            strftime('%Y/%m/%d-%H:%M:%S', localtime(state['updated'])),
+            state['path'])
+        return msg
+
+    def reindex(self, batch=1000, skip=0, senders=0, walk='tree',
+            resume=False):
         """ find all contentish objects (meaning all objects derived from one
-            of the catalog mixin classes) and (re)indexes them """
+            of the catalog mixin classes) and (re)indexes them;  the data is
+            extracted on the current thread, while the batches of updates
+            are sent either on the same one or, if `senders` is given, by
+            as many separate threads in the meantime;  all objects are
+            found by traversal unless `walk` is "catalog", in which case
+            only the cataloged ones are taken from the catalog in path
+            order, which is faster for large sites;  a checkpoint is saved
+            after each batch, which allows to `resume` an interrupted run
+            after the last object sent to solr, using the same walk and
+            ignoring `skip` """
         manager = queryUtility(ISolrConnectionManager)
         proc = SolrIndexProcessor(manager)
         conn = manager.getConnection()
         zodb_conn = self.context._p_jar
         log = self.mklog()
         log('reindexing solr catalog...\n')
-        if skip:
-            log('skipping indexing of %d object(s)...\n' % skip)
         real = timer()          # real time
         lap = timer()           # real lap time (for intermediate commits)
         cpu = timer(clock)      # cpu time
@@ -112,44 +214,165 @@ class SolrMaintenanceView(BrowserView):
         updates = {}            # list to hold data to be updated
         flush = lambda: conn.flush()
         flush = notimeout(flush)
+        senders = int(senders)
+        resume = str(resume).lower() in ('1', 'true', 'yes', 'on')
+        queue = None
+        threads = []
+        lock = Lock()
+        stats = dict(start=time(), waited=0.0, batches=0, bytes=0,
+            elapsed=0.0, errors=0)
+        statefile = self.checkpointPath()
+        state = resume and loadState(statefile) or None
+        if state is None or state['done']:
+            if resume:
+                log('nothing to resume, starting from scratch...\n')
+            state = dict(path=None, count=0, processed=0, total=None,
+                elapsed=0.0, started=time(), done=False, walk=walk)
+            # replace the checkpoint of an earlier run right away
+            saveState(statefile, dict(state, updated=time()))
+        else:
+            log('resuming after %r (%d items processed)...\n' % (
+                state['path'], state['processed']))
+            walk = state['walk']
+            skip = 0        # the checkpoint is past any skipped objects
+        skip = int(skip)
+        if skip:
+            log('skipping indexing of %d object(s)...\n' % skip)
+        origin = '/'.join(self.context.getPhysicalPath())
+        current = state['path']     # path of the last object handled
+        run = time()
+        saved = {}                  # checkpoints of batches sent so far
+        sequence = [0, 0]           # numbers of the next batch queued/saved
+
+        def snapshot():
+            return dict(state, path=current, count=offset + count,
+                processed=state['processed'] + processed, updated=time(),
+                elapsed=state['elapsed'] + time() - run)
+
+        def record(number, checkpoint):
+            """ returns a function saving the given checkpoint once all
+                previous batches have been sent as well """
+            def done():
+                lock.acquire()
+                try:
+                    saved[number] = checkpoint
+                    while sequence[1] in saved:
+                        saveState(statefile, saved.pop(sequence[1]))
+                        sequence[1] += 1
+                finally:
+                    lock.release()
+            return done
+
+        if senders > 0:
+            # a bounded queue, so extraction blocks while all senders are
+            # busy instead of piling up batches in memory
+            queue = Queue(maxsize=senders)
+            config = queryUtility(ISolrConnectionConfig)
+            pool = manager.getPool()
+            conns = [manager.setupConnection(pool.checkout(), config)
+                for index in range(senders)]
+            for sender in conns:
+                sender.setTimeout(None)
+                thread = Thread(target=sendUpdates,
+                    args=(sender, queue, stats, lock))
+                thread.setDaemon(True)
+                thread.start()
+                threads.append(thread)
 
         def checkPoint():
+            target = queue is None and conn or RecordingConnection(conn)
             for boost_values, data in updates.values():
                 adder = data.pop('_solr_adder')
-                adder(conn, boost_values=boost_values, **data)
+                adder(target, boost_values=boost_values, **data)
             updates.clear()
             msg = 'intermediate commit (%d items processed, ' \
                   'last batch in %s)...\n' % (processed, lap.next())
             log(msg)
             logger.info(msg)
-            flush()
+            if queue is None:
+                failures = conn.failures
+                flush()
+                stats['errors'] += conn.failures - failures
+                if not stats['errors']:     # don't skip over failed ones
+                    saveState(statefile, snapshot())
+            else:
+                requests = list(conn.xmlbody)
+                del conn.xmlbody[:]
+                start = time()
+                queue.put((requests, target.posts,
+                    record(sequence[0], snapshot())))
+                sequence[0] += 1
+                stats['waited'] += time() - start
+                msg = '%.1f items/s, %d of %d batches queued, waited ' \
+                      '%.3fs for senders, %d batches sent so far...\n' % (
+                        processed / max(time() - stats['start'], 0.001),
+                        queue.qsize(), senders, stats['waited'],
+                        stats['batches'])
+                log(msg)
+                logger.info(msg)
             zodb_conn.cacheGC()
         cpi = checkpointIterator(checkPoint, batch)
         count = 0
-        for path, obj in findObjects(self.context):
-            if ICheckIndexable(obj)():
-                count += 1
-                if count <= skip:
-                    continue
-                data, missing = proc.getData(obj)
-                prepareData(data)
-                if not missing:
-                    value = data.get(key, None)
-                    if value is not None:
-                        log('indexing %r\n' % obj)
-                        pt = data.get('portal_type', 'default')
-                        adder = queryAdapter(obj, ISolrAddHandler, name=pt)
-                        if adder is None:
-                            adder = DefaultAdder(obj)
-                        data['_solr_adder'] = adder
-                        updates[value] = (boost_values(obj, data), data)
-                        processed += 1
-                        cpi.next()
-                else:
-                    log('missing data, skipping indexing of %r.\n' % obj)
-        checkPoint()
+        catalog = getToolByName(self.context, 'portal_catalog', None)
+        if walk == 'catalog' and catalog is not None:
+            if state['total'] is None:
+                state['total'] = countCatalogObjects(self.context, catalog)
+            objects = findCatalogObjects(self.context, catalog,
+                start=current)
+        else:
+            objects = findObjects(self.context, start=current)
+        offset = state['count']
+        try:
+            for path, obj in objects:
+                current = path and origin + '/' + path or origin
+                if ICheckIndexable(obj)():
+                    count += 1
+                    if count <= skip:
+                        continue
+                    data, missing = proc.getData(obj)
+                    prepareData(data)
+                    if not missing:
+                        value = data.get(key, None)
+                        if value is not None:
+                            log('indexing %r\n' % obj)
+                            pt = data.get('portal_type', 'default')
+                            adder = queryAdapter(obj, ISolrAddHandler,
+                                name=pt)
+                            if adder is None:
+                                adder = DefaultAdder(obj)
+                            data['_solr_adder'] = adder
+                            updates[value] = (boost_values(obj, data), data)
+                            processed += 1
+                            cpi.next()
+                    else:
+                        log('missing data, skipping indexing of %r.\n' % obj)
+            checkPoint()
+        finally:
+            for thread in threads:
+                queue.put(None)         # tell the senders to stop...
+            for thread in threads:
+                thread.join()           # ...once the queue is drained
+            if threads:
+                for sender in conns:
+                    pool.checkin(sender)
+        failures = conn.failures
         conn.commit()
-        log('solr index rebuilt.\n')
+        stats['errors'] += conn.failures - failures
+        if stats['errors']:
+            msg = '%d update(s) could not be sent, use `resume` to retry ' \
+                  'after the last checkpoint.\n' % stats['errors']
+            log(msg)
+            logger.error(msg)
+        else:
+            saveState(statefile, dict(snapshot(), done=True))
+            log('solr index rebuilt.\n')
+        if threads:
+            msg = 'sent %d batches (%d bytes, %d errors) using %d ' \
+                  'sender(s) busy for %.3fs, waited %.3fs for them.\n'
+            msg = msg % (stats['batches'], stats['bytes'], stats['errors'],
+                senders, stats['elapsed'], stats['waited'])
+            log(msg)
+            logger.info(msg)
         msg = 'processed %d items in %s (%s cpu time).'
         msg = msg % (processed, real.next(), cpu.next())
         log(msg)
@@ -163,7 +386,8 @@ class SolrMaintenanceView(BrowserView):
         manager = queryUtility(ISolrConnectionManager)
         proc = SolrIndexProcessor(manager)
         conn = manager.getConnection()
-        key = queryUtility(ISolrConnectionManager).getSchema().uniqueKey
+        schema = manager.getSchema()
+        key = schema.uniqueKey
         zodb_conn = self.context._p_jar
         catalog = getToolByName(self.context, 'portal_catalog')
         getIndex = catalog._catalog.getIndex
@@ -181,8 +405,8 @@ class SolrMaintenanceView(BrowserView):
         # avoid creating DateTime instances
         simple_unmarshallers = unmarshallers.copy()
         simple_unmarshallers['date'] = parse_date_as_datetime
-        flares = SolrResponse(response, simple_unmarshallers)
-        response.close()
+        flares = conn.codec.response(unmarshallers=simple_unmarshallers,
+            schema=schema)
         solr_results = {}
         solr_uids = set()
 
@@ -190,10 +414,11 @@ class SolrMaintenanceView(BrowserView):
             t_tup = value.utctimetuple()
             return ((((t_tup[0] * 12 + t_tup[1]) * 31 + t_tup[2])
                     * 24 + t_tup[3]) * 60 + t_tup[4])
-        for flare in flares:
+        for flare in flares.stream(response):   # parse without keeping flares
             uid = flare[key]
             solr_uids.add(uid)
             solr_results[uid] = _utc_convert(flare['modified'])
+        response.close()
         # get catalog status
         cat_results = {}
         cat_uids = set()
@@ -294,10 +519,13 @@ class SolrMaintenanceView(BrowserView):
         conn = manager.getConnection()
         log = self.mklog(use_std_log=True)
         log('cleaning up solr index...\n')
-        key = manager.getSchema().uniqueKey
+        schema = manager.getSchema()
+        key = schema.uniqueKey
+        parse = conn.codec.parse
 
         start = 0
-        resp = SolrResponse(conn.search(q='*:*', rows=batch, start=start))
+        resp = parse(conn.search(q='*:*', rows=batch, start=start),
+            schema=schema)
         res = resp.results()
         log('%s items in solr catalog\n' % resp.response.numFound)
         deleted = 0
@@ -322,8 +550,8 @@ class SolrMaintenanceView(BrowserView):
                         flare['path_string'])
                     conn.delete(flare[key])
                     deleted += 1
-                    realob_res = SolrResponse(conn.search(q='%s:%s' %
-                                              (key, uuid))).results()
+                    realob_res = parse(conn.search(q='%s:%s' %
+                                       (key, uuid)), schema=schema).results()
                     if len(realob_res) == 0:
                         log('no sane entry for last object, reindexing\n')
                         data, missing = proc.getData(ob)
@@ -337,7 +565,8 @@ class SolrMaintenanceView(BrowserView):
             log('handled batch of %d items, commiting\n' % len(res))
             conn.commit()
             start += batch
-            resp = SolrResponse(conn.search(q='*:*', rows=batch, start=start))
+            resp = parse(conn.search(q='*:*', rows=batch, start=start),
+                schema=schema)
             res = resp.results()
         msg = 'solr cleanup finished, %s item(s) removed, %s item(s) reindexed\n' % (deleted, reindexed)
         log(msg)
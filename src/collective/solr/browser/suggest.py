@@ -14,7 +14,7 @@ class SuggestView(BrowserView):
         if not term:
             return json.dumps(suggestions)
         manager = getUtility(ISolrConnectionManager)
-        connection = manager.getConnection()
+        connection = manager.getConnection(readonly=True)
 
         if connection is None:
             return json.dumps(suggestions)
@@ -62,7 +62,7 @@ class AutocompleteView(BrowserView):
         if not term:
             return json.dumps(suggestions)
         manager = getUtility(ISolrConnectionManager)
-        connection = manager.getConnection()
+        connection = manager.getConnection(readonly=True)
 
         if connection is None:
             return json.dumps(suggestions)
@@ -0,0 +1,146 @@
+from collections import OrderedDict
+from logging import getLogger
+from threading import Lock
+from time import time
+
+from collective.solr.utils import serializeQuery
+
+logger = getLogger('collective.solr.cache')
+
+
+class SearchCache(object):
+    """ an in-process LRU cache of raw search responses, bounded by the
+        number of entries as well as their total size in bytes;  entries
+        are tagged with the generation of the index they were fetched for,
+        which changes whenever a commit is made locally or the polled index
+        version changes, i.e. after commits made by other clients;  after
+        such a change outdated entries may still be served for `stale`
+        seconds while they're revalidated in the background """
+
+    def __init__(self, entries=1000, size=16777216, poll=10, stale=0):
+        self.entries = entries
+        self.size = size                # maximum total size in bytes
+        self.poll = poll                # interval for polling the version
+        self.stale = stale
+        self.data = OrderedDict()       # least recently used entries first
+        self.bytes = 0
+        self.generation = 0
+        self.changed = time()           # time the generation last changed
+        self.version = None             # last polled index version
+        self.polled = 0
+        self.polling = False
+        self.refreshing = set()         # keys being revalidated
+        self.lock = Lock()
+        self.stats = dict(hits=0, misses=0, stale=0, invalidations=0)
+
+    def key(self, codec, query, parameters):
+        """ returns the cache key for a search;  the security filter is
+            part of the query or filter queries, so results are only shared
+            between users with the same roles and groups;  searches using
+            date math like "NOW/MINUTE" are only shared within a minute """
+        key = '%s\n%s' % (codec, serializeQuery(query, parameters))
+        if 'NOW' in key:
+            key += '\n%d' % (time() // 60)
+        return key
+
+    def get(self, key):
+        """ returns a tuple of the cached response and a flag telling
+            whether it's still up-to-date or `None` if nothing is cached """
+        self.lock.acquire()
+        try:
+            item = self.data.pop(key, None)
+            if item is None:
+                self.stats['misses'] += 1
+                return None
+            generation, data = item
+            if generation == self.generation:
+                self.data[key] = item
+                self.stats['hits'] += 1
+                return data, True
+            if self.stale and time() < self.changed + self.stale:
+                self.data[key] = item
+                self.stats['stale'] += 1
+                return data, False
+            self.bytes -= len(data)
+            self.stats['misses'] += 1
+            return None
+        finally:
+            self.lock.release()
+
+    def set(self, key, data, generation):
+        """ store a response fetched for the given generation, unless the
+            generation has changed in the meantime """
+        if len(data) > self.size:
+            return
+        self.lock.acquire()
+        try:
+            if generation != self.generation:
+                return
+            item = self.data.pop(key, None)
+            if item is not None:
+                self.bytes -= len(item[1])
+            self.data[key] = generation, data
+            self.bytes += len(data)
+            while len(self.data) > self.entries or self.bytes > self.size:
+                old, item = self.data.popitem(last=False)
+                self.bytes -= len(item[1])
+        finally:
+            self.lock.release()
+
+    def claim(self, key):
+        """ returns `True` if the caller should revalidate a stale entry,
+            making sure only one thread does so at a time """
+        self.lock.acquire()
+        try:
+            if key in self.refreshing:
+                return False
+            self.refreshing.add(key)
+            return True
+        finally:
+            self.lock.release()
+
+    def invalidate(self):
+        """ start a new generation, e.g. after a commit """
+        self.lock.acquire()
+        try:
+            self.generation += 1
+            self.changed = time()
+            self.stats['invalidations'] += 1
+            if not self.stale:
+                self.data.clear()
+                self.bytes = 0
+        finally:
+            self.lock.release()
+        logger.debug('invalidated search cache, generation %d',
+            self.generation)
+
+    def due(self):
+        """ returns `True` if the index version should be polled, in which
+            case the poll is marked as being in progress """
+        self.lock.acquire()
+        try:
+            if not self.poll or self.polling:
+                return False
+            if time() < self.polled + self.poll:
+                return False
+            self.polling = True
+            self.polled = time()
+            return True
+        finally:
+            self.lock.release()
+
+    def update(self, version):
+        """ record the polled index version, invalidating the cache if it
+            has changed since the last poll """
+        if self.version is not None and version != self.version:
+            logger.info('index version has changed from %s to %s',
+                self.version, version)
+            self.invalidate()
+        self.version = version
+
+    def statistics(self):
+        """ returns the number of cached entries, their size in bytes as
+            well as the number of hits, misses, stale hits and
+            invalidations """
+        return dict(self.stats, entries=len(self.data), bytes=self.bytes,
+            generation=self.generation)
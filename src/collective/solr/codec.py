@@ -0,0 +1,254 @@
+from json import dumps, loads
+from xml.etree.cElementTree import fromstring
+from xml.sax.saxutils import escape
+
+from collective.solr.parser import SolrResponse, JSONResponse
+from collective.solr.parser import JavaBinResponse, unmarshallers
+from collective.solr.utils import translation_map
+
+
+def escapeVal(val):
+    """ convert and escape a value for use in an xml update request """
+    if isinstance(val, unicode):
+        val = val.encode('utf-8')
+    else:
+        val = str(val)
+    return escape(val.translate(translation_map))
+
+
+def escapeKey(key):
+    """ convert and escape a field name for use in an xml attribute """
+    if isinstance(key, unicode):
+        key = key.encode('utf-8')
+    else:
+        key = str(key)
+    key = key.replace("&", "&amp;")
+    key = key.replace('"', "&quot;")
+    return key
+
+
+def jsonVal(val):
+    """ convert a value for use in a json update request;  strings are
+        cleaned up the same way as for xml and passed on utf-8 encoded, all
+        non-basic types get converted to strings """
+    if isinstance(val, (bool, int, long, float)):
+        return val
+    if isinstance(val, unicode):
+        val = val.encode('utf-8')
+    else:
+        val = str(val)
+    return val.translate(translation_map)
+
+
+class XMLCodec(object):
+    """ the xml wire format, i.e. `/update` requests and `wt=xml` responses;
+        the update requests are kept as strings so that they can be queued
+        and later merged into batches (see `SolrConnection.batches`) """
+
+    name = 'xml'
+    updatePath = '/update'
+    contentType = 'text/xml; charset=utf-8'
+    params = {}                 # solr responds with xml by default
+
+    def add(self, fields, boost_values=None, commitWithin=None,
+            modifiers=None):
+        """ build an <add> request;  `modifiers` can map field names to
+            the kind of atomic update, e.g. "set", in which case only these
+            fields are changed in the existing document """
+        if modifiers is None:
+            modifiers = {}
+        if commitWithin:
+            lst = ['<add commitWithin="%s">' % str(commitWithin)]
+        else:
+            lst = ['<add>']
+        if boost_values is None:
+            boost_values = {}
+        if '' in boost_values:      # boost value for the entire document
+            lst.append('<doc boost="%s">' % boost_values[''])
+        else:
+            lst.append('<doc>')
+        for f, v in fields.items():
+            if f in modifiers:
+                if v is None or (isinstance(v, (list, tuple)) and not v):
+                    lst.append('<field name="%s" update="%s" null="true"/>'
+                        % (escapeKey(f), modifiers[f]))  # remove the field
+                    continue
+                tmpl = '<field name="%s" update="%s">%%s</field>' % (
+                    escapeKey(f), modifiers[f])
+            elif f in boost_values:
+                tmpl = '<field name="%s" boost="%s">%%s</field>' % (
+                    escapeKey(f), boost_values[f])
+            else:
+                tmpl = '<field name="%s">%%s</field>' % escapeKey(f)
+            if isinstance(v, (list, tuple)): # multi-valued
+                for value in v:
+                    lst.append(tmpl % escapeVal(value))
+            else:
+                lst.append(tmpl % escapeVal(v))
+        lst.append('</doc>')
+        lst.append('</add>')
+        return ''.join(lst)
+
+    def delete(self, id):
+        return '<delete><id>%s</id></delete>' % escapeVal(id)
+
+    def deleteByQuery(self, query):
+        return '<delete><query>%s</query></delete>' % escapeVal(query)
+
+    def commit(self, waitFlush=True, waitSearcher=True, optimize=False):
+        data = {'committype': optimize and 'optimize' or 'commit',
+                'nowait': not waitSearcher and ' waitSearcher="false"' or '',
+                'noflush': not waitFlush and not waitSearcher and \
+                    ' waitFlush="false"' or ''}
+        return '<%(committype)s%(noflush)s%(nowait)s/>' % data
+
+    def split(self, request):
+        """ split an <add> or <delete> request into its opening tag, body and
+            closing tag;  `None` is returned for all other requests """
+        for tag in ('add', 'delete'):
+            closing = '</%s>' % tag
+            if request.startswith('<' + tag) and request.endswith(closing):
+                head = request[:request.index('>') + 1]
+                if head == '<%s>' % tag or head.startswith('<%s ' % tag):
+                    return head, request[len(head):-len(closing)], closing
+        return None
+
+    def merge(self, requests):
+        """ merge <add> or <delete> requests sharing the same opening tag """
+        if len(requests) == 1:
+            return requests[0]
+        head, body, closing = self.split(requests[0])
+        bodies = [self.split(request)[1] for request in requests]
+        return head + ''.join(bodies) + closing
+
+    def idempotent(self, request):
+        """ check if the request can safely be sent again in case it
+            failed, i.e. anything but deletes by query and optimizing """
+        if request.startswith('<delete>') and '<query>' in request:
+            return False
+        return not request.startswith('<optimize')
+
+    def loads(self, data):
+        """ parse the (already decoded) response to an update request """
+        return fromstring(data)
+
+    def error(self, parsed):
+        """ return the reason for an old-style error response, i.e. one
+            with a http status of 200, but a non-zero solr status """
+        status = parsed.attrib.get('status', 0)
+        if status != 0:
+            return parsed.text or status
+
+    def parse(self, data, unmarshallers=unmarshallers, schema=None):
+        """ parse a search response into a `SolrResponse` """
+        return SolrResponse(data, unmarshallers=unmarshallers)
+
+    def response(self, unmarshallers=unmarshallers, schema=None):
+        """ return an empty response object, e.g. for streaming """
+        return SolrResponse(unmarshallers=unmarshallers)
+
+
+class JSONCodec(XMLCodec):
+    """ the json wire format, i.e. `/update/json` requests and `wt=json`
+        responses;  each queued update is a single json object, which
+        allows merging consecutive adds and deletes by concatenating their
+        members (solr accepts repeated keys in update requests) """
+
+    name = 'json'
+    updatePath = '/update/json'
+    contentType = 'application/json; charset=utf-8'
+    params = {'wt': 'json', 'json.nl': 'map'}
+
+    def dumps(self, command, data):
+        return dumps({command: data})
+
+    def add(self, fields, boost_values=None, commitWithin=None,
+            modifiers=None):
+        if boost_values is None:
+            boost_values = {}
+        if modifiers is None:
+            modifiers = {}
+        doc = {}
+        for f, v in fields.items():
+            if isinstance(v, (list, tuple)): # multi-valued
+                v = [jsonVal(value) for value in v]
+            elif v is not None or f not in modifiers:
+                v = jsonVal(v)
+            if f in modifiers:
+                v = {modifiers[f]: v}
+            elif f in boost_values:
+                v = {'value': v, 'boost': float(boost_values[f])}
+            doc[f] = v
+        data = {'doc': doc}
+        if '' in boost_values:      # boost value for the entire document
+            data['boost'] = float(boost_values[''])
+        if commitWithin:
+            data['commitWithin'] = int(commitWithin)
+        return self.dumps('add', data)
+
+    def delete(self, id):
+        return self.dumps('delete', {'id': jsonVal(id)})
+
+    def deleteByQuery(self, query):
+        return self.dumps('delete', {'query': jsonVal(query)})
+
+    def commit(self, waitFlush=True, waitSearcher=True, optimize=False):
+        # `waitFlush` is gone since solr 4 and is ignored here
+        committype = optimize and 'optimize' or 'commit'
+        return self.dumps(committype, {'waitSearcher': bool(waitSearcher)})
+
+    def split(self, request):
+        """ split an add or delete request into braces and its members;
+            `None` is returned for all other requests """
+        if request.startswith('{"add": ') or \
+                request.startswith('{"delete": '):
+            return '{', request[1:-1], '}'
+        return None
+
+    def merge(self, requests):
+        """ merge add and delete requests into one object """
+        if len(requests) == 1:
+            return requests[0]
+        bodies = [self.split(request)[1] for request in requests]
+        return '{' + ', '.join(bodies) + '}'
+
+    def idempotent(self, request):
+        return '"delete": {"query": ' not in request and \
+            not request.startswith('{"optimize": ')
+
+    def loads(self, data):
+        return loads(data)
+
+    def error(self, parsed):
+        error = parsed.get('error')
+        status = parsed.get('responseHeader', {}).get('status', 0)
+        if error or status != 0:
+            return (error or {}).get('msg', status)
+
+    def parse(self, data, unmarshallers=unmarshallers, schema=None):
+        return JSONResponse(data, unmarshallers=unmarshallers, schema=schema)
+
+    def response(self, unmarshallers=unmarshallers, schema=None):
+        return JSONResponse(unmarshallers=unmarshallers, schema=schema)
+
+
+class JavaBinCodec(XMLCodec):
+    """ xml updates combined with search results in solr's binary format,
+        i.e. `wt=javabin`, which is both smaller and quicker to decode """
+
+    name = 'javabin'
+    params = {'wt': 'javabin'}
+
+    def parse(self, data, unmarshallers=unmarshallers, schema=None):
+        return JavaBinResponse(data, unmarshallers=unmarshallers)
+
+    def response(self, unmarshallers=unmarshallers, schema=None):
+        return JavaBinResponse(unmarshallers=unmarshallers)
+
+
+# available wire formats, see `ISolrConnectionConfig.wire_format`
+formats = {
+    'xml': XMLCodec(),
+    'json': JSONCodec(),
+    'javabin': JavaBinCodec(),
+}
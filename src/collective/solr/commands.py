@@ -1,13 +1,17 @@
 from cPickle import dumps
 from cPickle import loads
 import datetime
+from hashlib import md5
 import logging
+from optparse import OptionParser
 import os
 import os.path
 from os import listdir
 from os.path import join
 from struct import pack, unpack
+from subprocess import Popen
 import sys
+from time import sleep, time
 
 from Acquisition import aq_base
 from Acquisition import aq_get
@@ -15,8 +19,14 @@ from Acquisition import aq_parent
 from BTrees.IIBTree import IISet
 from BTrees.IIBTree import IITreeSet
 from collective.solr.indexer import datehandler
+from collective.solr.indexer import SolrIndexProcessor
 from collective.solr.interfaces import ISolrConnectionManager
+from collective.solr.parser import parse_date_as_datetime
+from collective.solr.parser import unmarshallers
+from collective.solr.utils import loadState
+from collective.solr.utils import saveState
 from DateTime import DateTime
+from Products.CMFCore.utils import getToolByName
 from zope.component import queryUtility
 from zope.i18nmessageid import Message
 from zope.site.hooks import setHooks
@@ -64,3 +74,268 @@ def solr_clear_index(app, args):
     conn.deleteByQuery('[* TO *]')
     conn.commit(optimize=True)
     conn.close()
+
+
+def _options(command, args):
+    parser = OptionParser(usage='%s [options] [site]' % command)
+    parser.add_option('-p', '--partitions', type='int', default=4,
+        help='number of partitions, each run in its own process')
+    parser.add_option('--partition', type='int', default=None,
+        help='only process the given partition (used internally)')
+    parser.add_option('-b', '--batch', type='int', default=1000,
+        help='number of objects to index before sending them to solr')
+    parser.add_option('-r', '--resume', action='store_true', default=False,
+        help='continue after the last checkpoint of a previous run')
+    parser.add_option('-s', '--state', default=join('var', 'solr'),
+        help='directory for the checkpoint files of the partitions')
+    parser.add_option('-i', '--interval', type='int', default=10,
+        help='seconds between progress reports')
+    parser.add_option('--script', default=None,
+        help='zopectl script used to start the partitions')
+    return parser.parse_args(args)
+
+
+def _partition(uid, partitions):
+    """ returns the partition the given unique key belongs to;  md5 is used
+        as it's stable across processes and platforms """
+    if isinstance(uid, unicode):
+        uid = uid.encode('utf-8')
+    return unpack('>I', md5(uid).digest()[:4])[0] % partitions
+
+
+def _state_path(options, command, partition):
+    name = '%s-%d-of-%d' % (command, partition, options.partitions)
+    return join(options.state, name)
+
+
+def _minutes(value):
+    """ convert a datetime to minutes the same way `DateIndex` does """
+    t = value.utctimetuple()
+    return (((t[0] * 12 + t[1]) * 31 + t[2]) * 24 + t[3]) * 60 + t[4]
+
+
+def _work_path(options, command, partition):
+    return _state_path(options, command, partition) + '.work'
+
+
+def _run_partitions(command, options, args, work):
+    """ start a process for each partition and report their aggregated
+        progress until all of them have finished;  `work` is called to
+        return the unique keys to be indexed and deleted by each of the
+        partitions, unless a run with existing lists is resumed """
+    script = options.script
+    if script is None:
+        script = sys.argv[0]
+        if not os.path.isfile(script):
+            script = join('bin', 'instance')
+    if not os.path.isdir(options.state):
+        os.makedirs(options.state)
+    paths = [_state_path(options, command, partition)
+        for partition in range(options.partitions)]
+    works = [_work_path(options, command, partition)
+        for partition in range(options.partitions)]
+    if not options.resume:
+        for path in paths + works:
+            if os.path.exists(path):
+                os.unlink(path)     # start from scratch
+    if [path for path in works if not os.path.exists(path)]:
+        for path, (uids, delete) in zip(works, work()):
+            saveState(path, dict(uids=uids, delete=delete))
+    processes = []
+    for partition in range(options.partitions):
+        cmd = [script, command] + args + [
+            '--partitions', str(options.partitions),
+            '--partition', str(partition),
+            '--batch', str(options.batch),
+            '--state', options.state]
+        if options.resume:
+            cmd.append('--resume')
+        processes.append(Popen(cmd))
+    logger.info('started %d partitions of %s', len(processes), command)
+    start, baseline = time(), None
+    while True:
+        running = len([p for p in processes if p.poll() is None])
+        states = [state for state in map(loadState, paths) if state]
+        processed = sum([state['processed'] for state in states])
+        total = sum([state['total'] for state in states])
+        if baseline is None:
+            baseline = processed        # when resuming a previous run
+        rate = (processed - baseline) / max(time() - start, 1)
+        eta = rate and (total - processed) / rate or 0
+        logger.info('%s: %d of %d objects processed (%.1f/s, eta %ds), '
+            '%d of %d partitions running', command, processed, total, rate,
+            eta, running, len(processes))
+        if not running:
+            break
+        sleep(options.interval)
+    failed = [str(partition) for partition, process in enumerate(processes)
+        if process.returncode]
+    if failed:
+        logger.error('partition(s) %s of %s failed, use --resume to '
+            'continue', ', '.join(failed), command)
+        sys.exit(1)
+
+
+def _run_partition(site, command, options):
+    """ process the unique keys assigned to the given partition """
+    work = loadState(_work_path(options, command, options.partition))
+    if work is None:
+        logger.error('no unique keys found for partition %d of %s',
+            options.partition, command)
+        sys.exit(1)
+    _index_partition(site, command, options, work['uids'], work['delete'])
+
+
+def _index_partition(site, command, options, uids, delete=()):
+    """ index the objects with the given unique keys in order, writing a
+        checkpoint after each batch;  when resuming, the keys up to the
+        last checkpoint are skipped;  the partition is stopped as soon as
+        a batch couldn't be sent, so that it's reported as failed and a
+        resumed run starts again after the last batch solr accepted """
+    manager = queryUtility(ISolrConnectionManager)
+    manager.setTimeout(None, lock=True)
+    proc = SolrIndexProcessor(manager)
+    conn = manager.getConnection()
+    path = _state_path(options, command, options.partition)
+    state = options.resume and loadState(path) or None
+    if state is None:
+        state = dict(last=None, processed=0, started=time(), done=False)
+    elif state['last'] is not None:
+        uids = [uid for uid in uids if uid > state['last']]
+    state['total'] = state['processed'] + len(uids)
+    for uid in delete:          # deleting is idempotent, so just repeat it
+        conn.delete(id=uid)
+    catalog = getToolByName(site, 'portal_catalog')
+    index = catalog._catalog.getIndex(manager.getSchema().uniqueKey)._index
+    getpath = catalog._catalog.paths.get
+    zodb_conn = site._p_jar
+
+    def sent(send, *args, **kw):
+        # failures to send updates are only counted by the connection
+        failures = conn.failures
+        send(*args, **kw)
+        if conn.failures > failures:
+            manager.setTimeout(None, lock=False)
+            logger.error('%s: partition %d of %d failed to send updates, '
+                'use --resume to continue', command, options.partition,
+                options.partitions)
+            sys.exit(1)
+
+    def checkpoint(uid):
+        sent(conn.flush)
+        state.update(last=uid, updated=time())
+        saveState(path, state)
+        zodb_conn.cacheGC()
+    saveState(path, state)
+    for uid in uids:
+        rid = index.get(uid)
+        if isinstance(rid, IITreeSet):
+            rid = rid.keys()[0]
+        obj = rid is not None and site.unrestrictedTraverse(
+            getpath(rid, ''), None) or None
+        if obj is not None:
+            proc.index(obj)
+        state['processed'] += 1
+        if state['processed'] % options.batch == 0:
+            checkpoint(uid)
+    checkpoint(state['last'] if not uids else uids[-1])
+    sent(conn.commit, waitSearcher=False)
+    state['done'] = True
+    saveState(path, state)
+    manager.setTimeout(None, lock=False)
+    logger.info('%s: partition %d of %d done, %d objects processed',
+        command, options.partition, options.partitions, state['processed'])
+
+
+def _split(uids, partitions):
+    """ distribute the given unique keys over the partitions, keeping
+        them in order """
+    parts = [[] for partition in range(partitions)]
+    for uid in uids:
+        parts[_partition(uid, partitions)].append(uid)
+    return parts
+
+
+def _catalog_uids(site):
+    """ returns the unique keys found in the catalog, in order, along with
+        their record ids """
+    manager = queryUtility(ISolrConnectionManager)
+    catalog = getToolByName(site, 'portal_catalog')
+    index = catalog._catalog.getIndex(manager.getSchema().uniqueKey)._index
+    return index.items()
+
+
+def _solr_uids(site):
+    """ returns the unique keys found in solr mapped to the modification
+        dates of their documents in minutes """
+    manager = queryUtility(ISolrConnectionManager)
+    schema = manager.getSchema()
+    key = schema.uniqueKey
+    conn = manager.getConnection()
+    conn.setTimeout(None)
+    response = conn.search(q='%s:[* TO *]' % key, rows=1000000000,
+        fl='%s modified' % key)
+    simple_unmarshallers = unmarshallers.copy()
+    simple_unmarshallers['date'] = parse_date_as_datetime
+    flares = conn.codec.response(unmarshallers=simple_unmarshallers,
+        schema=schema)
+    indexed = {}
+    for flare in flares.stream(response):   # parse without keeping flares
+        indexed[flare[key]] = flare.get('modified') and \
+            _minutes(flare['modified'])
+    response.close()
+    return indexed
+
+
+def _compare(indexed, cataloged, modified):
+    """ returns the unique keys of cataloged objects that are missing in
+        solr or have been modified since they were indexed as well as the
+        keys only found in solr;  `indexed` maps the keys found in solr to
+        their modification dates, while `modified` returns the one of the
+        catalog record with the given id """
+    indexed = dict(indexed)
+    uids = []
+    for uid, rid in cataloged:
+        if isinstance(rid, IITreeSet):
+            rid = rid.keys()[0]
+        if uid not in indexed or indexed.pop(uid) != modified(rid):
+            uids.append(uid)
+    return uids, sorted(indexed)
+
+
+def solr_reindex(app, args):
+    """Reindexes all content of a Plone site in Solr using several processes,
+    each handling one partition of the unique keys found in the catalog.
+    This needs a ZEO setup, as the partitions run as separate ZEO clients.
+    A failed or killed run can be continued using `--resume`. You can
+    optionally specify the id of the Plone site as the first command line
+    argument.
+    """
+    options, args = _options('solr_reindex', args)
+    site = _get_site(app, args)
+    if options.partition is None:
+        def work():
+            uids = (uid for uid, rid in _catalog_uids(site))
+            return [(part, []) for part in _split(uids, options.partitions)]
+        return _run_partitions('solr_reindex', options, args, work)
+    _run_partition(site, 'solr_reindex', options)
+
+
+def solr_sync(app, args):
+    """Syncs the Solr index with the portal catalog using several processes,
+    like `solr_reindex`: objects missing from Solr or modified since they
+    were last indexed are reindexed, while records without a corresponding
+    catalog entry are removed from Solr.
+    """
+    options, args = _options('solr_sync', args)
+    site = _get_site(app, args)
+    if options.partition is None:
+        def work():
+            catalog = getToolByName(site, 'portal_catalog')
+            modified = catalog._catalog.getIndex('modified')._unindex.get
+            uids, delete = _compare(_solr_uids(site), _catalog_uids(site),
+                modified)
+            return zip(_split(uids, options.partitions),
+                _split(delete, options.partitions))
+        return _run_partitions('solr_sync', options, args, work)
+    _run_partition(site, 'solr_sync', options)
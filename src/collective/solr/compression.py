@@ -0,0 +1,62 @@
+from zlib import compressobj, decompressobj, error, DEFLATED, MAX_WBITS
+
+GZIP = 16 + MAX_WBITS       # `wbits` for gzip headers & trailers
+
+
+def gzip(data, level=6):
+    """ compress the given data using the gzip format """
+    compressor = compressobj(level, DEFLATED, GZIP)
+    return compressor.compress(data) + compressor.flush()
+
+
+class DecompressingResponse(object):
+    """ a wrapper for http responses with a `Content-Encoding` of `gzip` or
+        `deflate`, which are decompressed transparently while being read,
+        so that streaming parsers keep working;  all other attributes are
+        taken from the original response """
+
+    chunksize = 65536
+
+    def __init__(self, response, encoding):
+        self.response = response
+        if encoding == 'gzip':
+            self.decompressor = decompressobj(GZIP)
+        else:
+            self.decompressor = None    # `deflate` is zlib or raw, see below
+        self.buffer = ''
+
+    def __getattr__(self, name):
+        return getattr(self.response, name)
+
+    def decompress(self, data):
+        if self.decompressor is None:
+            # some servers send raw deflate data instead of the zlib format
+            # mandated by rfc 2616, so the header needs to be checked first
+            try:
+                self.decompressor = decompressobj()
+                return self.decompressor.decompress(data)
+            except error:
+                self.decompressor = decompressobj(-MAX_WBITS)
+        return self.decompressor.decompress(data)
+
+    def read(self, size=None):
+        while size is None or len(self.buffer) < size:
+            data = self.response.read(self.chunksize)
+            if not data:
+                self.buffer += self.decompressor and \
+                    self.decompressor.flush() or ''
+                break
+            self.buffer += self.decompress(data)
+        if size is None:
+            data, self.buffer = self.buffer, ''
+        else:
+            data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+
+def decompressing(response):
+    """ wrap the response for transparent decompression if needed """
+    encoding = (response.getheader('content-encoding') or '').lower()
+    if encoding in ('gzip', 'x-gzip', 'deflate'):
+        return DecompressingResponse(response, encoding.replace('x-', ''))
+    return response
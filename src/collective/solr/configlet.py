@@ -5,14 +5,14 @@ from Products.CMFDefault.formlib.schema import SchemaAdapterBase
 from Products.CMFPlone.interfaces import IPloneSiteRoot
 from plone.app.controlpanel.form import ControlPanelForm
 
-from collective.solr.interfaces import ISolrSchema, _
+from collective.solr.interfaces import ISolrSchema, ISolrQueueStatus, _
 from collective.solr.interfaces import ISolrConnectionConfig
 from collective.solr.interfaces import ISolrConnectionManager
 
 
 class SolrControlPanelAdapter(SchemaAdapterBase):
     adapts(IPloneSiteRoot)
-    implements(ISolrSchema)
+    implements(ISolrSchema, ISolrQueueStatus)
 
     def reset(self):
         manager = queryUtility(ISolrConnectionManager)
@@ -66,6 +66,40 @@ class SolrControlPanelAdapter(SchemaAdapterBase):
 
     base = property(getBase, setBase)
 
+    def getReplicas(self):
+        util = queryUtility(ISolrConnectionConfig)
+        return getattr(util, 'replicas', '')
+
+    def setReplicas(self, value):
+        util = queryUtility(ISolrConnectionConfig)
+        if util is not None:
+            util.replicas = value
+        self.reset()
+
+    replicas = property(getReplicas, setReplicas)
+
+    def getReplicaRetry(self):
+        util = queryUtility(ISolrConnectionConfig)
+        return getattr(util, 'replica_retry', '')
+
+    def setReplicaRetry(self, value):
+        util = queryUtility(ISolrConnectionConfig)
+        if util is not None:
+            util.replica_retry = value
+
+    replica_retry = property(getReplicaRetry, setReplicaRetry)
+
+    def getClientMode(self):
+        util = queryUtility(ISolrConnectionConfig)
+        return getattr(util, 'client_mode', '')
+
+    def setClientMode(self, value):
+        util = queryUtility(ISolrConnectionConfig)
+        if util is not None:
+            util.client_mode = value
+
+    client_mode = property(getClientMode, setClientMode)
+
     def getAsync(self):
         util = queryUtility(ISolrConnectionConfig)
         return getattr(util, 'async', '')
@@ -121,6 +155,39 @@ class SolrControlPanelAdapter(SchemaAdapterBase):
 
     search_timeout = property(getSearchTimeout, setSearchTimeout)
 
+    def getPoolSize(self):
+        util = queryUtility(ISolrConnectionConfig)
+        return getattr(util, 'pool_size', '')
+
+    def setPoolSize(self, value):
+        util = queryUtility(ISolrConnectionConfig)
+        if util is not None:
+            util.pool_size = value
+
+    pool_size = property(getPoolSize, setPoolSize)
+
+    def getPoolTimeout(self):
+        util = queryUtility(ISolrConnectionConfig)
+        return getattr(util, 'pool_timeout', '')
+
+    def setPoolTimeout(self, value):
+        util = queryUtility(ISolrConnectionConfig)
+        if util is not None:
+            util.pool_timeout = value
+
+    pool_timeout = property(getPoolTimeout, setPoolTimeout)
+
+    def getPoolMaxIdle(self):
+        util = queryUtility(ISolrConnectionConfig)
+        return getattr(util, 'pool_max_idle', '')
+
+    def setPoolMaxIdle(self, value):
+        util = queryUtility(ISolrConnectionConfig)
+        if util is not None:
+            util.pool_max_idle = value
+
+    pool_max_idle = property(getPoolMaxIdle, setPoolMaxIdle)
+
     def getMaxResults(self):
         util = queryUtility(ISolrConnectionConfig)
         return getattr(util, 'max_results', '')
@@ -200,6 +267,17 @@ class SolrControlPanelAdapter(SchemaAdapterBase):
 
     effective_steps = property(getEffectiveSteps, setEffectiveSteps)
 
+    def getEffectiveRounding(self):
+        util = queryUtility(ISolrConnectionConfig)
+        return getattr(util, 'effective_rounding', '')
+
+    def setEffectiveRounding(self, value):
+        util = queryUtility(ISolrConnectionConfig)
+        if util is not None:
+            util.effective_rounding = value
+
+    effective_rounding = property(getEffectiveRounding, setEffectiveRounding)
+
     def getExcludeUser(self):
         util = queryUtility(ISolrConnectionConfig)
         return getattr(util, 'exclude_user', '')
@@ -211,6 +289,18 @@ class SolrControlPanelAdapter(SchemaAdapterBase):
 
     exclude_user = property(getExcludeUser, setExcludeUser)
 
+    def getSplitSecurityFilter(self):
+        util = queryUtility(ISolrConnectionConfig)
+        return getattr(util, 'split_security_filter', '')
+
+    def setSplitSecurityFilter(self, value):
+        util = queryUtility(ISolrConnectionConfig)
+        if util is not None:
+            util.split_security_filter = value
+
+    split_security_filter = property(getSplitSecurityFilter,
+        setSplitSecurityFilter)
+
     def getHighlightFields(self):
         util = queryUtility(ISolrConnectionConfig)
         return getattr(util, 'highlight_fields', '')
@@ -280,10 +370,279 @@ class SolrControlPanelAdapter(SchemaAdapterBase):
     levenshtein_distance = property(
         getLevenshteinDistance, setLevenshteinDistance)
 
+    def getUpdateBatchSize(self):
+        util = queryUtility(ISolrConnectionConfig)
+        return getattr(util, 'update_batch_size', '')
+
+    def setUpdateBatchSize(self, value):
+        util = queryUtility(ISolrConnectionConfig)
+        if util is not None:
+            util.update_batch_size = value
+
+    update_batch_size = property(getUpdateBatchSize, setUpdateBatchSize)
+
+    def getUpdateBatchBytes(self):
+        util = queryUtility(ISolrConnectionConfig)
+        return getattr(util, 'update_batch_bytes', '')
+
+    def setUpdateBatchBytes(self, value):
+        util = queryUtility(ISolrConnectionConfig)
+        if util is not None:
+            util.update_batch_bytes = value
+
+    update_batch_bytes = property(getUpdateBatchBytes, setUpdateBatchBytes)
+
+    def getWireFormat(self):
+        util = queryUtility(ISolrConnectionConfig)
+        return getattr(util, 'wire_format', '')
+
+    def setWireFormat(self, value):
+        util = queryUtility(ISolrConnectionConfig)
+        if util is not None:
+            util.wire_format = value
+
+    wire_format = property(getWireFormat, setWireFormat)
+
+    def getCompressThreshold(self):
+        util = queryUtility(ISolrConnectionConfig)
+        return getattr(util, 'compress_threshold', '')
+
+    def setCompressThreshold(self, value):
+        util = queryUtility(ISolrConnectionConfig)
+        if util is not None:
+            util.compress_threshold = value
+
+    compress_threshold = property(getCompressThreshold, setCompressThreshold)
+
+    def getCompressLevel(self):
+        util = queryUtility(ISolrConnectionConfig)
+        return getattr(util, 'compress_level', '')
+
+    def setCompressLevel(self, value):
+        util = queryUtility(ISolrConnectionConfig)
+        if util is not None:
+            util.compress_level = value
+
+    compress_level = property(getCompressLevel, setCompressLevel)
+
+    def getCompressResponses(self):
+        util = queryUtility(ISolrConnectionConfig)
+        return getattr(util, 'compress_responses', '')
+
+    def setCompressResponses(self, value):
+        util = queryUtility(ISolrConnectionConfig)
+        if util is not None:
+            util.compress_responses = value
+
+    compress_responses = property(getCompressResponses, setCompressResponses)
+
+    def getSchemaTtl(self):
+        util = queryUtility(ISolrConnectionConfig)
+        return getattr(util, 'schema_ttl', '')
+
+    def setSchemaTtl(self, value):
+        util = queryUtility(ISolrConnectionConfig)
+        if util is not None:
+            util.schema_ttl = value
+
+    schema_ttl = property(getSchemaTtl, setSchemaTtl)
+
+    def getSchemaRetry(self):
+        util = queryUtility(ISolrConnectionConfig)
+        return getattr(util, 'schema_retry', '')
+
+    def setSchemaRetry(self, value):
+        util = queryUtility(ISolrConnectionConfig)
+        if util is not None:
+            util.schema_retry = value
+
+    schema_retry = property(getSchemaRetry, setSchemaRetry)
+
+    def getSchemaCachePath(self):
+        util = queryUtility(ISolrConnectionConfig)
+        return getattr(util, 'schema_cache_path', '')
+
+    def setSchemaCachePath(self, value):
+        util = queryUtility(ISolrConnectionConfig)
+        if util is not None:
+            util.schema_cache_path = value
+
+    schema_cache_path = property(getSchemaCachePath, setSchemaCachePath)
+
+    def getQueueUpdates(self):
+        util = queryUtility(ISolrConnectionConfig)
+        return getattr(util, 'queue_updates', '')
+
+    def setQueueUpdates(self, value):
+        util = queryUtility(ISolrConnectionConfig)
+        if util is not None:
+            util.queue_updates = value
+
+    queue_updates = property(getQueueUpdates, setQueueUpdates)
+
+    def getQueueRetry(self):
+        util = queryUtility(ISolrConnectionConfig)
+        return getattr(util, 'queue_retry', '')
+
+    def setQueueRetry(self, value):
+        util = queryUtility(ISolrConnectionConfig)
+        if util is not None:
+            util.queue_retry = value
+
+    queue_retry = property(getQueueRetry, setQueueRetry)
+
+    def getQueueStatistics(self):
+        manager = queryUtility(ISolrConnectionManager)
+        if manager is not None:
+            return manager.getQueueStatistics()
+        return {}
+
+    def getQueueLength(self):
+        return self.getQueueStatistics().get('length')
+
+    queue_length = property(getQueueLength)
+
+    def getQueueLag(self):
+        return self.getQueueStatistics().get('lag')
+
+    queue_lag = property(getQueueLag)
+
+    def getBreakerThreshold(self):
+        util = queryUtility(ISolrConnectionConfig)
+        return getattr(util, 'breaker_threshold', '')
+
+    def setBreakerThreshold(self, value):
+        util = queryUtility(ISolrConnectionConfig)
+        if util is not None:
+            util.breaker_threshold = value
+
+    breaker_threshold = property(getBreakerThreshold, setBreakerThreshold)
+
+    def getBreakerCooldown(self):
+        util = queryUtility(ISolrConnectionConfig)
+        return getattr(util, 'breaker_cooldown', '')
+
+    def setBreakerCooldown(self, value):
+        util = queryUtility(ISolrConnectionConfig)
+        if util is not None:
+            util.breaker_cooldown = value
+
+    breaker_cooldown = property(getBreakerCooldown, setBreakerCooldown)
+
+    def getBreakerSlowThreshold(self):
+        util = queryUtility(ISolrConnectionConfig)
+        return getattr(util, 'breaker_slow_threshold', '')
+
+    def setBreakerSlowThreshold(self, value):
+        util = queryUtility(ISolrConnectionConfig)
+        if util is not None:
+            util.breaker_slow_threshold = value
+
+    breaker_slow_threshold = property(getBreakerSlowThreshold, setBreakerSlowThreshold)
+
+    def getRetryAttempts(self):
+        util = queryUtility(ISolrConnectionConfig)
+        return getattr(util, 'retry_attempts', '')
+
+    def setRetryAttempts(self, value):
+        util = queryUtility(ISolrConnectionConfig)
+        if util is not None:
+            util.retry_attempts = value
+
+    retry_attempts = property(getRetryAttempts, setRetryAttempts)
+
+    def getRetryDelay(self):
+        util = queryUtility(ISolrConnectionConfig)
+        return getattr(util, 'retry_delay', '')
+
+    def setRetryDelay(self, value):
+        util = queryUtility(ISolrConnectionConfig)
+        if util is not None:
+            util.retry_delay = value
+
+    retry_delay = property(getRetryDelay, setRetryDelay)
+
+    def getRetryDeadline(self):
+        util = queryUtility(ISolrConnectionConfig)
+        return getattr(util, 'retry_deadline', '')
+
+    def setRetryDeadline(self, value):
+        util = queryUtility(ISolrConnectionConfig)
+        if util is not None:
+            util.retry_deadline = value
+
+    retry_deadline = property(getRetryDeadline, setRetryDeadline)
+
+    def getSearchCacheEntries(self):
+        util = queryUtility(ISolrConnectionConfig)
+        return getattr(util, 'search_cache_entries', '')
+
+    def setSearchCacheEntries(self, value):
+        util = queryUtility(ISolrConnectionConfig)
+        if util is not None:
+            util.search_cache_entries = value
+
+    search_cache_entries = property(getSearchCacheEntries, setSearchCacheEntries)
+
+    def getSearchCacheSize(self):
+        util = queryUtility(ISolrConnectionConfig)
+        return getattr(util, 'search_cache_size', '')
+
+    def setSearchCacheSize(self, value):
+        util = queryUtility(ISolrConnectionConfig)
+        if util is not None:
+            util.search_cache_size = value
+
+    search_cache_size = property(getSearchCacheSize, setSearchCacheSize)
+
+    def getSearchCachePoll(self):
+        util = queryUtility(ISolrConnectionConfig)
+        return getattr(util, 'search_cache_poll', '')
+
+    def setSearchCachePoll(self, value):
+        util = queryUtility(ISolrConnectionConfig)
+        if util is not None:
+            util.search_cache_poll = value
+
+    search_cache_poll = property(getSearchCachePoll, setSearchCachePoll)
+
+    def getSearchCacheStale(self):
+        util = queryUtility(ISolrConnectionConfig)
+        return getattr(util, 'search_cache_stale', '')
+
+    def setSearchCacheStale(self, value):
+        util = queryUtility(ISolrConnectionConfig)
+        if util is not None:
+            util.search_cache_stale = value
+
+    search_cache_stale = property(getSearchCacheStale, setSearchCacheStale)
+
+    def getTermsThreshold(self):
+        util = queryUtility(ISolrConnectionConfig)
+        return getattr(util, 'terms_threshold', '')
+
+    def setTermsThreshold(self, value):
+        util = queryUtility(ISolrConnectionConfig)
+        if util is not None:
+            util.terms_threshold = value
+
+    terms_threshold = property(getTermsThreshold, setTermsThreshold)
+
+    def getAtomicUpdates(self):
+        util = queryUtility(ISolrConnectionConfig)
+        return getattr(util, 'atomic_updates', '')
+
+    def setAtomicUpdates(self, value):
+        util = queryUtility(ISolrConnectionConfig)
+        if util is not None:
+            util.atomic_updates = value
+
+    atomic_updates = property(getAtomicUpdates, setAtomicUpdates)
+
 
 class SolrControlPanel(ControlPanelForm):
 
-    form_fields = FormFields(ISolrSchema)
+    form_fields = FormFields(ISolrSchema, ISolrQueueStatus)
 
     label = _('label_solr_settings', default='Solr settings')
     description = _(
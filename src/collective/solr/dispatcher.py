@@ -11,6 +11,7 @@ from collective.solr.interfaces import ISolrConnectionConfig
 from collective.solr.interfaces import ISearchDispatcher
 from collective.solr.interfaces import ISearch
 from collective.solr.interfaces import IFlare
+from collective.solr.exceptions import SolrUnavailableException
 from collective.solr.utils import isActive, prepareData
 from collective.solr.utils import padResults
 from collective.solr.mangler import mangleQuery
@@ -43,7 +44,7 @@ class SearchDispatcher(object):
         if isActive():
             try:
                 return solrSearchResults(request, **keywords)
-            except FallBackException:
+            except (FallBackException, SolrUnavailableException):
                 pass
         if getattr(aq_base(self.context), '_cs_old_searchResults', None):
             return self.context._cs_old_searchResults(request, **keywords)
@@ -71,6 +72,8 @@ def solrSearchResults(request=None, **keywords):
         # if request is a dict, we need the real request in order to
         # be able to adapt to plone flares
         request = getattr(getSite(), 'REQUEST', args)
+    if getattr(config, 'client_mode', None) == 'index-only':
+        raise FallBackException     # this client doesn't search using solr
     if 'path' in args and 'navtree' in args['path']:
         raise FallBackException     # we can't handle navtree queries yet
     use_solr = args.get('use_solr', False)  # A special key to force Solr
@@ -99,9 +102,10 @@ def solrSearchResults(request=None, **keywords):
         adapter = queryMultiAdapter((flare, request), IFlare)
         return adapter is not None and adapter or flare
     results = response.results()
+    stored = getattr(schema, 'stored', frozenset())
     for idx, flare in enumerate(results):
         flare = wrap(flare)
-        for missing in set(schema.stored).difference(flare):
+        for missing in stored.difference(flare):
             flare[missing] = MV
         results[idx] = wrap(flare)
     padResults(results, **params)           # pad the batch
@@ -4,6 +4,9 @@ from Products.CMFDefault.permissions import ModifyPortalContent
 from Products.CMFCore.CMFCatalogAware import CMFCatalogAware
 from Products.Archetypes.CatalogMultiplex import CatalogMultiplex
 
+from collective.solr.manager import SolrConnectionManager
+
+
 def reorderedEvent(event):
     parent = event.object
     mtool = getToolByName(parent, 'portal_membership')
@@ -12,3 +15,12 @@ def reorderedEvent(event):
             if isinstance(child, CatalogMultiplex) or \
                     isinstance(child, CMFCatalogAware):
                 child.reindexObject(['getObjPositionInParent'])
+
+
+def releaseConnection(event):
+    """ return the solr connection checked out while publishing a request
+        to the pool;  the local manager utility might not be reachable at
+        this point anymore, but connection pools are process-wide anyway """
+    manager = SolrConnectionManager()
+    manager.closeConnection()
+    manager.pinToMaster(False)
@@ -1,4 +1,16 @@
+from socket import timeout
 
 
 class SolrInactiveException(Exception):
     """ an exception indicating the solr integration is not activated """
+
+
+class SolrUnavailableException(Exception):
+    """ an exception indicating that searches aren't sent to solr for the
+        time being, because it has been failing repeatedly """
+
+
+class SolrConnectionPoolExhausted(timeout):
+    """ an exception indicating that no pooled connection became available
+        within the configured time;  it's a `socket.timeout` so that it
+        gets handled like any other network problem """
@@ -29,11 +29,17 @@ class SolrConfigXMLAdapter(XMLAdapterBase):
         self.context.host = ''
         self.context.port = 0
         self.context.base = ''
+        self.context.replicas = []
+        self.context.replica_retry = 30
+        self.context.client_mode = 'read-write'
         self.context.async = False
         self.context.auto_commit = True
         self.context.commit_within = 0
         self.context.index_timeout = 0
         self.context.search_timeout = 0
+        self.context.pool_size = 10
+        self.context.pool_timeout = 10
+        self.context.pool_max_idle = 60
         self.context.max_results = 0
         self.context.required = []
         self.context.search_pattern = ''
@@ -41,12 +47,38 @@ class SolrConfigXMLAdapter(XMLAdapterBase):
         self.context.filter_queries = []
         self.context.slow_query_threshold = 0
         self.context.effective_steps = 1
+        self.context.effective_rounding = 'none'
         self.context.exclude_user = False
+        self.context.split_security_filter = False
         self.context.highlight_fields = []
         self.context.highlight_formatter_pre = ''
         self.context.highlight_formatter_post = ''
         self.context.highlight_fragsize = 0
         self.context.levenshtein_distance = 0
+        self.context.update_batch_size = 1000
+        self.context.update_batch_bytes = 4194304
+        self.context.wire_format = 'xml'
+        self.context.compress_threshold = 0
+        self.context.compress_level = 6
+        self.context.compress_responses = False
+        self.context.schema_ttl = 3600
+        self.context.schema_retry = 30
+        self.context.schema_cache_path = ''
+        self.context.queue_updates = False
+        self.context.queue_retry = 10
+        self.context.breaker_threshold = 5
+        self.context.breaker_cooldown = 30
+        self.context.breaker_slow_threshold = 0
+        self.context.retry_attempts = 2
+        self.context.retry_delay = 0.1
+        self.context.retry_deadline = 30.0
+        self.context.search_cache_entries = 0
+        self.context.search_cache_size = 16777216
+        self.context.search_cache_poll = 10
+        self.context.search_cache_stale = 0
+        self.context.terms_threshold = 0
+        self.context.atomic_updates = False
+
 
     def _initProperties(self, node):
         elems = node.getElementsByTagName('connection')
@@ -64,6 +96,17 @@ class SolrConfigXMLAdapter(XMLAdapterBase):
                     self.context.host = str(child.getAttribute('value'))
                 elif child.nodeName == 'base':
                     self.context.base = str(child.getAttribute('value'))
+                elif child.nodeName == 'replicas':
+                    value = []
+                    for elem in child.getElementsByTagName('endpoint'):
+                        value.append(elem.getAttribute('value'))
+                    self.context.replicas = tuple(map(str, value))
+                elif child.nodeName == 'replica-retry':
+                    value = int(str(child.getAttribute('value')))
+                    self.context.replica_retry = value
+                elif child.nodeName == 'client-mode':
+                    value = str(child.getAttribute('value'))
+                    self.context.client_mode = value
         elems = node.getElementsByTagName('settings')
         if elems:
             assert len(elems) == 1
@@ -84,6 +127,15 @@ class SolrConfigXMLAdapter(XMLAdapterBase):
                 elif child.nodeName == 'search-timeout':
                     value = float(str(child.getAttribute('value')))
                     self.context.search_timeout = value
+                elif child.nodeName == 'pool-size':
+                    value = int(str(child.getAttribute('value')))
+                    self.context.pool_size = value
+                elif child.nodeName == 'pool-timeout':
+                    value = float(str(child.getAttribute('value')))
+                    self.context.pool_timeout = value
+                elif child.nodeName == 'pool-max-idle':
+                    value = int(str(child.getAttribute('value')))
+                    self.context.pool_max_idle = value
                 elif child.nodeName == 'max-results':
                     value = int(str(child.getAttribute('value')))
                     self.context.max_results = value
@@ -111,9 +163,16 @@ class SolrConfigXMLAdapter(XMLAdapterBase):
                 elif child.nodeName == 'effective-steps':
                     value = int(str(child.getAttribute('value')))
                     self.context.effective_steps = value
+                elif child.nodeName == 'effective-rounding':
+                    value = str(child.getAttribute('value'))
+                    self.context.effective_rounding = value
                 elif child.nodeName == 'exclude-user':
                     value = str(child.getAttribute('value'))
                     self.context.exclude_user = self._convertToBoolean(value)
+                elif child.nodeName == 'split-security-filter':
+                    value = str(child.getAttribute('value'))
+                    self.context.split_security_filter = \
+                        self._convertToBoolean(value)
                 elif child.nodeName == 'highlight_fields':
                     value = []
                     for elem in child.getElementsByTagName('parameter'):
@@ -136,6 +195,76 @@ class SolrConfigXMLAdapter(XMLAdapterBase):
                 elif child.nodeName == 'levenshtein_distance':
                     value = float(str(child.getAttribute('value')))
                     self.context.levenshtein_distance = value
+                elif child.nodeName == 'update-batch-size':
+                    value = int(str(child.getAttribute('value')))
+                    self.context.update_batch_size = value
+                elif child.nodeName == 'update-batch-bytes':
+                    value = int(str(child.getAttribute('value')))
+                    self.context.update_batch_bytes = value
+                elif child.nodeName == 'wire-format':
+                    value = str(child.getAttribute('value'))
+                    self.context.wire_format = value
+                elif child.nodeName == 'compress-threshold':
+                    value = int(str(child.getAttribute('value')))
+                    self.context.compress_threshold = value
+                elif child.nodeName == 'compress-level':
+                    value = int(str(child.getAttribute('value')))
+                    self.context.compress_level = value
+                elif child.nodeName == 'compress-responses':
+                    value = str(child.getAttribute('value'))
+                    self.context.compress_responses = \
+                        self._convertToBoolean(value)
+                elif child.nodeName == 'schema-ttl':
+                    value = int(str(child.getAttribute('value')))
+                    self.context.schema_ttl = value
+                elif child.nodeName == 'schema-retry':
+                    value = int(str(child.getAttribute('value')))
+                    self.context.schema_retry = value
+                elif child.nodeName == 'schema-cache-path':
+                    value = str(child.getAttribute('value'))
+                    self.context.schema_cache_path = value
+                elif child.nodeName == 'queue-updates':
+                    value = str(child.getAttribute('value'))
+                    self.context.queue_updates = self._convertToBoolean(value)
+                elif child.nodeName == 'queue-retry':
+                    value = int(str(child.getAttribute('value')))
+                    self.context.queue_retry = value
+                elif child.nodeName == 'breaker-threshold':
+                    value = int(str(child.getAttribute('value')))
+                    self.context.breaker_threshold = value
+                elif child.nodeName == 'breaker-cooldown':
+                    value = int(str(child.getAttribute('value')))
+                    self.context.breaker_cooldown = value
+                elif child.nodeName == 'breaker-slow-threshold':
+                    value = int(str(child.getAttribute('value')))
+                    self.context.breaker_slow_threshold = value
+                elif child.nodeName == 'retry-attempts':
+                    value = int(str(child.getAttribute('value')))
+                    self.context.retry_attempts = value
+                elif child.nodeName == 'retry-delay':
+                    value = float(str(child.getAttribute('value')))
+                    self.context.retry_delay = value
+                elif child.nodeName == 'retry-deadline':
+                    value = float(str(child.getAttribute('value')))
+                    self.context.retry_deadline = value
+                elif child.nodeName == 'search-cache-entries':
+                    value = int(str(child.getAttribute('value')))
+                    self.context.search_cache_entries = value
+                elif child.nodeName == 'search-cache-size':
+                    value = int(str(child.getAttribute('value')))
+                    self.context.search_cache_size = value
+                elif child.nodeName == 'search-cache-poll':
+                    value = int(str(child.getAttribute('value')))
+                    self.context.search_cache_poll = value
+                elif child.nodeName == 'search-cache-stale':
+                    value = int(str(child.getAttribute('value')))
+                    self.context.search_cache_stale = value
+                elif child.nodeName == 'terms-threshold':
+                    value = int(str(child.getAttribute('value')))
+                    self.context.terms_threshold = value
+                elif child.nodeName == 'atomic-updates':
+                    value = str(child.getAttribute('value'))
+                    self.context.atomic_updates = self._convertToBoolean(value)
 
     def _createNode(self, name, value):
         node = self._doc.createElement(name)
@@ -152,6 +281,13 @@ class SolrConfigXMLAdapter(XMLAdapterBase):
         conn.appendChild(create('host', self.context.host))
         conn.appendChild(create('port', str(self.context.port)))
         conn.appendChild(create('base', self.context.base))
+        replicas = self._doc.createElement('replicas')
+        conn.appendChild(replicas)
+        for endpoint in self.context.replicas:
+            replicas.appendChild(create('endpoint', endpoint))
+        conn.appendChild(create('replica-retry',
+            str(self.context.replica_retry)))
+        conn.appendChild(create('client-mode', self.context.client_mode))
         settings = self._doc.createElement('settings')
         node.appendChild(settings)
         append = settings.appendChild
@@ -160,6 +296,9 @@ class SolrConfigXMLAdapter(XMLAdapterBase):
         append(create('commit-within', str(self.context.commit_within)))
         append(create('index-timeout', str(self.context.index_timeout)))
         append(create('search-timeout', str(self.context.search_timeout)))
+        append(create('pool-size', str(self.context.pool_size)))
+        append(create('pool-timeout', str(self.context.pool_timeout)))
+        append(create('pool-max-idle', str(self.context.pool_max_idle)))
         append(create('max-results', str(self.context.max_results)))
         required = self._doc.createElement('required-query-parameters')
         append(required)
@@ -183,7 +322,10 @@ class SolrConfigXMLAdapter(XMLAdapterBase):
         append(create('slow-query-threshold',
             str(self.context.slow_query_threshold)))
         append(create('effective-steps', str(self.context.effective_steps)))
+        append(create('effective-rounding', self.context.effective_rounding))
         append(create('exclude-user', str(bool(self.context.exclude_user))))
+        append(create('split-security-filter',
+            str(bool(self.context.split_security_filter))))
         highlight_fields = self._doc.createElement('highlight_fields')
         append(highlight_fields)
         for name in self.context.highlight_fields:
@@ -197,6 +339,42 @@ class SolrConfigXMLAdapter(XMLAdapterBase):
         append(field_list)
         append(create('levenshtein_distance',
             str(self.context.levenshtein_distance)))
+        append(create('update-batch-size',
+            str(self.context.update_batch_size)))
+        append(create('update-batch-bytes',
+            str(self.context.update_batch_bytes)))
+        append(create('wire-format', str(self.context.wire_format)))
+        append(create('compress-threshold',
+            str(self.context.compress_threshold)))
+        append(create('compress-level', str(self.context.compress_level)))
+        append(create('compress-responses',
+            str(bool(self.context.compress_responses))))
+        append(create('schema-ttl', str(self.context.schema_ttl)))
+        append(create('schema-retry', str(self.context.schema_retry)))
+        append(create('schema-cache-path',
+            str(self.context.schema_cache_path)))
+        append(create('queue-updates',
+            str(bool(self.context.queue_updates))))
+        append(create('queue-retry', str(self.context.queue_retry)))
+        append(create('breaker-threshold',
+            str(self.context.breaker_threshold)))
+        append(create('breaker-cooldown', str(self.context.breaker_cooldown)))
+        append(create('breaker-slow-threshold',
+            str(self.context.breaker_slow_threshold)))
+        append(create('retry-attempts', str(self.context.retry_attempts)))
+        append(create('retry-delay', str(self.context.retry_delay)))
+        append(create('retry-deadline', str(self.context.retry_deadline)))
+        append(create('search-cache-entries',
+            str(self.context.search_cache_entries)))
+        append(create('search-cache-size',
+            str(self.context.search_cache_size)))
+        append(create('search-cache-poll',
+            str(self.context.search_cache_poll)))
+        append(create('search-cache-stale',
+            str(self.context.search_cache_stale)))
+        append(create('terms-threshold', str(self.context.terms_threshold)))
+        append(create('atomic-updates',
+            str(bool(self.context.atomic_updates))))
         for name in self.context.field_list:
             param = self._doc.createElement('parameter')
             param.setAttribute('name', name)
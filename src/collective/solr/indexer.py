@@ -1,7 +1,8 @@
 import os
 
+from collections import OrderedDict
 from logging import getLogger
-from Acquisition import aq_get
+from Acquisition import aq_base, aq_get
 from DateTime import DateTime
 from datetime import date, datetime
 from zope.component import getUtility, queryUtility, queryMultiAdapter
@@ -9,6 +10,7 @@ from zope.component import queryAdapter, adapts
 from zope.interface import implements
 from zope.interface import Interface
 from zope.contenttype import guess_content_type
+from transaction import get as getTransaction
 from ZODB.POSException import ConflictError
 from Products.CMFCore.utils import getToolByName
 from Products.CMFCore.CMFCatalogAware import CMFCatalogAware
@@ -23,6 +25,8 @@ from collective.solr.interfaces import ISolrIndexQueueProcessor
 from collective.solr.interfaces import ICheckIndexable
 from collective.solr.interfaces import ISolrAddHandler
 from collective.solr.solr import SolrException
+from collective.solr.exceptions import SolrConnectionPoolExhausted
+from collective.solr.local import getLocal, setLocal
 from collective.solr.utils import prepareData
 from socket import error
 from urllib import urlencode, quote
@@ -79,6 +83,32 @@ handlers = {
     'solr.IntField': inthandler,
 }
 
+
+def joiner(separator):
+    """ return a converter joining multiple values for single-valued
+        fields """
+    def join(value):
+        if isinstance(value, (list, tuple)):
+            return separator.join(value)
+        return value
+    return join
+
+
+def getConverters(schema):
+    """ return a list of `(field, converter)` pairs for all fields of the
+        given schema, using the registered `handlers`;  the list is compiled
+        once and kept along with the schema until it's prepared again """
+    converters = schema.converters
+    if converters is None:
+        converters = []
+        for field in schema.fields:
+            converter = handlers.get(field.class_, None)
+            if converter is None and not field.multiValued:
+                converter = joiner(getattr(field, 'separator', ' '))
+            converters.append((field, converter))
+        schema.converters = converters
+    return converters
+
 class DefaultAdder(object):
     """
     """
@@ -143,13 +173,15 @@ class SolrIndexProcessor(object):
         self.manager = manager
 
     def index(self, obj, attributes=None):
+        if self.defer('index', obj, attributes):
+            return
         conn = self.getConnection()
         if conn is not None and ICheckIndexable(obj)():
-            # unfortunately with current versions of solr we need to provide
-            # data for _all_ fields during an <add> -- partial updates aren't
-            # supported (see https://issues.apache.org/jira/browse/SOLR-139)
-            # however, the reindexing can be skipped if none of the given
-            # attributes match existing solr indexes...
+            # solr only supports partial updates (see SOLR-139) if it can
+            # rebuild the rest of the document from its stored fields, so
+            # usually data for _all_ fields needs to be provided -- however,
+            # the reindexing can be skipped if none of the given attributes
+            # match existing solr indexes...
             schema = self.manager.getSchema()
             if schema is None:
                 msg = 'unable to fetch schema, skipping indexing of %r'
@@ -164,6 +196,8 @@ class SolrIndexProcessor(object):
                 attributes = set(schema.keys()).intersection(attributes)
                 if not attributes:
                     return
+                if self.updatable(obj, schema, attributes):
+                    return self.update(conn, obj, schema, attributes)
             data, missing = self.getData(obj)
             if not data:
                 return          # don't index with no data...
@@ -185,10 +219,68 @@ class SolrIndexProcessor(object):
                 except (SolrException, error):
                     logger.exception('exception during indexing %r', obj)
 
+    def updatable(self, obj, schema, attributes):
+        """ check if the given attributes can be sent as an atomic update
+            instead of re-adding the whole document """
+        config = queryUtility(ISolrConnectionConfig)
+        if not getattr(config, 'atomic_updates', False):
+            return False
+        if not schema.updatable or schema.uniqueKey in attributes:
+            return False
+        # updates of missing documents are replaced by adding all of it
+        # when they're rejected, which isn't possible in the background
+        if self.manager.getSpool() is not None:
+            return False
+        # boost values and custom add handlers need the full document
+        if aq_get(obj, 'solr_boost_index_values', None) is not None:
+            return False
+        pt = getattr(aq_base(obj), 'portal_type', None)
+        if pt and queryAdapter(obj, ISolrAddHandler, name=pt) is not None:
+            return False
+        return True
+
+    def update(self, conn, obj, schema, attributes):
+        """ send only the given attributes using "set" operations;  the
+            document needs to exist in the index already """
+        uniqueKey = schema.uniqueKey
+        fields = set([field.name for field in schema.fields])
+        attributes = fields.intersection(attributes)
+        data, missing = self.getData(obj, attributes | set([uniqueKey]))
+        prepareData(data)
+        if data.get(uniqueKey, None) is None:
+            return
+        if set(schema.requiredFields).intersection(attributes) - set(data):
+            return          # like for an <add> required fields can't be empty
+        modifiers = {}
+        for name in attributes:
+            data.setdefault(name, None)     # no value, remove the field
+            modifiers[name] = 'set'
+        data['_version_'] = 1       # fail instead of adding a partial document
+        config = getUtility(ISolrConnectionConfig)
+        if config.commit_within:
+            data['commitWithin'] = config.commit_within
+
+        def fallback():
+            # the document is missing in the index, so add all of it
+            data, missing = self.getData(obj)
+            prepareData(data)
+            if data.get(uniqueKey, None) is None or missing:
+                return None
+            data.pop('links', '')       # see `DefaultAdder`
+            return conn.codec.add(data, None, config.commit_within or None)
+
+        try:
+            logger.debug('updating %r (%r)', obj, data)
+            conn.update(modifiers, fallback, **data)
+        except (SolrException, error):
+            logger.exception('exception during updating %r', obj)
+
     def reindex(self, obj, attributes=None):
         self.index(obj, attributes)
 
     def unindex(self, obj):
+        if self.defer('unindex', obj):
+            return
         conn = self.getConnection()
         if conn is not None:
             schema = self.manager.getSchema()
@@ -226,17 +318,53 @@ class SolrIndexProcessor(object):
                 logger.exception('exception during unindexing %r', obj)
 
     def begin(self):
-        pass
+        # operations are collected until the transaction is about to be
+        # committed, so that every document is only extracted once (see
+        # `defer`);  the hook is registered after the one of the indexing
+        # queue, so it runs once the queue has been processed, but still
+        # before the vote, i.e. not while the commit lock is being held
+        if getLocal('pending') is None:
+            setLocal('pending', OrderedDict())
+            getTransaction().addBeforeCommitHook(self.extract)
+
+    def extract(self):
+        """ turn the pending operations into update requests, which are
+            only sent when the transaction is committed """
+        pending = getLocal('pending')
+        setLocal('pending', None)
+        if not pending:
+            return
+        conn = self.getConnection()
+        if conn is None:
+            return
+        for key, (op, obj, attributes) in pending.items():
+            if op == 'index':
+                self.index(obj, attributes)
+                continue
+            # the object may have been deleted or moved in the meantime,
+            # so its key is taken from the time it was unindexed
+            try:
+                logger.debug('unindexing %r (%r)', obj, key)
+                conn.delete(id=key)
+            except (SolrException, error):
+                logger.exception('exception during unindexing %r', obj)
 
     def commit(self, wait=None):
+        self.extract()      # in case there was no transaction to hook into
         conn = self.getConnection()
         if conn is not None:
+            if conn.xmlbody:
+                # subsequent searches should see the changes, so they have
+                # to go to the master until the request ends
+                self.manager.pinToMaster()
             config = getUtility(ISolrConnectionConfig)
             if not isinstance(wait, bool):
                 wait = not config.async
             try:
                 logger.debug('committing')
-                if not config.auto_commit or config.commit_within:
+                if self.enqueue(conn, config):
+                    pass        # the updates will be sent in the background
+                elif not config.auto_commit or config.commit_within:
                     # If we have commitWithin enabled, we never want to do
                     # explicit commits. Even though only add's support this
                     # and we might wait a bit longer on delete's this way
@@ -245,9 +373,11 @@ class SolrIndexProcessor(object):
                     conn.commit(waitFlush=wait, waitSearcher=wait)
             except (SolrException, error):
                 logger.exception('exception during commit')
+            self.manager.invalidateCache()
             self.manager.closeConnection()
 
     def abort(self):
+        setLocal('pending', None)
         conn = self.getConnection()
         if conn is not None:
             logger.debug('aborting')
@@ -256,12 +386,78 @@ class SolrIndexProcessor(object):
 
     # helper methods
 
-    def getConnection(self):
+    def defer(self, op, obj, attributes=None):
+        """ record an operation to be carried out when the transaction is
+            committed, keyed by the unique key of the document:  a later
+            operation replaces an earlier one, so that an "unindex" cancels
+            a pending "index", while the attributes of partial reindexes are
+            merged;  returns `False` if the operation needs to be carried out
+            right away, i.e. outside of a transaction or without a key """
+        pending = getLocal('pending')
+        if pending is None or not self.writable():
+            return False
+        if op == 'index' and not ICheckIndexable(obj)():
+            return False
+        schema = self.manager.getSchema()
+        uniqueKey = schema and schema.get('uniqueKey', None)
+        if uniqueKey is None:
+            return False
+        if op == 'unindex' and hasattr(obj, 'context'):
+            data, missing = self.getData(obj.context, attributes=[uniqueKey])
+        else:
+            data, missing = self.getData(obj, attributes=[uniqueKey])
+        prepareData(data)
+        key = data.get(uniqueKey, None)
+        if key is None:
+            return False
+        previous = pending.pop(key, None)
+        if op == 'index' and previous is not None:
+            if previous[0] == 'index' and previous[2] is not None and \
+                    attributes is not None:
+                attributes = previous[2].union(attributes)
+            else:
+                attributes = None   # (re-)add the whole document
+        if attributes is not None:
+            attributes = frozenset(attributes)
+        pending[key] = op, obj, attributes
+        logger.debug('deferring %s of %r (%r)', op, obj, attributes)
+        return True
+
+    def enqueue(self, conn, config):
+        """ hand the pending updates over to the index queue, if one is
+            configured;  returns `False` if they need to be sent directly """
+        spool = self.manager.getSpool()
+        if spool is None:
+            return False
+        if conn.xmlbody:
+            requests = list(conn.xmlbody)
+            if config.auto_commit and not config.commit_within:
+                requests.append(conn.codec.commit(waitSearcher=False))
+            try:
+                spool.put(conn.codec.name, requests)
+            except (IOError, OSError):
+                logger.exception('unable to queue updates, sending them now')
+                return False
+            del conn.xmlbody[:]
+        return True
+
+    def writable(self):
+        """ check if updates are to be sent to solr at all, without
+            checking out a connection already """
         if self.manager is None:
             self.manager = queryUtility(ISolrConnectionManager)
-        if self.manager is not None:
-            self.manager.setIndexTimeout()
-            return self.manager.getConnection()
+        config = queryUtility(ISolrConnectionConfig)
+        if getattr(config, 'client_mode', None) == 'search-only':
+            return False            # this client doesn't send updates
+        return self.manager is not None and getattr(config, 'active', False)
+
+    def getConnection(self):
+        if self.writable():
+            try:
+                self.manager.setIndexTimeout()
+                return self.manager.getConnection()
+            except SolrConnectionPoolExhausted:
+                logger.exception('unable to get a connection')
 
     def wrapObject(self, obj):
         """ wrap object with an "IndexableObjectWrapper` (for Plone < 3.3) or
@@ -290,11 +486,14 @@ class SolrIndexProcessor(object):
         schema = self.manager.getSchema()
         if schema is None:
             return {}, ()
-        if attributes is None:
-            attributes = schema.keys()
+        if attributes is not None:
+            attributes = set(attributes)
         obj = self.wrapObject(obj)
         data, marker = {}, []
-        for name in attributes:
+        for field, converter in getConverters(schema):
+            name = field.name
+            if attributes is not None and name not in attributes:
+                continue
             try:
                 value = getattr(obj, name)
                 if callable(value):
@@ -307,16 +506,11 @@ class SolrIndexProcessor(object):
                 logger.exception('Error occured while getting data for '
                     'indexing!')
                 continue
-            field = schema[name]
-            handler = handlers.get(field.class_, None)
-            if handler is not None:
+            if converter is not None:
                 try:
-                    value = handler(value)
+                    value = converter(value)
                 except AttributeError:
                     continue
-            elif isinstance(value, (list, tuple)) and not field.multiValued:
-                separator = getattr(field, 'separator', ' ')
-                value = separator.join(value)
             if isinstance(value, str):
                 value = unicode(value, 'utf-8', 'ignore').encode('utf-8')
             data[name] = value
@@ -1,6 +1,6 @@
 from collective.indexing.interfaces import IIndexQueueProcessor
 from zope.interface import Interface
-from zope.schema import Bool, Text, TextLine, Int, Float, List
+from zope.schema import Bool, Text, TextLine, Int, Float, List, Choice
 from zope.schema.interfaces import IVocabularyFactory
 
 from collective.solr import SolrMessageFactory as _
@@ -41,6 +41,46 @@ class ISolrSchema(Interface):
         )
     )
 
+    replicas = List(
+        title=_('label_replicas', default=u'Replicas'),
+        description=_(
+            'help_replicas',
+            default=u'Solr instances replicating the above one, which are '
+                    u'used for searching, while updates are always sent '
+                    u'to the above "master" instance. Specify one replica '
+                    u'per line in the form "host:port/base". Search '
+                    u'requests are balanced by the least number of '
+                    u'outstanding requests.'
+        ),
+        value_type=TextLine(),
+        default=[],
+        required=False
+    )
+
+    replica_retry = Int(
+        title=_('label_replica_retry', default=u'Replica retry interval'),
+        default=30,
+        description=_(
+            'help_replica_retry',
+            default=u'Number of seconds after which a replica, which has '
+                    u'been taken out of service due to errors, is checked '
+                    u'again.'
+        )
+    )
+
+    client_mode = Choice(
+        title=_('label_client_mode', default=u'Client mode'),
+        values=('read-write', 'index-only', 'search-only'),
+        default='read-write',
+        description=_(
+            'help_client_mode',
+            default=u'Dedicated Zope clients can be restricted to only '
+                    u'send index updates ("index-only"), in which case '
+                    u'searches fall back to the portal catalog, or to only '
+                    u'use Solr for searching ("search-only").'
+        )
+    )
+
     async = Bool(
         title=_('label_async', default=u'Asynchronous indexing'),
         default=False,
@@ -79,6 +119,105 @@ class ISolrSchema(Interface):
         )
     )
 
+    queue_updates = Bool(
+        title=_('label_queue_updates', default=u'Queue index operations'),
+        default=False,
+        description=_(
+            'help_queue_updates',
+            default=u'Check to queue index operations. The updates of each '
+                    u'committed transaction are then stored in the '
+                    u'"solr-queue" directory of each Zope instance (i.e. its '
+                    u'clienthome) and sent to Solr in batches by a '
+                    u'background worker, so that content changes no longer '
+                    u'wait for Solr.'
+        )
+    )
+
+    queue_retry = Int(
+        title=_('label_queue_retry', default=u'Index queue retry delay'),
+        default=10,
+        description=_(
+            'help_queue_retry',
+            default=u'Number of seconds after which the background worker '
+                    u'retries sending queued updates after a failure. The '
+                    u'delay is doubled after each consecutive failure, up to '
+                    u'ten times this value.'
+        )
+    )
+
+    update_batch_size = Int(
+        title=_('label_update_batch_size', default=u'Update batch size'),
+        default=1000,
+        description=_(
+            'help_update_batch_size',
+            default=u'Maximum number of documents sent to Solr in a single '
+                    u'update request. Consecutive add and delete operations '
+                    u'are merged into batches of up to this size.'
+        )
+    )
+
+    update_batch_bytes = Int(
+        title=_('label_update_batch_bytes', default=u'Update batch bytes'),
+        default=4194304,
+        description=_(
+            'help_update_batch_bytes',
+            default=u'Maximum size in bytes of a single update request sent '
+                    u'to Solr. Larger batches are split into several '
+                    u'requests.'
+        )
+    )
+
+    wire_format = Choice(
+        title=_('label_wire_format', default=u'Wire format'),
+        values=('xml', 'json', 'javabin'),
+        default='xml',
+        description=_(
+            'help_wire_format',
+            default=u'Specify the format used to exchange data with Solr, '
+                    u'i.e. for sending index updates as well as receiving '
+                    u'search results. The binary "javabin" format is only '
+                    u'used for search results, while updates are sent as '
+                    u'XML. Please note that both the JSON and the binary '
+                    u'format require Solr 3.1 or later.'
+        )
+    )
+
+    compress_threshold = Int(
+        title=_('label_compress_threshold', default=u'Compression threshold'),
+        default=0,
+        description=_(
+            'help_compress_threshold',
+            default=u'Update requests larger than the given number of bytes '
+                    u'are sent gzip-compressed, which saves bandwidth e.g. '
+                    u'for full reindexes over slow links. Please note that '
+                    u'Solr (or the servlet container in front of it) needs to '
+                    u'be set up to accept compressed requests. Leave at 0 to '
+                    u'disable compression of requests.'
+        )
+    )
+
+    compress_level = Int(
+        title=_('label_compress_level', default=u'Compression level'),
+        default=6,
+        description=_(
+            'help_compress_level',
+            default=u'The gzip compression level used for update requests, '
+                    u'ranging from 1 (fastest) to 9 (best compression).'
+        )
+    )
+
+    compress_responses = Bool(
+        title=_('label_compress_responses', default=u'Compressed responses'),
+        default=False,
+        description=_(
+            'help_compress_responses',
+            default=u'Check this to ask Solr for gzip- or deflate-compressed '
+                    u'responses, which are decompressed transparently. This '
+                    u'requires compression to be enabled in the servlet '
+                    u'container.'
+        )
+    )
+
     index_timeout = Float(
         title=_('label_index_timeout',
                 default=u'Index timeout'),
@@ -99,6 +238,193 @@ class ISolrSchema(Interface):
         )
     )
 
+    retry_attempts = Int(
+        title=_('label_retry_attempts', default=u'Maximum attempts'),
+        default=2,
+        description=_(
+            'help_retry_attempts',
+            default=u'Maximum number of times a request is sent to Solr after '
+                    u'network errors or a "503 Service Unavailable" response. '
+                    u'Only requests that can safely be repeated are retried, '
+                    u'i.e. searches, adds and deletes by id, but not deletes '
+                    u'by query or optimizing.'
+        )
+    )
+
+    retry_delay = Float(
+        title=_('label_retry_delay', default=u'Retry delay'),
+        default=0.1,
+        description=_(
+            'help_retry_delay',
+            default=u'Number of seconds to wait before retrying a failed '
+                    u'request. The delay is doubled for each further attempt '
+                    u'and randomized by up to half its value to avoid all '
+                    u'clients reconnecting at once.'
+        )
+    )
+
+    retry_deadline = Float(
+        title=_('label_retry_deadline', default=u'Retry deadline'),
+        default=30.0,
+        description=_(
+            'help_retry_deadline',
+            default=u'Maximum number of seconds spent on retrying a request, '
+                    u'after which it is given up. Set to 0 to only limit the '
+                    u'number of attempts.'
+        )
+    )
+
+    breaker_threshold = Int(
+        title=_('label_breaker_threshold',
+                default=u'Circuit breaker threshold'),
+        default=5,
+        description=_(
+            'help_breaker_threshold',
+            default=u'Number of consecutive failed or slow searches after '
+                    u'which Solr is considered unavailable, so that searches '
+                    u'fall back to the portal catalog right away for a while. '
+                    u'Set to 0 to disable.'
+        )
+    )
+
+    breaker_cooldown = Int(
+        title=_('label_breaker_cooldown',
+                default=u'Circuit breaker cool-down'),
+        default=30,
+        description=_(
+            'help_breaker_cooldown',
+            default=u'Number of seconds searches fall back to the portal '
+                    u'catalog after Solr has been considered unavailable, '
+                    u'before a single search is sent to Solr again to check '
+                    u'if it has recovered.'
+        )
+    )
+
+    breaker_slow_threshold = Int(
+        title=_('label_breaker_slow_threshold',
+                default=u'Circuit breaker slow threshold'),
+        default=0,
+        description=_(
+            'help_breaker_slow_threshold',
+            default=u'Response time in milliseconds above which a search '
+                    u'counts as failed for the circuit breaker. Set to 0 to '
+                    u'only count errors.'
+        )
+    )
+
+    search_cache_entries = Int(
+        title=_('label_search_cache_entries', default=u'Search cache entries'),
+        default=0,
+        description=_(
+            'help_search_cache_entries',
+            default=u'The maximum number of search responses kept in an '
+                    u'in-process cache, which is shared by all threads and '
+                    u'invalidated by commits. Set to 0 to disable the cache.'
+        )
+    )
+
+    search_cache_size = Int(
+        title=_('label_search_cache_size', default=u'Search cache size'),
+        default=16777216,
+        description=_(
+            'help_search_cache_size',
+            default=u'The maximum total size of the cached search responses '
+                    u'in bytes.'
+        )
+    )
+
+    search_cache_poll = Int(
+        title=_('label_search_cache_poll',
+                default=u'Index version poll interval'),
+        default=10,
+        description=_(
+            'help_search_cache_poll',
+            default=u'Interval in seconds for checking the version of the '
+                    u'index, so that commits made by other clients invalidate '
+                    u'the search cache as well. Set to 0 to disable polling.'
+        )
+    )
+
+    search_cache_stale = Int(
+        title=_('label_search_cache_stale', default=u'Stale search results'),
+        default=0,
+        description=_(
+            'help_search_cache_stale',
+            default=u'Number of seconds after an invalidation during which '
+                    u'outdated search responses are still served while they '
+                    u'are refreshed in the background. Set to 0 to always '
+                    u'wait for fresh results.'
+        )
+    )
+
+    pool_size = Int(
+        title=_('label_pool_size', default=u'Connection pool size'),
+        default=10,
+        description=_(
+            'help_pool_size',
+            default=u'Maximum number of persistent connections to the Solr '
+                    u'server, which are shared by all threads of the Zope '
+                    u'instance.'
+        )
+    )
+
+    pool_timeout = Float(
+        title=_('label_pool_timeout', default=u'Connection pool timeout'),
+        default=10.0,
+        description=_(
+            'help_pool_timeout',
+            default=u'Number of seconds to wait for a free connection when '
+                    u'all pooled connections are in use. Set to "0" to wait '
+                    u'indefinitely.'
+        )
+    )
+
+    pool_max_idle = Int(
+        title=_('label_pool_max_idle', default=u'Maximum idle time'),
+        default=60,
+        description=_(
+            'help_pool_max_idle',
+            default=u'Number of seconds after which unused connections are '
+                    u'closed. Set to "0" to keep them open.'
+        )
+    )
+
+    schema_ttl = Int(
+        title=_('label_schema_ttl', default=u'Schema refresh interval'),
+        default=3600,
+        description=_(
+            'help_schema_ttl',
+            default=u'Number of seconds the Solr schema is cached for. '
+                    u'Afterwards it is fetched again in the background, while '
+                    u'the cached copy continues to be used. Set to "0" to '
+                    u'never refresh the schema.'
+        )
+    )
+
+    schema_retry = Int(
+        title=_('label_schema_retry', default=u'Schema retry interval'),
+        default=30,
+        description=_(
+            'help_schema_retry',
+            default=u'Number of seconds to wait before trying to fetch the '
+                    u'Solr schema again after a failed attempt.'
+        )
+    )
+
+    schema_cache_path = TextLine(
+        title=_('label_schema_cache_path', default=u'Schema cache file'),
+        default=u'',
+        required=False,
+        description=_(
+            'help_schema_cache_path',
+            default=u'Path of a file used to keep a copy of the Solr schema, '
+                    u'so that it is available right after a restart even when '
+                    u'Solr cannot be reached. The host, port and base of the '
+                    u'Solr server get appended to the file name. '
+                    u'Leave empty to disable.'
+        )
+    )
+
     max_results = Int(
         title=_('label_max_results',
                 default=u'Maximum search results'),
@@ -165,6 +491,35 @@ class ISolrSchema(Interface):
         required=False
     )
 
+    terms_threshold = Int(
+        title=_('label_terms_threshold', default=u'Terms query threshold'),
+        default=0,
+        description=_(
+            'help_terms_threshold',
+            default=u'Lists of more values than this, which are searched in a '
+                    u'string field, are sent as a separate filter query using '
+                    u'the "terms" query parser, which is much faster than a '
+                    u'long boolean query and not subject to '
+                    u'"maxBooleanClauses". This requires Solr 4.10 or later. '
+                    u'Set to 0 to disable.'
+        )
+    )
+
+    atomic_updates = Bool(
+        title=_('label_atomic_updates', default=u'Atomic updates'),
+        default=False,
+        description=_(
+            'help_atomic_updates',
+            default=u'Check this to only send the changed fields to Solr when '
+                    u'just some of the indexes of an object are reindexed, '
+                    u'e.g. its position or workflow state. This needs a Solr '
+                    u'schema with a "_version_" field, where all fields '
+                    u'except for the targets of copy fields are stored; '
+                    u'otherwise, or when updates are queued, the full '
+                    u'document is sent.'
+        )
+    )
+
     slow_query_threshold = Int(
         title=_('label_slow_query_threshold',
                 default=u'Slow query threshold'),
@@ -186,6 +541,21 @@ class ISolrSchema(Interface):
                     u'Using 900 seconds (15 minutes) means the effective '
                     u'date sent to Solr changes every 15 minutes.'))
 
+    effective_rounding = Choice(
+        title=_('label_effective_rounding',
+                default=u'Effective date rounding'),
+        values=('none', 'minute', 'hour', 'day'),
+        default='none',
+        description=_(
+            'help_effective_rounding',
+            default=u'Select a unit to query the effective and expiration '
+                    u'dates relative to the current time using Solr date '
+                    u'math, e.g. "NOW/MINUTE". These dates are then sent as '
+                    u'a separate filter query, which doesn\'t change until '
+                    u'the next minute, hour or day and can be cached by '
+                    u'Solr. "none" sends the actual date, as adjusted by '
+                    u'the steps configured above.'))
+
     exclude_user = Bool(
         title=_('label_exclude_user',
                 default=u'Exclude user from allowedRolesAndUsers'),
@@ -198,6 +568,20 @@ class ISolrSchema(Interface):
         default=False
     )
 
+    split_security_filter = Bool(
+        title=_('label_split_security_filter',
+                default=u'Split security filter'),
+        description=_(
+            'help_split_security_filter',
+            default=u'Check this to send allowedRolesAndUsers as a separate '
+                    u'filter query, where the role and group tokens, which '
+                    u'are shared by many users, are cached by Solr, while '
+                    u'the user specific token is not. This requires Solr '
+                    u'5.4 or later. The index must not be part of the '
+                    u'filter queries configured above.'),
+        default=False
+    )
+
     highlight_fields = List(
         title=_(u'Highlighting fields'),
         description=_(
@@ -256,30 +640,117 @@ class ISolrSchema(Interface):
     )
 
 
+class ISolrQueueStatus(Interface):
+    """ read-only status of the index queue shown in the control panel """
+
+    queue_length = Int(
+        title=_('label_queue_length', default=u'Queued transactions'),
+        description=_(
+            'help_queue_length',
+            default=u'Number of committed transactions whose updates are '
+                    u'still waiting in the index queue.'
+        ),
+        required=False,
+        readonly=True
+    )
+
+    queue_lag = Int(
+        title=_('label_queue_lag', default=u'Index queue lag'),
+        description=_(
+            'help_queue_lag',
+            default=u'Number of seconds the oldest queued transaction has '
+                    u'been waiting to be sent to Solr.'
+        ),
+        required=False,
+        readonly=True
+    )
+
+
 class ISolrConnectionConfig(ISolrSchema):
     """ utility to hold the connection configuration for the solr server """
 
 
 class ISolrConnectionManager(Interface):
-    """ a thread-local connection manager for solr """
+    """ a connection manager for solr handing out pooled connections,
+        which stay checked out by a thread until they're closed """
 
     def setHost(active=False, host='localhost', port=8983, base='/solr'):
         """ set connection parameters """
 
     def closeConnection(clearSchema=False):
-        """ close the current connection, if any """
-
-    def getConnection():
-        """ returns an existing connection or opens one """
+        """ return the current connection, if any, to the pool and
+            optionally drop the cached schema """
+
+    def getConnection(readonly=False):
+        """ returns the connection checked out by the current thread or
+            takes one from the pool, possibly opening a new one;  for
+            `readonly` connections a replica is picked if configured """
+
+    def pinToMaster(pin=True):
+        """ make the current thread read from the master, e.g. to see
+            its own updates, until the pin is removed again;  this is
+            done automatically after sending updates """
+
+    def failover(connection):
+        """ take the replica used by the given connection out of service
+            and release the connection;  returns `False` for connections
+            to the master """
+
+    def getPoolStatistics():
+        """ returns a dictionary with usage statistics of the connection
+            pool, i.e. the number of created, reused, evicted or dropped
+            connections as well as the number of waits and timeouts """
+
+    def getRetryStatistics():
+        """ returns a dictionary with the number of retried requests as
+            well as failed ones that weren't retried because they're not
+            idempotent (`skipped`), because the maximum number of attempts
+            was reached (`exhausted`) or due to the deadline (`expired`) """
+
+    def getBreaker():
+        """ returns the circuit breaker guarding searches or `None` if
+            it has been disabled """
+
+    def getBreakerStatistics():
+        """ returns a dictionary with the state of the circuit breaker
+            (`closed`, `open` or `half-open`) as well as the number of
+            times it tripped, searches it rejected, failures and slow
+            responses """
+
+    def getSearchCache():
+        """ returns the cache for search responses or `None` if it has
+            been disabled """
+
+    def getCacheStatistics():
+        """ returns a dictionary with the number and total size of the
+            cached search responses as well as the number of hits, misses,
+            stale hits and invalidations """
+
+    def invalidateCache():
+        """ start a new generation of the search cache, so that results
+            cached before aren't used anymore, e.g. after a commit;  the
+            responses memoized for the current request are dropped, too """
+
+    def getSpool():
+        """ returns the queue of index operations to be sent to solr in
+            the background or `None` if no queue directory is configured """
+
+    def getQueueStatistics():
+        """ returns a dictionary with the number of transactions waiting
+            in the index queue (`length`), the age of the oldest one in
+            seconds (`lag`) as well as the number of sent requests and
+            failed attempts to send them """
 
     def getSchema():
         """ returns the currently used schema or fetches it.
-            If the schema cannot be fetched None is returned. """
+            If the schema cannot be fetched None is returned.
+            The schema is cached process-wide and refreshed in the
+            background once it has expired. """
 
-    def setTimeout(timeout, lock=object()):
+    def setTimeout(timeout, lock=object(), readonly=False):
         """ set the timeout on the current (or to be opened) connection
             to the given value and optionally lock it until explicitly
-            freed again """
+            freed again or the connection is returned to the pool """
 
     def setIndexTimeout():
         """ set the timeout on the current (or to be opened) connection
@@ -314,6 +785,13 @@ class ISearch(Interface):
     def __call__(query, **parameters):
         """ convenience alias for `search` """
 
+    def searchMany(searches, timeout=None):
+        """ perform several searches at the same time, each given as a
+            tuple of query and parameters, and return their responses in
+            the same order;  searches that failed or didn't complete within
+            `timeout` seconds (or the configured search timeout) result
+            in `None` """
+
     def buildQuery(default=None, **args):
         """ helper to build a query for simple use-cases; the query is
             returned as a dictionary which might be string-joined or
@@ -342,9 +820,17 @@ class ISolrMaintenanceView(Interface):
     def clear():
         """ clear all data from solr, i.e. delete all indexed objects """
 
-    def reindex(batch=1000, skip=0):
+    def reindex(batch=1000, skip=0, senders=0, walk='tree', resume=False):
         """ find all contentish objects (meaning all objects derived from one
-            of the catalog mixin classes) and (re)indexes them """
+            of the catalog mixin classes) and (re)indexes them;  the updates
+            are sent by `senders` threads, if given, while the data is
+            extracted;  the objects are either found by traversing the site
+            or, if `walk` is "catalog", only the cataloged ones are taken
+            from the catalog;  an interrupted run can be continued from its
+            last checkpoint using `resume` """
+
+    def progress():
+        """ report the progress of the current or last reindex run """
 
     def sync(batch=1000):
         """ sync the solr index with the portal catalog;  records contained
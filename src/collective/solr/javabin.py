@@ -0,0 +1,234 @@
+# a decoder for solr's binary response format, i.e. `wt=javabin`, see
+# `org.apache.solr.common.util.JavaBinCodec` for the reference implementation;
+# only version 2 of the format (solr 3.1 and later) is supported, as older
+# versions used java's "modified utf-8" for strings
+
+from datetime import datetime, timedelta
+from struct import Struct
+
+VERSION = 2
+
+# basic value types...
+NULL, BOOL_TRUE, BOOL_FALSE, BYTE, SHORT, DOUBLE, INT, LONG, FLOAT, DATE, \
+    MAP, SOLRDOC, SOLRDOCLST, BYTEARR, ITERATOR, END, SOLRINPUTDOC, \
+    MAP_ENTRY_ITER, ENUM_FIELD_VALUE, MAP_ENTRY = range(20)
+
+# ...and types which encode their size in the lower bits of the tag
+STR, SINT, SLONG, ARR, ORDERED_MAP, NAMED_LST, EXTERN_STRING = range(1, 8)
+
+signed = Struct('>b').unpack
+short = Struct('>h').unpack
+integer = Struct('>i').unpack
+longint = Struct('>q').unpack
+single = Struct('>f')
+double = Struct('>d').unpack
+
+epoch = datetime(1970, 1, 1)
+
+
+def isodate(millis):
+    """ format milliseconds since the epoch the way solr formats dates """
+    date = epoch + timedelta(milliseconds=millis)   # `strftime` needs 1900+
+    return '%04d-%02d-%02dT%02d:%02d:%02d.%03dZ' % (date.year, date.month,
+        date.day, date.hour, date.minute, date.second, millis % 1000)
+
+
+def tofloat(data):
+    """ convert a single-precision float to the shortest python float
+        representing the same value, like java's `Float.toString` """
+    value, = single.unpack(data)
+    for digits in 6, 7, 8:
+        rounded = float('%.*g' % (digits, value))
+        if single.pack(rounded) == data:
+            return rounded
+    return value
+
+
+def tostr(data):
+    """ decode a utf-8 string the way `ElementTree` does, i.e. only use
+        `unicode` for values that aren't plain ascii """
+    try:
+        data.decode('ascii')
+        return data
+    except UnicodeError:
+        return data.decode('utf-8')
+
+
+class End(object):
+    """ marker for the end of an iterator """
+
+end = End()
+
+
+class JavaBinDecoder(object):
+    """ decoder for javabin data read from a string or file-like object;
+        the latter is read in chunks, so that data can be decoded while
+        it's being received;  `date`, `document` and `results` are hooks
+        for converting dates (given as solr-formatted strings), documents
+        (given as a list of name/value pairs) and document lists (given a
+        tuple of `numFound`, `start` and `maxScore` plus the documents) """
+
+    def __init__(self, data, date=str, document=dict,
+                 results=lambda header, docs: docs, chunksize=65536):
+        if isinstance(data, basestring):
+            self.buffer, self.read = data, None
+        else:
+            self.buffer, self.read = '', data.read
+        self.pos = 0
+        self.chunksize = chunksize
+        self.strings = []       # the "extern strings" seen so far
+        self.date = date
+        self.document = document
+        self.results = results
+
+    def bytes(self, size):
+        end = self.pos + size
+        if end > len(self.buffer):
+            self.fill(size)
+            end = size
+        data = self.buffer[self.pos:end]
+        self.pos = end
+        return data
+
+    def fill(self, size):
+        chunks = [self.buffer[self.pos:]]
+        available = len(chunks[0])
+        while available < size:
+            chunk = self.read and self.read(self.chunksize) or ''
+            if not chunk:
+                raise ValueError('unexpected end of javabin data')
+            chunks.append(chunk)
+            available += len(chunk)
+        self.buffer = ''.join(chunks)
+        self.pos = 0
+
+    def byte(self):
+        return ord(self.bytes(1))
+
+    def vint(self):
+        """ decode a variable length integer, 7 bits per byte """
+        byte = self.byte()
+        value = byte & 0x7f
+        shift = 7
+        while byte & 0x80:
+            byte = self.byte()
+            value |= (byte & 0x7f) << shift
+            shift += 7
+        return value
+
+    def size(self, tag):
+        size = tag & 0x1f
+        if size == 0x1f:
+            size += self.vint()
+        return size
+
+    def version(self):
+        """ read and check the version header """
+        version = self.byte()
+        if version != VERSION:
+            raise ValueError('unsupported javabin version %d' % version)
+
+    def value(self, tag=None):
+        """ decode the next value, optionally with an already read tag """
+        if tag is None:
+            tag = self.byte()
+        if tag >> 5:
+            return self.sized[tag >> 5](self, tag)
+        decode = self.basic.get(tag)
+        if decode is None:
+            raise ValueError('unknown javabin tag %d' % tag)
+        return decode(self)
+
+    def pairs(self, tag):
+        """ decode the name/value pairs of a named list """
+        value = self.value
+        return [(value(), value()) for n in xrange(self.size(tag))]
+
+    def extern(self, tag):
+        index = self.size(tag)
+        if index:
+            return self.strings[index - 1]
+        string = self.value()
+        self.strings.append(string)
+        return string
+
+    def smallint(self, tag):
+        value = tag & 0x0f
+        if tag & 0x10:
+            value |= self.vint() << 4
+        return value
+
+    sized = {
+        STR: lambda self, tag: tostr(self.bytes(self.size(tag))),
+        SINT: smallint,
+        SLONG: lambda self, tag: long(self.smallint(tag)),
+        ARR: lambda self, tag: [self.value() for n in xrange(self.size(tag))],
+        ORDERED_MAP: lambda self, tag: dict(self.pairs(tag)),
+        NAMED_LST: lambda self, tag: dict(self.pairs(tag)),
+        EXTERN_STRING: extern,
+    }
+
+    def iterator(self):
+        while True:
+            value = self.value()
+            if value is end:
+                break
+            yield value
+
+    def solrdoc(self):
+        tag = self.byte()           # the fields are an ordered map
+        fields, children = [], []
+        for n in xrange(self.size(tag)):
+            name = self.value()
+            if isinstance(name, basestring):
+                fields.append((name, self.value()))
+            else:                   # nested child document (solr 4.5+)
+                children.append(name)
+        if children:
+            fields.append(('_childDocuments_', children))
+        return self.document(fields)
+
+    def documents(self):
+        """ decode a document list incrementally:  its header, a tuple of
+            `numFound`, `start` and `maxScore`, is yielded first, followed
+            by the documents themselves """
+        header = self.value()
+        yield tuple(header[:3])
+        tag = self.byte()
+        if tag == ITERATOR:
+            for doc in self.iterator():
+                yield doc
+        else:
+            for n in xrange(self.size(tag)):
+                yield self.value()
+
+    def solrdoclst(self):
+        documents = self.documents()
+        header = documents.next()
+        return self.results(header, list(documents))
+
+    def mapentry(self):
+        return self.value(), self.value()
+
+    basic = {
+        NULL: lambda self: None,
+        BOOL_TRUE: lambda self: True,
+        BOOL_FALSE: lambda self: False,
+        BYTE: lambda self: signed(self.bytes(1))[0],
+        SHORT: lambda self: short(self.bytes(2))[0],
+        DOUBLE: lambda self: double(self.bytes(8))[0],
+        INT: lambda self: integer(self.bytes(4))[0],
+        LONG: lambda self: longint(self.bytes(8))[0],
+        FLOAT: lambda self: tofloat(self.bytes(4)),
+        DATE: lambda self: self.date(isodate(longint(self.bytes(8))[0])),
+        MAP: lambda self: dict((self.value(), self.value())
+            for n in xrange(self.vint())),
+        SOLRDOC: solrdoc,
+        SOLRDOCLST: solrdoclst,
+        BYTEARR: lambda self: self.bytes(self.vint()),
+        ITERATOR: lambda self: list(self.iterator()),
+        END: lambda self: end,
+        MAP_ENTRY_ITER: lambda self: dict(self.iterator()),
+        ENUM_FIELD_VALUE: lambda self: (self.value(), self.value())[1],
+        MAP_ENTRY: mapentry,
+    }
@@ -1,17 +1,101 @@
+from hashlib import md5
 from logging import getLogger
+from os import rename
+from re import sub
+from threading import Lock, Thread
+from time import time
 from persistent import Persistent
 from zope.interface import implements
 from zope.component import getUtility
+from collective.solr.breaker import CircuitBreaker
+from collective.solr.cache import SearchCache
+from collective.solr.codec import formats
 from collective.solr.interfaces import ISolrConnectionConfig
 from collective.solr.interfaces import ISolrConnectionManager
-from collective.solr.solr import SolrConnection
+from collective.solr.parser import SolrSchema
+from collective.solr.solr import SolrConnection, SolrException, retries
+from collective.solr.pool import SolrConnectionPool
+from collective.solr.routing import SolrNode, parseEndpoint, pickNode
+from collective.solr.spool import getSpool, queuePath
 from collective.solr.local import getLocal, setLocal
-from httplib import CannotSendRequest, ResponseNotReady
+from collective.solr.utils import getRequestMemo
+from httplib import HTTPException
 from socket import error
 
 logger = getLogger('collective.solr.manager')
 marker = object()
 
+# process-wide connection pools, keyed by host, port and base
+pools = {}
+poolsLock = Lock()
+
+# process-wide health state of replicas, using the same keys
+nodes = {}
+
+# process-wide circuit breakers for searches, using the same keys
+breakers = {}
+
+# process-wide caches for search results, using the same keys
+caches = {}
+
+# process-wide schema cache, using the same keys
+schemas = {}
+schemasLock = Lock()
+
+
+def schemaCachePath(path, key):
+    """ return the name of the file used to store a copy of the schema
+        of the solr server given as a tuple of host, port and base """
+    if not path:
+        return path
+    server = sub(r'[^\w.]+', '-', '%s-%s-%s' % key).strip('-')
+    return '%s.%s' % (path, server)
+
+
+class SchemaCacheEntry(object):
+    """ a cached schema along with the information when it's due to be
+        refreshed or, after a failure, may be fetched again """
+
+    def __init__(self):
+        self.schema = None
+        self.digest = None          # identifies the version of the schema
+        self.expires = None         # time after which it gets refreshed
+        self.retry = 0              # time until which failures are cached
+        self.refreshing = False
+        self.lock = Lock()
+
+    def update(self, data, ttl, path=None):
+        """ set up the schema from the given `schema.xml` contents,
+            unless they're the same as before, and store a copy """
+        digest = md5(data).hexdigest()
+        if digest != self.digest:
+            if self.digest is not None:
+                logger.info('solr schema has changed, updating')
+            self.schema = SolrSchema(data)
+            self.digest = digest
+            if path:
+                try:
+                    tmp = path + '.tmp'
+                    open(tmp, 'w').write(data)
+                    rename(tmp, path)
+                except (IOError, OSError):
+                    logger.exception('unable to store schema in %s', path)
+        self.expires = ttl and time() + ttl or None
+        self.retry = 0
+
+    def load(self, path):
+        """ set up the schema from a copy stored earlier;  it's treated
+            as expired, so that it gets refreshed as soon as possible """
+        try:
+            data = open(path).read()
+        except (IOError, OSError):
+            return False
+        logger.info('using schema copy stored in %s', path)
+        self.schema = SolrSchema(data)
+        self.digest = md5(data).hexdigest()
+        self.expires = time()
+        return True
+
 
 class BaseSolrConnectionConfig(object):
     """ utility to hold the connection configuration for the solr server """
@@ -22,6 +106,9 @@ class BaseSolrConnectionConfig(object):
         self.host = None
         self.port = None
         self.base = None
+        self.replicas = []
+        self.replica_retry = 30
+        self.client_mode = 'read-write'
         self.async = False
         self.auto_commit = True
         self.commit_within = 0
@@ -34,8 +121,36 @@ class BaseSolrConnectionConfig(object):
         self.filter_queries = []
         self.slow_query_threshold = 0
         self.effective_steps = 1
+        self.effective_rounding = 'none'
         self.exclude_user = False
+        self.split_security_filter = False
         self.field_list = []
+        self.pool_size = 10
+        self.pool_timeout = 10
+        self.pool_max_idle = 60
+        self.update_batch_size = 1000
+        self.update_batch_bytes = 4194304
+        self.wire_format = 'xml'
+        self.compress_threshold = 0
+        self.compress_level = 6
+        self.compress_responses = False
+        self.schema_ttl = 3600
+        self.schema_retry = 30
+        self.schema_cache_path = ''
+        self.queue_updates = False
+        self.queue_retry = 10
+        self.breaker_threshold = 5
+        self.breaker_cooldown = 30
+        self.breaker_slow_threshold = 0
+        self.retry_attempts = 2
+        self.retry_delay = 0.1
+        self.retry_deadline = 30.0
+        self.search_cache_entries = 0
+        self.search_cache_size = 16777216
+        self.search_cache_poll = 10
+        self.search_cache_stale = 0
+        self.terms_threshold = 0
+        self.atomic_updates = False
 
 
 class SolrConnectionConfig(BaseSolrConnectionConfig, Persistent):
@@ -49,8 +164,39 @@ class SolrConnectionConfig(BaseSolrConnectionConfig, Persistent):
     filter_queries = ()
     slow_query_threshold = 0
     effective_steps = 1
+    effective_rounding = 'none'
     exclude_user = False
+    split_security_filter = False
     field_list = []
+    pool_size = 10
+    pool_timeout = 10
+    pool_max_idle = 60
+    update_batch_size = 1000
+    update_batch_bytes = 4194304
+    wire_format = 'xml'
+    compress_threshold = 0
+    compress_level = 6
+    compress_responses = False
+    schema_ttl = 3600
+    schema_retry = 30
+    schema_cache_path = ''
+    replicas = []
+    replica_retry = 30
+    client_mode = 'read-write'
+    queue_updates = False
+    queue_retry = 10
+    breaker_threshold = 5
+    breaker_cooldown = 30
+    breaker_slow_threshold = 0
+    retry_attempts = 2
+    retry_delay = 0.1
+    retry_deadline = 30.0
+    search_cache_entries = 0
+    search_cache_size = 16777216
+    search_cache_poll = 10
+    search_cache_stale = 0
+    terms_threshold = 0
+    atomic_updates = False
 
     def getId(self):
         """ return a unique id to be used with GenericSetup """
@@ -58,11 +204,11 @@ class SolrConnectionConfig(BaseSolrConnectionConfig, Persistent):
 
 
 class SolrConnectionManager(object):
-    """ a thread-local connection manager for solr """
+    """ a connection manager for solr;  connections are taken from a
+        process-wide pool and stay checked out by the current thread
+        until they're closed again """
     implements(ISolrConnectionManager)
 
-    lock = False
-
     def __init__(self, active=None):
         if isinstance(active, bool):
             self.setHost(active=active)
@@ -75,55 +221,363 @@ class SolrConnectionManager(object):
         config.port = port
         config.base = base
         self.closeConnection(clearSchema=True)
+        poolsLock.acquire()
+        try:
+            for pool in pools.values():
+                pool.clear()
+            pools.clear()
+            nodes.clear()
+            breakers.clear()
+            caches.clear()
+        finally:
+            poolsLock.release()
 
     def closeConnection(self, clearSchema=False):
-        """ close the current connection, if any """
+        """ return the current connections, if any, to their pools """
         logger.debug('closing connection')
         conn = getLocal('connection')
         if conn is not None:
-            conn.close()
+            getLocal('pool').checkin(conn)
             setLocal('connection', None)
+            setLocal('pool', None)
+        conn = getLocal('readConnection')
+        if conn is not None:
+            getLocal('readNode').pool.checkin(conn)
+            setLocal('readConnection', None)
+            setLocal('readNode', None)
+        setLocal('timeoutLock', False)
         if clearSchema:
-            setLocal('schema', None)
+            schemasLock.acquire()
+            try:
+                schemas.clear()
+            finally:
+                schemasLock.release()
+
+    def getPool(self, key=None):
+        """ returns the connection pool for the configured solr server or
+            the one given as a tuple of host, port and base """
+        config = getUtility(ISolrConnectionConfig)
+        if key is None:
+            key = config.host, config.port, config.base
+        poolsLock.acquire()
+        try:
+            pool = pools.get(key)
+            if pool is None:
+                host = '%s:%d' % key[:2]
+                base = key[2]
+                logger.debug('setting up connection pool for %s', host)
+                factory = lambda: SolrConnection(host=host, solrBase=base,
+                    persistent=True)
+                pool = pools[key] = SolrConnectionPool(factory)
+        finally:
+            poolsLock.release()
+        pool.size = getattr(config, 'pool_size', 10) or 10
+        pool.timeout = getattr(config, 'pool_timeout', 10) or None
+        pool.max_idle = getattr(config, 'pool_max_idle', 60)
+        return pool
+
+    def getPoolStatistics(self):
+        """ returns usage statistics for the current connection pool """
+        config = getUtility(ISolrConnectionConfig)
+        if config.host is None:
+            return {}
+        return self.getPool().statistics()
+
+    def getRetryStatistics(self):
+        """ returns process-wide counters of retried requests """
+        return dict(retries)
+
+    def getBreaker(self):
+        """ returns the circuit breaker for searches or `None` if it's
+            been disabled """
+        config = getUtility(ISolrConnectionConfig)
+        threshold = getattr(config, 'breaker_threshold', 5)
+        if not threshold or config.host is None:
+            return None
+        key = config.host, config.port, config.base
+        poolsLock.acquire()
+        try:
+            breaker = breakers.get(key)
+            if breaker is None:
+                breaker = breakers[key] = CircuitBreaker()
+        finally:
+            poolsLock.release()
+        breaker.threshold = threshold
+        breaker.cooldown = getattr(config, 'breaker_cooldown', 30)
+        breaker.slow = getattr(config, 'breaker_slow_threshold', 0)
+        return breaker
+
+    def getBreakerStatistics(self):
+        """ returns the state and statistics of the circuit breaker """
+        breaker = self.getBreaker()
+        if breaker is None:
+            return {}
+        return breaker.statistics()
+
+    def getSearchCache(self):
+        """ returns the cache for search results or `None` if it's been
+            disabled;  the index version is polled in the background every
+            `search_cache_poll` seconds, so that commits made by other
+            clients invalidate the cache as well """
+        config = getUtility(ISolrConnectionConfig)
+        entries = getattr(config, 'search_cache_entries', 0)
+        if not entries or not config.active or config.host is None:
+            return None
+        key = config.host, config.port, config.base
+        poolsLock.acquire()
+        try:
+            cache = caches.get(key)
+            if cache is None:
+                cache = caches[key] = SearchCache()
+        finally:
+            poolsLock.release()
+        cache.entries = entries
+        cache.size = getattr(config, 'search_cache_size', 16777216)
+        cache.poll = getattr(config, 'search_cache_poll', 10)
+        cache.stale = getattr(config, 'search_cache_stale', 0)
+        if cache.due():
+            thread = Thread(target=self.pollIndexVersion,
+                args=(cache, self.getSearchPool()))
+            thread.setDaemon(True)
+            thread.start()
+        return cache
+
+    def getCacheStatistics(self):
+        """ returns the size and statistics of the search cache """
+        cache = self.getSearchCache()
+        if cache is None:
+            return {}
+        return cache.statistics()
 
-    def getConnection(self):
-        """ returns an existing connection or opens one """
+    def invalidateCache(self):
+        """ invalidate cached search results, e.g. after a commit """
+        memo = getRequestMemo('searches')
+        if memo is not None:
+            memo.clear()
+        config = getUtility(ISolrConnectionConfig)
+        cache = caches.get((config.host, config.port, config.base))
+        if cache is not None:
+            cache.invalidate()
+
+    def pollIndexVersion(self, cache, pool):
+        """ check the version of the index in a separate thread """
+        conn = None
+        try:
+            try:
+                conn = pool.checkout()
+                cache.update(conn.getIndexVersion())
+            except (error, HTTPException, SolrException):
+                logger.exception('exception while polling the index version')
+        finally:
+            if conn is not None:
+                pool.checkin(conn)
+            cache.polling = False
+
+    def getReplicas(self):
+        """ returns the nodes for the configured replicas """
+        config = getUtility(ISolrConnectionConfig)
+        replicas = []
+        for endpoint in getattr(config, 'replicas', None) or ():
+            key = parseEndpoint(endpoint)
+            pool = self.getPool(key)
+            poolsLock.acquire()
+            try:
+                node = nodes.get(key)
+                if node is None:
+                    node = nodes[key] = SolrNode(key, pool)
+            finally:
+                poolsLock.release()
+            replicas.append(node)
+        return replicas
+
+    def getSearchPool(self):
+        """ returns the pool of the replica with the least outstanding
+            requests or the master, e.g. for checking out connections to be
+            used by other threads """
+        config = getUtility(ISolrConnectionConfig)
+        if not getLocal('pinned') and getattr(config, 'replicas', None):
+            node = pickNode(self.getReplicas())
+            if node is not None:
+                return node.pool
+        return self.getPool()
+
+    def getConnection(self, readonly=False):
+        """ returns the connection checked out by the current thread or
+            takes one from the pool;  `readonly` connections are taken from
+            the replica with the least outstanding requests, unless reads
+            are pinned to the master or all replicas are out of service """
         config = getUtility(ISolrConnectionConfig)
         if not config.active:
             return None
+        if readonly and not getLocal('pinned'):
+            conn = getLocal('readConnection')
+            if conn is None and getattr(config, 'replicas', None):
+                node = pickNode(self.getReplicas())
+                if node is not None:
+                    logger.debug('checking out connection to %r', node)
+                    conn = self.setupConnection(node.pool.checkout(), config)
+                    setLocal('readConnection', conn)
+                    setLocal('readNode', node)
+            if conn is not None:
+                return conn
         conn = getLocal('connection')
         if conn is None and config.host is not None:
-            host = '%s:%d' % (config.host, config.port)
-            logger.debug('opening connection to %s', host)
-            conn = SolrConnection(host=host, solrBase=config.base,
-                persistent=True)
+            pool = self.getPool()
+            logger.debug('checking out connection to %s:%s',
+                config.host, config.port)
+            conn = self.setupConnection(pool.checkout(), config)
             setLocal('connection', conn)
+            setLocal('pool', pool)
         return conn
 
+    def getSettings(self, config):
+        """ returns the connection attributes for the current configuration """
+        return dict(
+            maxBatchSize=getattr(config, 'update_batch_size', 1000),
+            maxBatchBytes=getattr(config, 'update_batch_bytes', 4194304),
+            codec=formats.get(getattr(config, 'wire_format', 'xml'),
+                formats['xml']),
+            compressThreshold=getattr(config, 'compress_threshold', 0),
+            compressLevel=getattr(config, 'compress_level', 6),
+            compressResponses=getattr(config, 'compress_responses', False),
+            retryAttempts=getattr(config, 'retry_attempts', 2),
+            retryDelay=getattr(config, 'retry_delay', 0.1),
+            retryDeadline=getattr(config, 'retry_deadline', 30.0))
+
+    def setupConnection(self, conn, config):
+        """ apply the current configuration to a checked out connection """
+        for key, value in self.getSettings(config).items():
+            setattr(conn, key, value)
+        return conn
+
+    def getSpool(self):
+        """ returns the queue for index operations sent in the background
+            or `None` if updates are to be sent while committing """
+        config = getUtility(ISolrConnectionConfig)
+        if not config.active or config.host is None or \
+                not getattr(config, 'queue_updates', False):
+            return None
+        path = queuePath()
+        if path is None:
+            return None
+        return getSpool(path, self.getPool(),
+            retry=getattr(config, 'queue_retry', 10),
+            timeout=getattr(config, 'index_timeout', 0) or None,
+            settings=self.getSettings(config))
+
+    def getQueueStatistics(self):
+        """ returns the length and lag of the index queue """
+        spool = self.getSpool()
+        if spool is None:
+            return {}
+        return spool.statistics()
+
+    def pinToMaster(self, pin=True):
+        """ make the current thread read from the master, e.g. to see its
+            own updates, until the pin is removed again """
+        setLocal('pinned', pin)
+        conn = getLocal('readConnection')
+        if pin and conn is not None:
+            getLocal('readNode').pool.checkin(conn)
+            setLocal('readConnection', None)
+            setLocal('readNode', None)
+
+    def failover(self, conn):
+        """ take the replica used by the given connection out of service
+            and release the connection;  returns `False` for connections
+            to the master, for which there's nothing to fail over to """
+        if conn is None or conn is not getLocal('readConnection'):
+            return False
+        config = getUtility(ISolrConnectionConfig)
+        node = getLocal('readNode')
+        node.eject(getattr(config, 'replica_retry', 30) or 30)
+        conn.close()
+        node.pool.checkin(conn)
+        setLocal('readConnection', None)
+        setLocal('readNode', None)
+        return True
+
     def getSchema(self):
-        """ returns the currently used schema or fetches it """
-        schema = getLocal('schema')
-        if schema is None:
-            conn = self.getConnection()
-            if conn is not None:
-                logger.debug('getting schema from solr')
-                try:
-                    schema = conn.getSchema()
-                    setLocal('schema', schema)
-                except (error, CannotSendRequest, ResponseNotReady):
-                    logger.exception('exception while getting schema')
+        """ returns the currently used schema or fetches it;  the schema is
+            shared by all threads and refreshed in the background after
+            `schema_ttl` seconds, while failures to fetch it are cached for
+            `schema_retry` seconds """
+        config = getUtility(ISolrConnectionConfig)
+        if not config.active or config.host is None:
+            return None
+        key = config.host, config.port, config.base
+        schemasLock.acquire()
+        try:
+            entry = schemas.get(key)
+            if entry is None:
+                entry = schemas[key] = SchemaCacheEntry()
+        finally:
+            schemasLock.release()
+        ttl = getattr(config, 'schema_ttl', 3600)
+        retry = getattr(config, 'schema_retry', 30)
+        path = schemaCachePath(getattr(config, 'schema_cache_path', ''), key)
+        if entry.schema is None:
+            entry.lock.acquire()        # only one thread needs to fetch it
+            try:
+                if entry.schema is None and time() >= entry.retry:
+                    if not (path and entry.load(path)):
+                        self.fetchSchema(entry, ttl, retry, path)
+            finally:
+                entry.lock.release()
+        schema = entry.schema
+        if entry.expires is not None and time() >= entry.expires:
+            entry.lock.acquire()
+            try:
+                refresh = not entry.refreshing
+                entry.refreshing = True
+            finally:
+                entry.lock.release()
+            if refresh:
+                thread = Thread(target=self.refreshSchema,
+                    args=(entry, self.getPool(), ttl, retry, path))
+                thread.setDaemon(True)
+                thread.start()
         return schema
 
-    def setTimeout(self, timeout, lock=marker):
+    def fetchSchema(self, entry, ttl, retry, path):
+        """ fetch the schema using the current thread's connection """
+        conn = self.getConnection()
+        if conn is not None:
+            logger.debug('getting schema from solr')
+            try:
+                entry.update(conn.getSchemaData(), ttl, path)
+            except (error, HTTPException, SolrException):
+                logger.exception('exception while getting schema')
+                entry.retry = time() + retry
+
+    def refreshSchema(self, entry, pool, ttl, retry, path):
+        """ fetch the schema again in a separate thread;  the cached one
+            stays in use until it's replaced or, on failures, until the
+            next attempt """
+        conn = None
+        try:
+            try:
+                conn = pool.checkout()
+                logger.debug('refreshing schema from solr')
+                entry.update(conn.getSchemaData(), ttl, path)
+            except (error, HTTPException, SolrException):
+                logger.exception('exception while refreshing schema')
+                entry.expires = time() + retry
+        finally:
+            if conn is not None:
+                pool.checkin(conn)
+            entry.refreshing = False
+
+    def setTimeout(self, timeout, lock=marker, readonly=False):
         """ set the timeout on the current (or to be opened) connection
             to the given value """
-        update = not self.lock          # update if not locked...
+        update = not getLocal('timeoutLock')    # update if not locked...
         if lock is not marker:
-            self.lock = bool(lock)
+            setLocal('timeoutLock', bool(lock))
             update = True               # ...or changed
             logger.debug('%ssetting timeout lock', lock and '' or 're')
         if update:
-            conn = self.getConnection()
+            conn = self.getConnection(readonly=readonly)
             if conn is not None:
                 logger.debug('setting timeout to %s', timeout)
                 conn.setTimeout(timeout)
@@ -138,4 +592,4 @@ class SolrConnectionManager(object):
         """ set the timeout on the current (or to be opened) connection
             to the value specified for search operations """
         config = getUtility(ISolrConnectionConfig)
-        self.setTimeout(config.search_timeout or None)
+        self.setTimeout(config.search_timeout or None, readonly=True)
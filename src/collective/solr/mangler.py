@@ -1,3 +1,4 @@
+from time import time
 from zope.component import queryUtility
 from AccessControl import getSecurityManager
 from DateTime import DateTime
@@ -16,6 +17,17 @@ ranges = {
     'min:max': '[%s TO %s]',
 }
 
+# units for rounding the effective range using date math, in seconds
+rounding = {
+    'minute': 60,
+    'hour': 3600,
+    'day': 86400,
+}
+
+# number of security tokens from which on the `terms` query parser is
+# used when there's no `terms_threshold` setting
+terms_threshold = 10
+
 sort_aliases = {
     'sortable_title': 'Title',
 }
@@ -38,6 +50,47 @@ def iso8601date(value):
     return value
 
 
+def dateMath(value, config):
+    """ returns solr date math like "NOW/MINUTE" for the given date if
+        rounding of the effective range is configured and the date falls
+        into the current minute, hour or day, i.e. yields the same result
+        as the rounded date itself """
+    unit = getattr(config, 'effective_rounding', 'none')
+    seconds = rounding.get(unit)
+    if seconds and value.timeTime() // seconds == time() // seconds:
+        return 'NOW/%s' % unit.upper()
+    return None
+
+
+def securityFilter(tokens, threshold=None, name='allowedRolesAndUsers'):
+    """ returns a filter query for the given security tokens;  the clause
+        for the role and group tokens is the same for many users and gets
+        cached by solr, while the one for user specific tokens is only
+        added without caching the whole filter """
+    shared = sorted([t for t in tokens if not t.startswith('user$')])
+    users = sorted([t for t in tokens if t.startswith('user$')])
+    phrase = lambda token: '"%s"' % token.replace('"', '\\"')
+    if threshold is None:
+        threshold = terms_threshold
+    # the terms query parser splits at commas, so other tokens need the
+    # boolean query;  a threshold of 0 disables the former altogether
+    if threshold and len(shared) > threshold and \
+            not [token for token in shared if ',' in token]:
+        clause = '{!terms f=%s}%s' % (name, ','.join(shared))
+        if users:
+            clause = '_query_:%s' % phrase(clause)
+    elif shared:
+        clause = '%s:(%s)' % (name, ' OR '.join(map(phrase, shared)))
+    else:
+        clause = None
+    if not users:
+        return clause
+    users = '%s:(%s)' % (name, ' OR '.join(map(phrase, users)))
+    if clause is None:
+        return users
+    return '{!cache=false}filter(%s) OR %s' % (clause, users)
+
+
 def makeSimpleExpressions(term, levenstein_distance):
     '''Return a search expression for part of the query that
     includes the levenstein distance and wildcards where appropriate.
@@ -111,13 +164,7 @@ def mangleQuery(keywords, config, schema):
 
     # find EPI indexes
     if schema:
-        epi_indexes = {}
-        for name in schema.keys():
-            parts = name.split('_')
-            if parts[-1] in ['string', 'depth', 'parents']:
-                count = epi_indexes.get(parts[0], 0)
-                epi_indexes[parts[0]] = count + 1
-        epi_indexes = [k for k, v in epi_indexes.items() if v == 3]
+        epi_indexes = schema.epi_indexes
     else:
         epi_indexes = ['path']
 
@@ -149,12 +196,17 @@ def mangleQuery(keywords, config, schema):
                         )
                 del args['depth']
         elif key == 'effectiveRange':
+            del keywords[key]
+            now = isinstance(value, DateTime) and dateMath(value, config)
+            if now:     # literal clauses, see `optimizeQueryParameters`
+                keywords['effective'] = set(['+effective:[* TO %s]' % now])
+                keywords['expires'] = set(['+expires:[%s TO *]' % now])
+                continue
             if isinstance(value, DateTime):
                 steps = getattr(config, 'effective_steps', 1)
                 if steps > 1:
                     value = DateTime(value.timeTime() // steps * steps)
                 value = iso8601date(value)
-            del keywords[key]
             keywords['effective'] = '[* TO %s]' % value
             keywords['expires'] = '[%s TO *]' % value
         elif key == 'show_inactive':
@@ -168,7 +220,7 @@ def mangleQuery(keywords, config, schema):
         elif 'operator' in args:
             if isinstance(value, (list, tuple)) and len(value) > 1:
                 sep = ' %s ' % args['operator'].upper()
-                value = sep.join(map(str, map(iso8601date, value)))
+                value = sep.join(sorted(map(str, map(iso8601date, value))))
                 keywords[key] = '(%s)' % value
             del args['operator']
         elif key == 'allowedRolesAndUsers':
@@ -176,6 +228,9 @@ def mangleQuery(keywords, config, schema):
                 token = 'user$' + getSecurityManager().getUser().getId()
                 if token in value:
                     value.remove(token)
+            if getattr(config, 'split_security_filter', False) and value:
+                threshold = getattr(config, 'terms_threshold', None)
+                keywords[key] = set([securityFilter(value, threshold)])
         elif isinstance(value, DateTime):
             keywords[key] = iso8601date(value)
         elif not isinstance(value, basestring):
@@ -234,8 +289,7 @@ def cleanupQueryParameters(args, schema):
         field, order = sort.split(' ', 1)
         if not field in schema:
             field = sort_aliases.get(field, None)
-        fld = schema.get(field, None)
-        if fld is not None and fld.indexed:
+        if field in schema.sortable:
             args['sort'] = '%s %s' % (field, order)
         else:
             del args['sort']
@@ -250,10 +304,23 @@ def optimizeQueryParameters(query, params):
     config = queryUtility(ISolrConnectionConfig)
     fq = []
     if config is not None:
+        if getattr(config, 'split_security_filter', False):
+            if 'allowedRolesAndUsers' in query:
+                fq.append(query.pop('allowedRolesAndUsers'))
         for idxs in config.filter_queries:
             idxs = set(idxs.split(' '))
             if idxs.issubset(query.keys()):
-                fq.append(' '.join([query.pop(idx) for idx in idxs]))
+                clauses = [query.pop(idx) for idx in sorted(idxs)]
+                # local parameters like `{!terms ...}` would apply to the
+                # whole filter query, so such clauses are kept separate
+                fq.extend([c for c in clauses if c.startswith('{!')])
+                clauses = [c for c in clauses if not c.startswith('{!')]
+                if clauses:
+                    fq.append(' '.join(clauses))
+        dated = query.get('effective', '') + query.get('expires', '')
+        if 'NOW/' in dated:     # a separate filter query cached by solr
+            fq.append(' '.join([query.pop(idx)
+                for idx in ('effective', 'expires') if idx in query]))
     if 'fq' in params:
         if isinstance(params['fq'], list):
             params['fq'].extend(fq)
@@ -9,6 +9,7 @@ from Products.ZCatalog.Lazy import LazyCat
 
 from collective.solr.interfaces import (ISearchDispatcher)
 from collective.solr.parser import SolrResponse
+from collective.solr.utils import getRequestMemo
 
 HAS_EXPCAT = True
 try:
@@ -22,9 +23,17 @@ def searchResults(self, REQUEST=None, **kw):
     kw = kw.copy()
     only_active = not kw.get('show_inactive', False)
     user = _getAuthenticatedUser(self)
-    kw['allowedRolesAndUsers'] = self._listAllowedRolesAndUsers(user)
+    memo = getRequestMemo('security')   # computed once per request
+    if memo is None:
+        memo = {}
+    key = user.getId(), tuple(user.getRoles())
+    if key not in memo:
+        memo[key] = self._listAllowedRolesAndUsers(user)
+    kw['allowedRolesAndUsers'] = list(memo[key])
     if only_active and not _checkPermission(AccessInactivePortalContent, self):
-        kw['effectiveRange'] = DateTime()
+        if 'now' not in memo:
+            memo['now'] = DateTime()
+        kw['effectiveRange'] = memo['now']
 
     adapter = queryAdapter(self, ISearchDispatcher)
     if adapter is not None:
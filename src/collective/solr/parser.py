@@ -1,4 +1,6 @@
+from copy import copy
 from datetime import datetime
+from json import load, loads
 from StringIO import StringIO
 
 from DateTime import DateTime
@@ -6,6 +8,7 @@ from zope.interface import implements
 
 from collective.solr.interfaces import ISolrFlare
 from collective.solr.iterparse import iterparse
+from collective.solr.javabin import JavaBinDecoder, SOLRDOCLST
 
 
 class AttrDict(dict):
@@ -96,9 +99,21 @@ class SolrResponse(object):
 
     def parse(self, data):
         """ parse a solr response contained in a string or file-like object """
+        for flare in self.stream(data, keep=True):
+            pass
+        return self
+
+    def stream(self, data, keep=False):
+        """ parse a solr response incrementally, e.g. straight from the
+            http response, yielding the documents of the result set as soon
+            as they've been converted to flares;  processed elements are
+            freed right away and unless `keep` is set the flares aren't
+            collected in the result set either, so that memory usage stays
+            flat regardless of the number of results """
         if isinstance(data, basestring):
             data = StringIO(data)
         stack = [self]      # the response object is the outmost container
+        parents = [None]    # elements to be freed once processed
         elements = iterparse(data, events=('start', 'end'))
         for action, elem in elements:
             tag = elem.tag
@@ -108,20 +123,40 @@ class SolrResponse(object):
                     for key, value in elem.attrib.items():
                         if not key == 'name':   # set extra attributes
                             setattr(data, key, value)
+                    if isinstance(data, SolrResults):
+                        # make the result set available while streaming
+                        setter(stack[-1], elem.get('name'), data)
                     stack.append(data)
+                parents.append(elem)
             elif action == 'end':
+                parents.pop()
                 if tag in nested:
                     data = stack.pop()
-                    setter(stack[-1], elem.get('name'), data)
+                    if isinstance(stack[-1], SolrResults):
+                        if keep:
+                            stack[-1].append(data)
+                        yield data
+                    elif not isinstance(data, SolrResults):
+                        setter(stack[-1], elem.get('name'), data)
                 elif tag in self.unmarshallers:
                     data = self.unmarshallers[tag](elem.text)
                     setter(stack[-1], elem.get('name'), data)
-        return self
+                elem.clear()
+                if parents[-1] is not None:
+                    del parents[-1][:]
 
     def results(self):
         """ return only the list of results, i.e. a `SolrResults` instance """
         return getattr(self, 'response', [])
 
+    def clone(self):
+        """ return a copy of the response, whose result set can be modified,
+            e.g. by wrapping or padding it, without affecting this one """
+        response = copy(self)
+        if isinstance(getattr(self, 'response', None), list):
+            response.response = copy(self.response)
+        return response
+
     def __len__(self):
         return len(self.results())
 
@@ -129,6 +164,124 @@ class SolrResponse(object):
         return self.results()[index]
 
 
+def jsonStr(value):
+    """ convert strings from json the way `ElementTree` does, i.e. only use
+        `unicode` for values that aren't plain ascii """
+    try:
+        return value.encode('ascii')
+    except UnicodeError:
+        return value
+
+
+# date field types, whose values get unmarshalled in json responses
+datetypes = ('solr.DateField', 'solr.TrieDateField')
+
+
+class JSONResponse(SolrResponse):
+    """ a solr search response in json format (`wt=json` with `json.nl=map`),
+        converted to the same structures as the xml version;  as json has
+        no date type the schema is used to find out which of the fields
+        returned should be converted using the `date` unmarshaller """
+
+    def __init__(self, data=None, unmarshallers=unmarshallers, schema=None):
+        self.dates = getattr(schema, 'dates', ())
+        super(JSONResponse, self).__init__(data, unmarshallers)
+
+    def stream(self, data, keep=False):
+        """ parse a json response, yielding the documents of the result set;
+            unlike with xml the whole response is decoded in one go """
+        if isinstance(data, basestring):
+            data = loads(data)
+        else:
+            data = load(data)
+        for key, value in data.items():
+            if key == 'response':
+                results = self.convert(value, docs=False)
+                setattr(self, key, results)
+                for doc in value.get('docs', ()):
+                    flare = self.flare(doc)
+                    if keep:
+                        results.append(flare)
+                    yield flare
+            else:
+                setattr(self, key, self.convert(value))
+
+    def flare(self, doc):
+        """ convert a document to a flare, unmarshalling its dates """
+        flare = SolrFlare()
+        date = self.unmarshallers['date']
+        for name, value in doc.items():
+            value = self.convert(value)
+            if name in self.dates:
+                if isinstance(value, list):
+                    value = map(date, value)
+                else:
+                    value = date(value)
+            flare[name] = value
+        return flare
+
+    def convert(self, value, docs=True):
+        """ convert json values recursively;  result sets are turned into
+            `SolrResults` with their attributes kept as strings """
+        if isinstance(value, unicode):
+            return jsonStr(value)
+        elif isinstance(value, list):
+            return map(self.convert, value)
+        elif isinstance(value, dict):
+            if 'numFound' in value and 'docs' in value:
+                results = SolrResults()
+                for key, item in value.items():
+                    if key != 'docs':
+                        setattr(results, str(key), str(item))
+                if docs:
+                    results.extend(map(self.flare, value['docs']))
+                return results
+            return dict((jsonStr(key), self.convert(item))
+                for key, item in value.items())
+        return value
+
+
+def javabinResults(header, docs=()):
+    """ create a result set from a javabin document list """
+    results = SolrResults(docs)
+    for name, value in zip(('numFound', 'start', 'maxScore'), header):
+        if value is not None:   # attributes are strings like in xml
+            setattr(results, name, str(value))
+    return results
+
+
+class JavaBinResponse(SolrResponse):
+    """ a solr search response in solr's binary format (`wt=javabin`),
+        converted to the same structures as the xml version;  dates are
+        passed to the `date` unmarshaller as strings formatted like solr
+        does, all other values already come with the correct type """
+
+    def __init__(self, data=None, unmarshallers=unmarshallers, schema=None):
+        super(JavaBinResponse, self).__init__(data, unmarshallers)
+
+    def stream(self, data, keep=False):
+        """ decode a javabin response incrementally, yielding the documents
+            of the result set as soon as they've been read, see `stream`
+            of `SolrResponse` """
+        decoder = JavaBinDecoder(data, date=self.unmarshallers['date'],
+            document=SolrFlare, results=javabinResults)
+        decoder.version()
+        tag = decoder.byte()        # the response itself is a named list
+        for n in xrange(decoder.size(tag)):
+            name = decoder.value()
+            tag = decoder.byte()
+            if tag == SOLRDOCLST:
+                documents = decoder.documents()
+                results = javabinResults(documents.next())
+                setattr(self, name, results)
+                for flare in documents:
+                    if keep:
+                        results.append(flare)
+                    yield flare
+            else:
+                setattr(self, name, decoder.value(tag))
+
+
 class SolrField(AttrDict):
     """ a schema field representation """
 
@@ -156,7 +309,18 @@ class SolrSchema(AttrDict):
         all <analyzer> (tokenizers, filters) and <dynamicField> information
         is ignored;  some of the other fields relevant to the implementation,
         like <uniqueKey>, <solrQueryParser> or <defaultSearchField>, are also
-        parsed and provided, all others are ignored """
+        parsed and provided, all others are ignored;  information derived
+        from the fields, which is needed for every query or indexing
+        operation, is computed once after parsing (see `prepare`) """
+
+    epi_indexes = frozenset()
+    stored = frozenset()
+    indexed = frozenset()
+    sortable = frozenset()
+    dates = frozenset()
+    copies = frozenset()            # targets of <copyField>s
+    updatable = False
+    converters = None               # see `indexer.getConverters`
 
     def __init__(self, data=None):
         if data is not None:
@@ -168,6 +332,7 @@ class SolrSchema(AttrDict):
         if isinstance(data, basestring):
             data = StringIO(data)
         self['requiredFields'] = required = []
+        copies = []
         types = {}
         for action, elem in iterparse(data):
             name = elem.get('name')
@@ -183,10 +348,45 @@ class SolrSchema(AttrDict):
                 self[name] = field
                 if field.get('required', False):
                     required.append(name)
+            elif elem.tag == 'copyField':
+                copies.append(elem.get('dest'))
             elif elem.tag in ('uniqueKey', 'defaultSearchField'):
                 self[elem.tag] = elem.text
             elif elem.tag == 'solrQueryParser':
                 self[elem.tag] = AttrStr(elem.text, **elem.attrib)
+        self.copies = frozenset(copies)
+        self.prepare()
+
+    def prepare(self):
+        """ compute the sets of field names used by the query and indexing
+            code;  this needs to be called again after modifying fields """
+        fields = list(self.fields)
+        names = lambda flag: frozenset([field.name for field in fields
+            if field.get(flag, False)])
+        self.stored = names('stored')
+        self.indexed = names('indexed')
+        self.sortable = frozenset([field.name for field in fields
+            if field.get('indexed', False) and not field.multiValued])
+        self.dates = frozenset([field.name for field in fields
+            if field.get('class_') in datetypes])
+        # atomic updates need the update log, i.e. a `_version_` field, and
+        # solr has to be able to rebuild the rest of the document from its
+        # stored values, so only the targets of copy fields may be unstored
+        self.updatable = '_version_' in self and not [field
+            for field in fields if field.name != '_version_' and
+            field.name not in self.copies and
+            not field.get('stored', False) and
+            not field.get('docValues', False)]
+        # "extended path indexes" are made up of three fields each
+        counts = {}
+        for field in fields:
+            parts = field.name.split('_')
+            if parts[-1] in ('string', 'depth', 'parents'):
+                counts[parts[0]] = counts.get(parts[0], 0) + 1
+        self.epi_indexes = frozenset([name
+            for name, count in counts.items() if count == 3])
+        # the indexing converters are compiled again when first needed
+        self.converters = None
 
     @property
     def fields(self):
@@ -194,10 +394,3 @@ class SolrSchema(AttrDict):
         for name, field in self.items():
             if isinstance(field, SolrField):
                 yield field
-
-    @property
-    def stored(self):
-        """ return names of all stored fields, a.k.a. metadata """
-        for field in self.fields:
-            if field.stored:
-                yield field.name
@@ -0,0 +1,158 @@
+from logging import getLogger
+from select import select, error as SelectError
+from socket import error
+from threading import Condition, Lock, currentThread
+from time import time
+
+from collective.solr.exceptions import SolrConnectionPoolExhausted
+
+logger = getLogger('collective.solr.pool')
+
+
+def isDropped(conn):
+    """ check if the socket of an idle connection has been closed by the
+        server, i.e. if it has become readable without a request being
+        sent;  connections which haven't been opened yet are fine, and so
+        are the ones whose socket cannot be checked (e.g. during testing) """
+    sock = getattr(conn.conn, 'sock', None)
+    if sock is None:
+        return False
+    try:
+        readable, writable, errors = select([sock], [], [], 0.0)
+    except TypeError:           # not a real socket...
+        return False
+    except (SelectError, ValueError, error):
+        return True
+    return bool(readable)
+
+
+class SolrConnectionPool(object):
+    """ a bounded, thread-safe pool of persistent solr connections;  idle
+        connections are reused last-in-first-out, so that keep-alive works
+        best for the most recently used ones, while those not used for
+        more than `max_idle` seconds get closed """
+
+    def __init__(self, factory, size=10, timeout=None, max_idle=60):
+        self.factory = factory
+        self.size = size
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self.idle = []          # tuples of connection and time of last use
+        self.used = {}          # checked out connections and their owners
+        self.inflight = 0       # requests currently sent via the pool
+        self.condition = Condition(Lock())
+        self.stats = dict(created=0, reused=0, evicted=0, dropped=0,
+            reclaimed=0, waits=0, timeouts=0)
+
+    def checkout(self):
+        """ return an idle connection or open a new one;  if all connections
+            are in use, wait up to `timeout` seconds for one to be returned """
+        deadline = self.timeout and time() + self.timeout or None
+        self.condition.acquire()
+        try:
+            waited = False
+            while True:
+                self.evict()
+                while self.idle:
+                    conn, last = self.idle.pop()
+                    if isDropped(conn):
+                        logger.debug('closing dropped connection %r', conn)
+                        self.stats['dropped'] += 1
+                        conn.close()    # it'll get reopened on next use
+                    self.stats['reused'] += 1
+                    del conn.xmlbody[:]     # drop requests never flushed
+                    conn.fallbacks.clear()
+                    return self.use(conn)
+                if len(self.used) < self.size or self.reclaim():
+                    self.stats['created'] += 1
+                    return self.use(self.factory())
+                if not waited:
+                    self.stats['waits'] += 1
+                    waited = True
+                if deadline is None:
+                    self.condition.wait()
+                else:
+                    remaining = deadline - time()
+                    if remaining <= 0:
+                        self.stats['timeouts'] += 1
+                        raise SolrConnectionPoolExhausted('all %d connections '
+                            'are in use' % self.size)
+                    self.condition.wait(remaining)
+        finally:
+            self.condition.release()
+
+    def checkin(self, conn):
+        """ return a connection to the pool of idle connections;  ones the
+            pool doesn't know about (anymore), e.g. after it was cleared,
+            get closed instead """
+        self.condition.acquire()
+        try:
+            if self.used.pop(id(conn), None) is not None:
+                conn.setTimeout(None)
+                self.idle.append((conn, time()))
+                self.condition.notify()
+            elif conn not in [idle for idle, last in self.idle]:
+                logger.debug('closing foreign connection %r', conn)
+                conn.close()
+        finally:
+            self.condition.release()
+
+    def track(self, delta):
+        """ adjust the number of requests in flight, see `doPost` """
+        self.condition.acquire()
+        try:
+            self.inflight += delta
+        finally:
+            self.condition.release()
+
+    def clear(self):
+        """ close all idle connections and forget about the used ones """
+        self.condition.acquire()
+        try:
+            for conn, last in self.idle:
+                conn.close()
+            del self.idle[:]
+            self.used.clear()
+            self.condition.notifyAll()
+        finally:
+            self.condition.release()
+
+    def statistics(self):
+        """ return usage statistics of the pool """
+        self.condition.acquire()
+        try:
+            stats = self.stats.copy()
+            stats.update(size=self.size, used=len(self.used),
+                idle=len(self.idle), inflight=self.inflight)
+            return stats
+        finally:
+            self.condition.release()
+
+    # helper methods, to be called with the lock held
+
+    def use(self, conn):
+        conn.pool = self
+        self.used[id(conn)] = conn, currentThread()
+        return conn
+
+    def evict(self):
+        """ close connections that have been idle for too long """
+        if not self.max_idle:
+            return
+        limit = time() - self.max_idle
+        while self.idle and self.idle[0][1] < limit:
+            conn, last = self.idle.pop(0)
+            logger.debug('closing idle connection %r', conn)
+            self.stats['evicted'] += 1
+            conn.close()
+
+    def reclaim(self):
+        """ free slots of connections held by threads that have ended """
+        dead = [key for key, (conn, thread) in self.used.items()
+            if not thread.isAlive()]
+        for key in dead:
+            conn, thread = self.used.pop(key)
+            logger.debug('reclaiming connection %r from %r', conn, thread)
+            self.stats['reclaimed'] += 1
+            conn.close()
+        return bool(dead)
@@ -0,0 +1,90 @@
+from httplib import HTTPException
+from logging import getLogger
+from random import shuffle
+from socket import error
+from threading import Lock, Thread
+from time import sleep
+
+from collective.solr.exceptions import SolrConnectionPoolExhausted
+
+logger = getLogger('collective.solr.routing')
+
+
+def parseEndpoint(value):
+    """ parse a "host:port/base" specification of a solr instance into a
+        tuple of host, port and base, like the ones used as pool keys """
+    value = value.strip()
+    if '/' in value:
+        address, base = value.split('/', 1)
+        base = '/' + base.rstrip('/')
+    else:
+        address, base = value, '/solr'
+    host, sep, port = address.partition(':')
+    return host, int(port or 8983), base != '/' and base or '/solr'
+
+
+class SolrNode(object):
+    """ a replica of the solr master along with its connection pool and
+        health state;  unhealthy nodes get checked in the background until
+        they respond again """
+
+    def __init__(self, key, pool):
+        self.key = key
+        self.pool = pool
+        self.healthy = True
+        self.lock = Lock()
+
+    def __repr__(self):
+        return '<SolrNode %s:%d%s>' % self.key
+
+    def outstanding(self):
+        """ returns the number of requests currently sent to the node """
+        return self.pool.inflight
+
+    def eject(self, retry=30):
+        """ take the node out of service and start checking it again
+            every `retry` seconds;  returns `False` if it already was """
+        self.lock.acquire()
+        try:
+            if not self.healthy:
+                return False
+            self.healthy = False
+        finally:
+            self.lock.release()
+        logger.warning('taking replica %s:%d%s out of service', *self.key)
+        thread = Thread(target=self.recover, args=(retry,))
+        thread.setDaemon(True)
+        thread.start()
+        return True
+
+    def probe(self):
+        """ check if the node is responding (again) """
+        conn = None
+        try:
+            try:
+                conn = self.pool.checkout()
+                return conn.ping()
+            except (error, HTTPException, SolrConnectionPoolExhausted):
+                return False
+        finally:
+            if conn is not None:
+                self.pool.checkin(conn)
+
+    def recover(self, retry):
+        while True:
+            sleep(retry)
+            if self.probe():
+                break
+        logger.info('putting replica %s:%d%s back into service', *self.key)
+        self.healthy = True
+
+
+def pickNode(nodes):
+    """ returns the healthy node with the least outstanding requests or
+        `None` if there is none;  ties are broken randomly, so that idle
+        nodes share the load """
+    healthy = [node for node in nodes if node.healthy]
+    if not healthy:
+        return None
+    shuffle(healthy)
+    return min(healthy, key=lambda node: node.outstanding())
@@ -1,4 +1,9 @@
-from logging import getLogger
+from hashlib import md5
+from httplib import HTTPException
+from logging import getLogger, DEBUG
+from socket import error
+from StringIO import StringIO
+from threading import Thread
 from time import time
 from zope.interface import implements
 from zope.component import queryUtility
@@ -7,16 +12,39 @@ from Missing import MV
 from collective.solr.interfaces import ISolrConnectionConfig
 from collective.solr.interfaces import ISolrConnectionManager
 from collective.solr.interfaces import ISearch
-from collective.solr.parser import SolrResponse
 from collective.solr.exceptions import SolrInactiveException
+from collective.solr.exceptions import SolrUnavailableException
 from collective.solr.queryparser import quote
+from collective.solr.solr import SolrException
+from collective.solr.utils import getRequestMemo
 from collective.solr.utils import isWildCard
 from collective.solr.utils import prepare_wildcard
+from collective.solr.utils import serializeQuery
 
 
 logger = getLogger('collective.solr.search')
 
 
+def isLiteralList(values):
+    """ check if the given values can be searched using the terms query
+        parser, which splits them at commas and takes them literally, i.e.
+        none of them may contain wildcards, quotes or operators """
+    for value in values:
+        if not isinstance(value, basestring) or not value:
+            return False
+        if value[0] in '+-' or [char for char in ',*?"' if char in value]:
+            return False
+    return True
+
+
+def isServerError(exception):
+    """ check if a failed search indicates a problem with solr itself
+        rather than with the query """
+    if isinstance(exception, SolrException):
+        return int(exception.httpcode) >= 500
+    return True
+
+
 class Search(object):
     """ a search utility for solr """
     implements(ISearch)
@@ -30,14 +58,70 @@ class Search(object):
         return self.manager
 
     def search(self, query, **parameters):
-        """ perform a search with the given querystring and parameters """
+        """ perform a search with the given querystring and parameters;
+            identical searches within one request share their response """
+        memo = getRequestMemo('searches')
+        if memo is None:
+            return self.fetch(query, parameters)
+        if isinstance(query, dict):
+            key = repr((sorted(query.items()), sorted(parameters.items())))
+        else:
+            key = repr((query, sorted(parameters.items())))
+        if key not in memo:
+            memo[key] = self.fetch(query, parameters).clone()
+        return memo[key].clone()
+
+    __call__ = search
+
+    def fetch(self, query, parameters):
+        """ send the search to solr unless it's been cached """
         start = time()
         config = queryUtility(ISolrConnectionConfig)
         manager = self.getManager()
         manager.setSearchTimeout()
-        connection = manager.getConnection()
+        connection = manager.getConnection(readonly=True)
         if connection is None:
             raise SolrInactiveException
+        schema = manager.getSchema()    # before the response is pending
+        query, parameters = self.prepare(query, parameters, schema)
+        cache = manager.getSearchCache()
+        key = None
+        if cache is not None:
+            key = cache.key(connection.codec.name, query, parameters)
+            cached = cache.get(key)
+            if cached is not None:
+                data, fresh = cached
+                if not fresh and cache.claim(key):
+                    self.revalidate(cache, key, query, parameters)
+                manager.setTimeout(None, readonly=True)
+                return connection.codec.parse(StringIO(data), schema=schema)
+        breaker = manager.getBreaker()
+        if breaker is not None and not breaker.allow():
+            raise SolrUnavailableException
+        try:
+            results = self.send(connection, query, parameters, schema,
+                cache, key)
+        except (error, HTTPException, SolrException), e:
+            if breaker is not None:
+                if isServerError(e):
+                    breaker.failure()
+                else:
+                    breaker.success()
+            raise
+        manager.setTimeout(None, readonly=True)
+        elapsed = (time() - start) * 1000
+        if breaker is not None:
+            breaker.success(elapsed)
+        slow = config.slow_query_threshold
+        if slow and elapsed >= slow:
+            logger.info('slow query: %d/%d ms for %r (%r)',
+                results.responseHeader['QTime'], elapsed, query, parameters)
+        logger.debug('highlighting info: %s' % getattr(results, 'highlighting', {}))
+        return results
+
+    def prepare(self, query, parameters, schema=None):
+        """ apply the configured defaults to the given query and parameters """
+        config = queryUtility(ISolrConnectionConfig)
         if not 'rows' in parameters:
             parameters['rows'] = config.max_results or ''
             logger.info('falling back to "max_results" (%d) without a "rows" '
@@ -54,39 +138,176 @@ class Search(object):
                 parameters['fl'] = ' '.join(config.field_list)
             else:
                 parameters['fl'] = '* score'
-        if isinstance(query, dict):
-            query = ' '.join(query.values())
-        logger.debug('searching for %r (%r)', query, parameters)
+        if isinstance(query, dict):     # clauses are ordered by index
+            clauses = [value for name, value in sorted(query.items())]
+            # local parameters are only recognized at the very beginning,
+            # so those clauses need to go into separate filter queries
+            local = [clause for clause in clauses if clause.startswith('{!')]
+            if local:
+                fq = parameters.get('fq', [])
+                if not isinstance(fq, (list, tuple)):
+                    fq = [fq]
+                parameters['fq'] = list(fq) + local
+                clauses = [c for c in clauses if not c.startswith('{!')]
+            query = ' '.join(clauses) or '*:*'
+        if isinstance(parameters.get('fq'), (list, tuple)):
+            parameters['fq'] = sorted(set(parameters['fq']))
+        if logger.isEnabledFor(DEBUG):
+            key = md5(serializeQuery(query, parameters)).hexdigest()
+            logger.debug('searching for %r (%r), key %s', query, parameters,
+                key)
         if 'sort' in parameters:    # issue warning for unknown sort indices
             index, order = parameters['sort'].split()
-            schema = manager.getSchema() or {}
-            field = schema.get(index, None)
-            if field is None or not field.stored:
+            if index not in getattr(schema, 'stored', ()):
                 logger.warning('sorting on non-stored attribute "%s"', index)
-        response = connection.search(q=query, **parameters)
-        results = SolrResponse(response)
+        return query, parameters
+
+    def searchMany(self, searches, timeout=None):
+        """ perform several searches at the same time, each on a separate
+            pooled connection;  `searches` is a sequence of tuples of query
+            and parameters and the responses are returned in the same order,
+            with `None` for searches that failed or didn't complete within
+            `timeout` seconds (or the configured search timeout) """
+        config = queryUtility(ISolrConnectionConfig)
+        manager = self.getManager()
+        if not getattr(config, 'active', False) or config.host is None:
+            raise SolrInactiveException
+        breaker = manager.getBreaker()
+        if breaker is not None and not breaker.allow():
+            raise SolrUnavailableException
+        timeout = timeout or config.search_timeout or None
+        settings = manager.getSettings(config)
+        schema = manager.getSchema()
+        results = [None] * len(searches)
+        threads = []
+        for index, (query, parameters) in enumerate(searches):
+            query, parameters = self.prepare(query, dict(parameters), schema)
+            thread = Thread(target=self.run, args=(results, index,
+                manager.getSearchPool(), settings, timeout, breaker, query,
+                parameters, schema))
+            thread.setDaemon(True)
+            thread.start()
+            threads.append(thread)
+        deadline = timeout and time() + timeout
+        for thread in threads:
+            if deadline:
+                thread.join(max(deadline - time(), 0))
+            else:
+                thread.join()
+        return list(results)
+
+    def run(self, results, index, pool, settings, timeout, breaker, query,
+            parameters, schema):
+        """ perform one of several parallel searches, see `searchMany` """
+        start = time()
+        conn = None
+        try:
+            try:
+                conn = pool.checkout()
+                for key, value in settings.items():
+                    setattr(conn, key, value)
+                conn.setTimeout(timeout)
+                response = conn.search(q=query, **parameters)
+                result = conn.codec.parse(response, schema=schema)
+                response.close()
+            except (error, HTTPException, SolrException), e:
+                logger.warning('search for %r (%r) failed: %s', query,
+                    parameters, e)
+                if conn is not None:
+                    conn.close()            # it might still be in use
+                if breaker is not None:
+                    if isServerError(e):
+                        breaker.failure()
+                    else:
+                        breaker.success()
+            except Exception:   # the result is `None` then, see `searchMany`
+                logger.exception('search for %r (%r) failed', query,
+                    parameters)
+                if conn is not None:
+                    conn.close()
+            else:
+                results[index] = result
+                if breaker is not None:
+                    breaker.success((time() - start) * 1000)
+        finally:
+            if conn is not None:
+                pool.checkin(conn)
+
+    def revalidate(self, cache, key, query, parameters):
+        """ fetch a stale search response again in the background, so that
+            it can be served from the cache in the meantime """
+        config = queryUtility(ISolrConnectionConfig)
+        manager = self.getManager()
+        thread = Thread(target=self.refresh, args=(cache, key,
+            manager.getSearchPool(), manager.getSettings(config),
+            config.search_timeout or None, query, parameters))
+        thread.setDaemon(True)
+        thread.start()
+
+    def refresh(self, cache, key, pool, settings, timeout, query,
+            parameters):
+        """ update a cached search response, see `revalidate` """
+        generation = cache.generation
+        conn = None
+        try:
+            try:
+                conn = pool.checkout()
+                for name, value in settings.items():
+                    setattr(conn, name, value)
+                conn.setTimeout(timeout)
+                response = conn.search(q=query, **parameters)
+                cache.set(key, response.read(), generation)
+                response.close()
+            except (error, HTTPException, SolrException), e:
+                logger.warning('refreshing search for %r (%r) failed: %s',
+                    query, parameters, e)
+                if conn is not None:
+                    conn.close()
+        finally:
+            if conn is not None:
+                pool.checkin(conn)
+            cache.refreshing.discard(key)
+
+    def send(self, connection, query, parameters, schema=None, cache=None,
+            key=None):
+        """ send the search request and parse the response;  failing
+            replicas are taken out of service and the search is retried
+            using the next one (or the master);  if a `cache` is given,
+            the response is stored under `key` """
+        manager = self.getManager()
+        if cache is not None:
+            generation = cache.generation   # before the index can change
+        while True:
+            try:
+                response = connection.search(q=query, **parameters)
+                break
+            except (error, HTTPException):
+                if not manager.failover(connection):
+                    raise
+                manager.setSearchTimeout()
+                connection = manager.getConnection(readonly=True)
+        if cache is not None:
+            data = response.read()
+            response.close()
+            cache.set(key, data, generation)
+            response = StringIO(data)
+        results = connection.codec.parse(response, schema=schema)
         response.close()
-        manager.setTimeout(None)
-        elapsed = (time() - start) * 1000
-        slow = config.slow_query_threshold
-        if slow and elapsed >= slow:
-            logger.info('slow query: %d/%d ms for %r (%r)',
-                results.responseHeader['QTime'], elapsed, query, parameters)
-        logger.debug('highlighting info: %s' % getattr(results, 'highlighting', {}))
         return results
 
-    __call__ = search
-
     def buildQuery(self, default=None, **args):
         """ helper to build a querystring for simple use-cases """
         logger.debug('building query for "%r", %r', default, args)
         schema = self.getManager().getSchema() or {}
         defaultSearchField = getattr(schema, 'defaultSearchField', None)
+        config = queryUtility(ISolrConnectionConfig)
+        threshold = getattr(config, 'terms_threshold', 0)
+        indexed = getattr(schema, 'indexed', ())
         args[None] = default
         query = {}
         for name, value in sorted(args.items()):
             field = schema.get(name or defaultSearchField, None)
-            if field is None or not field.indexed:
+            if field is None or (name or defaultSearchField) not in indexed:
                 logger.info('dropping unknown search attribute "%s" '
                     ' (%r) for query: %r', name, value, args)
                 continue
@@ -107,6 +328,16 @@ class Search(object):
                     assert len(value) == 2      # just to make sure
                     continue                    # skip when "true or false"
                 value = str(value.pop()).lower()
+            elif isinstance(value, (tuple, list)) and name and threshold and \
+                    len(value) > threshold and \
+                    field.class_ == 'solr.StrField' and isLiteralList(value):
+                # large lists of literals are searched using the terms
+                # query parser, see `prepare`
+                value = [isinstance(term, unicode) and term.encode('utf-8')
+                    or term for term in value]
+                query[name] = '{!terms f=%s}%s' % (name,
+                    ','.join(sorted(set(value))))
+                continue
             elif isinstance(value, (tuple, list)):
                 # list items should be treated as literals, but
                 # nevertheless only get quoted when necessary
@@ -117,12 +348,12 @@ class Search(object):
                     if not quoted.startswith('"') and not quoted == term:
                         quoted = quote('"' + term + '"')
                     return quoted
-                value = '(%s)' % ' OR '.join(map(quoteitem, value))
+                value = '(%s)' % ' OR '.join(sorted(map(quoteitem, value)))
             elif isinstance(value, set):        # sets are taken literally
                 if len(value) == 1:
                     query[name] = ''.join(value)
                 else:
-                    query[name] = '(%s)' % ' OR '.join(value)
+                    query[name] = '(%s)' % ' OR '.join(sorted(value))
                 continue
             elif isinstance(value, basestring):
                 if field.class_ == 'solr.TextField':
@@ -30,17 +30,34 @@
 import sys
 import httplib
 import socket
-from xml.etree.cElementTree import fromstring
-from xml.sax.saxutils import escape
 import codecs
-import urllib
-from collective.solr.parser import SolrSchema
+from random import random
+from threading import Lock
+from time import time, sleep
+from collective.solr.codec import escapeKey, escapeVal, formats
+from collective.solr.compression import gzip, decompressing
+from collective.solr.parser import SolrResponse, SolrSchema
+from collective.solr.utils import serializeQuery
 from collective.solr.timeout import HTTPConnectionWithTimeout
-from collective.solr.utils import translation_map
 
 from logging import getLogger
 logger = getLogger(__name__)
 
+# process-wide counters of retried requests, see `SolrConnection.backoff`
+retries = dict(retries=0, skipped=0, exhausted=0, expired=0)
+retriesLock = Lock()
+
+# http status codes of errors not caused by the sent request itself
+unavailable = ('502', '503', '504')
+
+
+def count(name):
+    retriesLock.acquire()
+    try:
+        retries[name] += 1
+    finally:
+        retriesLock.release()
+
 
 class SolrException(Exception):
     """ An exception thrown by solr connections """
@@ -61,11 +78,26 @@ class SolrException(Exception):
 class SolrConnection:
 
     def __init__(self, host='localhost:8983', solrBase='/solr',
-                 persistent=True, postHeaders={}, timeout=None):
+                 persistent=True, postHeaders={}, timeout=None,
+                 maxBatchSize=1000, maxBatchBytes=4194304, codec=None,
+                 compressThreshold=0, compressLevel=6,
+                 compressResponses=False, retryAttempts=2, retryDelay=0,
+                 retryDeadline=0):
         self.host = host
         self.solrBase = solrBase
         self.persistent = persistent
+        self.maxBatchSize = maxBatchSize
+        self.maxBatchBytes = maxBatchBytes
+        self.compressThreshold = compressThreshold
+        self.compressLevel = compressLevel
+        self.compressResponses = compressResponses
+        self.retryAttempts = retryAttempts
+        self.retryDelay = retryDelay
+        self.retryDeadline = retryDeadline
         self.reconnects = 0
+        self.failures = 0       # requests that couldn't be sent
+        self.pool = None        # set when checked out from a pool
+        self.codec = codec or formats['xml']
         self.encoder = codecs.getencoder('utf-8')
         # responses from Solr will always be in UTF-8
         self.decoder = codecs.getdecoder('utf-8')
@@ -73,6 +105,7 @@ class SolrConnection:
         self.conn = HTTPConnectionWithTimeout(self.host, timeout=timeout)
         # self.conn.set_debuglevel(1000000)
         self.xmlbody = []
+        self.fallbacks = {}     # functions replacing rejected updates
         self.xmlheaders = {'Content-Type': 'text/xml; charset=utf-8'}
         self.xmlheaders.update(postHeaders)
         if not self.persistent:
@@ -112,21 +145,82 @@ class SolrConnection:
         logger.debug('setting socket timeout on %r: %s', self, timeout)
         self.conn.setTimeout(timeout)
 
-    def doPost(self, url, body, headers):
+    def backoff(self, attempt, start, idempotent=True):
+        """ returns the number of seconds to wait before the next attempt
+            to send a failed request or `None` if it shouldn't be retried,
+            because it isn't idempotent, or the maximum number of attempts
+            or the deadline has been reached;  connection failures get an
+            additional immediate retry beforehand, see `sendPost` """
+        if not idempotent:
+            count('skipped')
+            return None
+        if attempt >= self.retryAttempts:
+            count('exhausted')
+            return None
+        delay = self.retryDelay * 2 ** (attempt - 1)
+        delay = delay / 2 + random() * delay / 2    # add some jitter
+        if self.retryDeadline and time() + delay > start + self.retryDeadline:
+            count('expired')
+            return None
+        count('retries')
+        return delay
+
+    def doPost(self, url, body, headers, idempotent=True):
+        # the pool keeps track of the requests in flight, so that searches
+        # can be routed to the least busy replica
+        pool = self.pool
+        if pool is not None:
+            pool.track(1)
         try:
-            self.conn.request('POST', url, body, headers)
-            return self.__errcheck(self.conn.getresponse())
-        except (socket.error, httplib.CannotSendRequest,
-            httplib.ResponseNotReady, httplib.BadStatusLine):
-            # Reconnect in case the connection was broken from the server
-            # going down, the server timing out our persistent connection, or
-            # another network failure. Also catch httplib.CannotSendRequest,
-            # httlib.ResponseNotReady and httlib.BadStatusLine because the
-            # HTTPConnection object can get in a bad state (seems like they
-            # might be "ghosted" in the zodb).
-            self.__reconnect()
-            self.conn.request('POST', url, body, headers)
-            return self.__errcheck(self.conn.getresponse())
+            return self.sendPost(url, body, headers, idempotent)
+        finally:
+            if pool is not None:
+                pool.track(-1)
+
+    def sendPost(self, url, body, headers, idempotent=True):
+        if self.compressResponses:
+            headers = dict(headers, **{'Accept-Encoding': 'gzip, deflate'})
+        start, attempt, reconnect, reconnected = time(), 1, False, False
+        while True:
+            try:
+                if reconnect:
+                    self.__reconnect()
+                self.conn.request('POST', url, body, headers)
+                return self.__errcheck(decompressing(self.conn.getresponse()))
+            except (socket.error, httplib.CannotSendRequest,
+                httplib.ResponseNotReady, httplib.BadStatusLine), e:
+                # Reconnect in case the connection was broken from the server
+                # going down, the server timing out our persistent connection,
+                # or another network failure. Also catch
+                # httplib.CannotSendRequest, httlib.ResponseNotReady and
+                # httlib.BadStatusLine because the HTTPConnection object can
+                # get in a bad state (seems like they might be "ghosted" in
+                # the zodb).
+                reconnect = True
+                if not reconnected:
+                    # the first failure most likely means the persistent
+                    # connection was stale, i.e. the request either didn't
+                    # make it to solr or wasn't processed, so it's retried
+                    # once right away, even if it's not idempotent
+                    reconnected = True
+                    logger.debug('reconnecting to retry request to %s after '
+                        'failure: %s', url, e)
+                    continue
+                delay = self.backoff(attempt, start, idempotent)
+                if delay is None:
+                    self.conn.close()
+                    raise
+            except SolrException, e:
+                if e.httpcode != 503:   # e.g. while solr is starting up
+                    raise
+                reconnect = False
+                delay = self.backoff(attempt, start, idempotent)
+                if delay is None:
+                    raise
+            logger.warning('retrying request to %s in %.2f seconds after '
+                'attempt %d failed: %s', url, delay, attempt, e)
+            sleep(delay)
+            attempt += 1
 
     def doUpdateXML(self, request):
         # solr will support abort/rollback only from version 1.4, so
@@ -135,97 +229,134 @@ class SolrConnection:
         logger.debug('storing xml request for later: %r', request)
         self.xmlbody.append(request)
 
+    def batches(self, requests):
+        """ group consecutive <add> and <delete> requests, so that they can
+            be sent in one go, respecting the maximum number of requests
+            as well as the maximum size of the resulting body """
+        batches = []
+        current, head, size = None, None, 0
+        for request in requests:
+            parts = self.codec.split(request)
+            if parts is None:           # <commit/>, <optimize/> etc
+                batches.append([request])
+                current = None
+                continue
+            if current is not None and parts[0] == head and \
+                    len(current) < self.maxBatchSize and \
+                    size + len(parts[1]) <= self.maxBatchBytes:
+                current.append(request)
+                size += len(parts[1])
+            else:
+                current, head, size = [request], parts[0], len(request)
+                batches.append(current)
+        return batches
+
     def flush(self):
         """ send out the stored requests to solr """
-        count = 0
         responses = []
-        for request in self.xmlbody:
+        batches = self.batches(self.xmlbody)
+        for index, batch in enumerate(batches):
             try:
-                responses.append(self.doSendXML(request))
-            except (SolrException, socket.error):
-                logger.exception('exception during request %r', request)
-            count += len(request)
-        logger.debug('flushed out %d bytes in %d requests',
-            count, len(self.xmlbody))
+                responses.extend(self.sendBatch(batch))
+            except (SolrException, socket.error, httplib.HTTPException):
+                # solr is unavailable, so there's no point in sending the
+                # rest, which is counted as failed as a whole
+                remaining = sum(map(len, batches[index:]))
+                logger.exception('solr unavailable, dropping %d requests',
+                    remaining)
+                self.failures += remaining
+                break
+        logger.debug('flushed out %d requests in %d batches',
+            len(self.xmlbody), len(batches))
         del self.xmlbody[:]
+        self.fallbacks.clear()
         return responses
 
+    def sendBatch(self, requests):
+        """ send the given requests merged into one;  if solr rejects them,
+            the batch is bisected to isolate the failing request(s), which
+            are logged and counted in `failures`;  network errors and ones
+            indicating that solr (or a proxy in front of it) is unavailable
+            are raised, as they're not caused by the documents themselves """
+        request = self.codec.merge(requests)
+        try:
+            return [self.doSendXML(request)]
+        except SolrException, e:
+            if str(e.httpcode) in unavailable:
+                raise
+            if len(requests) > 1:
+                logger.warning('batch of %d requests failed, bisecting',
+                    len(requests))
+                middle = len(requests) // 2
+                return self.sendBatch(requests[:middle]) + \
+                    self.sendBatch(requests[middle:])
+            fallback = self.fallbacks.pop(request, None)
+            if fallback is not None and str(e.httpcode) == '409':
+                # the document to be updated doesn't exist (yet)
+                replacement = fallback()
+                if replacement is not None:
+                    logger.info('update was rejected, sending %r instead',
+                        replacement)
+                    return self.sendBatch([replacement])
+            logger.exception('exception during request %r', request)
+        self.failures += 1
+        return []
+
     def doSendXML(self, request):
+        headers = dict(self.xmlheaders, **{'Content-Type':
+            self.codec.contentType})
+        idempotent = self.codec.idempotent(request)     # before compressing
+        if self.compressThreshold and len(request) >= self.compressThreshold:
+            size = len(request)
+            request = gzip(request, self.compressLevel)
+            headers['Content-Encoding'] = 'gzip'
+            logger.debug('compressed request from %d to %d bytes',
+                size, len(request))
         try:
-            rsp = self.doPost(self.solrBase+'/update', request,
-                self.xmlheaders)
+            rsp = self.doPost(self.solrBase + self.codec.updatePath, request,
+                headers, idempotent=idempotent)
             data = rsp.read()
         finally:
             if not self.persistent:
                 self.conn.close()
         #detect old-style error response (HTTP response code of
         #200 with a non-zero status.
-        parsed = fromstring(self.decoder(data)[0])
-        status = parsed.attrib.get('status', 0)
-        if status != 0:
-            reason = parsed.documentElement.firstChild.nodeValue
+        parsed = self.codec.loads(self.decoder(data)[0])
+        reason = self.codec.error(parsed)
+        if reason is not None:
             raise SolrException(rsp.status, reason)
         return parsed
 
     def escapeVal(self, val):
-        if isinstance(val, unicode):
-            val = val.encode('utf-8')
-        else:
-            val = str(val)
-        return escape(val.translate(translation_map))
+        return escapeVal(val)
 
     def escapeKey(self, key):
-        if isinstance(key, unicode):
-            key = key.encode('utf-8')
-        else:
-            key = str(key)
-        key = key.replace("&", "&amp;")
-        key = key.replace('"', "&quot;")
-        return key
+        return escapeKey(key)
 
     def delete(self, id):
-        xstr = '<delete><id>%s</id></delete>' % self.escapeVal(id)
-        return self.doUpdateXML(xstr)
+        return self.doUpdateXML(self.codec.delete(id))
 
     def deleteByQuery(self, query):
-        xstr = '<delete><query>%s</query></delete>' % self.escapeVal(query)
-        return self.doUpdateXML(xstr)
+        return self.doUpdateXML(self.codec.deleteByQuery(query))
 
     def add(self, boost_values=None, **fields):
         within = fields.pop('commitWithin', None)
-        if within:
-            lst = ['<add commitWithin="%s">' % str(within)]
-        else:
-            lst = ['<add>']
-        if boost_values is None:
-            boost_values = {}
-        if '' in boost_values:      # boost value for the entire document
-            lst.append('<doc boost="%s">' % boost_values[''])
-        else:
-            lst.append('<doc>')
-        for f, v in fields.items():
-            if f in boost_values:
-                tmpl = '<field name="%s" boost="%s">%%s</field>' % (
-                    self.escapeKey(f), boost_values[f])
-            else:
-                tmpl = '<field name="%s">%%s</field>' % self.escapeKey(f)
-            if isinstance(v, (list, tuple)): # multi-valued
-                for value in v:
-                    lst.append(tmpl % self.escapeVal(value))
-            else:
-                lst.append(tmpl % self.escapeVal(v))
-        lst.append('</doc>')
-        lst.append('</add>')
-        xstr = ''.join(lst)
-        return self.doUpdateXML(xstr)
+        return self.doUpdateXML(self.codec.add(fields, boost_values, within))
+
+    def update(self, modifiers, fallback=None, **fields):
+        """ atomically update an existing document, i.e. only change the
+            fields given in `modifiers`, which maps their names to the kind
+            of update, e.g. "set";  the unique key identifies the document;
+            if solr rejects the update because of a version conflict, the
+            request returned by calling `fallback` gets sent instead """
+        within = fields.pop('commitWithin', None)
+        request = self.codec.add(fields, None, within, modifiers)
+        if fallback is not None:
+            self.fallbacks[request] = fallback
+        return self.doUpdateXML(request)
 
     def commit(self, waitFlush=True, waitSearcher=True, optimize=False):
-        data = {'committype': optimize and 'optimize' or 'commit',
-                'nowait': not waitSearcher and ' waitSearcher="false"' or '',
-                'noflush': not waitFlush and not waitSearcher and \
-                    ' waitFlush="false"' or ''}
-        xstr = '<%(committype)s%(noflush)s%(nowait)s/>' % data
-        self.doUpdateXML(xstr)
+        self.doUpdateXML(self.codec.commit(waitFlush, waitSearcher, optimize))
         return self.flush()
 
     def abort(self):
@@ -236,6 +367,7 @@ class SolrConnection:
         logger.debug('aborting %d requests: %r',
             len(self.xmlbody), self.xmlbody)
         del self.xmlbody[:]
+        self.fallbacks.clear()
 
     def search(self, **params):
         # XXX: Ugly hack. Needs to be properly fixed!!!
@@ -244,7 +376,9 @@ class SolrConnection:
         if not '\\/Plone' in params['q']:
             params['q'] = params['q'].replace('/Plone', "\\/Plone")
         # XXX: Ugly hack. Needs to be properly fixed!!!
-        request = urllib.urlencode(params, doseq=True)
+        for key, value in self.codec.params.items():
+            params.setdefault(key, value)
+        request = serializeQuery(None, params)
         logger.debug('sending request: %s' % request)
         try:
             response = self.doPost('%s/select' % self.solrBase, request,
@@ -255,6 +389,35 @@ class SolrConnection:
         return response
 
     def getSchema(self):
+        return SolrSchema(self.getSchemaData())
+
+    def ping(self):
+        """ check if the server is up using its ping request handler """
+        url = '%s/admin/ping' % self.solrBase
+        try:
+            self.conn.request('GET', url)
+            response = self.conn.getresponse()
+        except (socket.error, httplib.CannotSendRequest,
+            httplib.ResponseNotReady, httplib.BadStatusLine):
+            # see `doPost` method for more info about these exceptions
+            self.__reconnect()
+            self.conn.request('GET', url)
+            response = self.conn.getresponse()
+        response.read()
+        return response.status == 200
+
+    def getIndexVersion(self):
+        """ return the version of the index, which changes with every
+            commit, as reported by solr's luke request handler """
+        response = self.doPost('%s/admin/luke' % self.solrBase,
+            'numTerms=0&wt=xml', self.formheaders)
+        try:
+            return SolrResponse(response).index.get('version')
+        finally:
+            response.close()
+
+    def getSchemaData(self):
+        """ return the contents of solr's `schema.xml` """
         schema_urls = ('%s/admin/file/?file=schema.xml',        # solr 1.3
                        '%s/admin/get-file.jsp?file=schema.xml') # solr 1.2
         for url in schema_urls:
@@ -269,7 +432,6 @@ class SolrConnection:
                 self.conn.request('GET', url % self.solrBase)
                 response = self.conn.getresponse()
             if response.status == 200:
-                xml = response.read()
-                return SolrSchema(xml.strip())
+                return response.read().strip()
             self.__reconnect()          # force a new connection for each url
         self.__errcheck(response)       # raise a solrexception
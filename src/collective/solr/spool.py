@@ -0,0 +1,255 @@
+from httplib import HTTPException
+from json import dump, load
+from logging import getLogger
+from os import listdir, makedirs, remove, rename, fsync
+from os.path import exists, join
+from socket import error
+from threading import Condition, Lock, Thread
+from time import time, sleep
+
+from App.config import getConfiguration
+
+from collective.solr.codec import formats
+from collective.solr.solr import SolrException
+
+logger = getLogger('collective.solr.spool')
+
+# process-wide spools, keyed by their directory
+spools = {}
+spoolsLock = Lock()
+
+
+def queuePath():
+    """ returns the directory used to queue updates of this instance or
+        `None` if it doesn't have one;  it's kept apart from the ones of
+        other zeo clients, as their workers would compete for the same
+        files, and it's not configurable through the web, so that nobody
+        can make the worker send files placed elsewhere """
+    home = getattr(getConfiguration(), 'clienthome', None)
+    return home and join(home, 'solr-queue') or None
+
+
+def created(name):
+    """ returns the time a spool file was written, which is encoded in its
+        name as microseconds since the epoch """
+    return int(name.split('-', 1)[0]) / 1e6
+
+
+class UpdateSpool(object):
+    """ a durable queue of update requests, which are stored in the given
+        directory, one file per committed transaction, and sent to solr in
+        batches by a worker thread;  files are only removed once solr has
+        accepted their requests, so nothing is lost after a restart, and
+        the single worker keeps updates in the order they were committed;
+        the directory mustn't be shared with other processes (see
+        `queuePath`) and the files are stored as json, i.e. reading them
+        doesn't run any code """
+
+    suffix = '.updates'
+    maxFiles = 100              # number of transactions sent in one go
+
+    def __init__(self, path, pool, retry=10, timeout=None, settings=None):
+        self.path = path
+        self.pool = pool
+        self.retry = retry
+        self.timeout = timeout
+        self.settings = settings or {}      # attributes for connections
+        self.condition = Condition(Lock())
+        self.counter = 0
+        self.worker = None
+        self.stats = dict(sent=0, failures=0)
+        if not exists(path):
+            makedirs(path)
+
+    def pending(self):
+        """ returns the names of the queued files, oldest first """
+        names = [name for name in listdir(self.path)
+            if name.endswith(self.suffix)]
+        return sorted(names)
+
+    def put(self, codec, requests):
+        """ store the update requests of a committed transaction, encoded
+            by the given codec, and wake up the worker """
+        self.condition.acquire()
+        try:
+            self.counter = (self.counter + 1) % 1000000
+            name = '%016d-%06d' % (time() * 1e6, self.counter)
+            tmp = join(self.path, name + '.tmp')
+            output = open(tmp, 'wb')
+            try:
+                dump((codec, list(requests)), output)
+                output.flush()
+                fsync(output.fileno())
+            finally:
+                output.close()
+            rename(tmp, join(self.path, name + self.suffix))
+            logger.debug('queued %d requests as %s', len(requests), name)
+            self.condition.notify()
+        finally:
+            self.condition.release()
+        self.start()
+
+    def start(self):
+        """ start the worker thread unless it's already running """
+        self.condition.acquire()
+        try:
+            if self.worker is None or not self.worker.isAlive():
+                self.worker = Thread(target=self.run,
+                    name='solr-spool-worker')
+                self.worker.setDaemon(True)
+                self.worker.start()
+        finally:
+            self.condition.release()
+
+    def wait(self):
+        """ block until there are queued files and return their names """
+        self.condition.acquire()
+        try:
+            while True:
+                names = self.pending()
+                if names:
+                    return names
+                self.condition.wait()
+        finally:
+            self.condition.release()
+
+    def run(self):
+        delay = self.retry
+        while True:
+            names = self.wait()
+            try:
+                self.process(names[:self.maxFiles])
+                delay = self.retry
+            except (error, HTTPException, SolrException):
+                self.stats['failures'] += 1
+                logger.exception('unable to send queued updates, retrying '
+                    'in %d seconds', delay)
+                sleep(delay)
+                delay = min(delay * 2, self.retry * 10)
+            except Exception:   # the worker mustn't die, whatever happens
+                self.stats['failures'] += 1
+                logger.exception('unexpected error while processing queued '
+                    'updates, retrying in %d seconds', delay)
+                sleep(delay)
+                delay = min(delay * 2, self.retry * 10)
+
+    def read(self, names):
+        """ read the given files and return the codec, the merged requests
+            and the names of the files read;  only files using the same
+            codec are combined and only one commit is sent at the end """
+        codec, requests, commit, read = None, [], None, []
+        for name in names:
+            try:
+                data, format = self.load(name)
+            except Exception, e:
+                self.discard(name, e)
+                continue
+            if codec is not None and data[0] != codec:
+                break
+            codec = data[0]
+            for request in data[1]:
+                if format.split(request) is None:
+                    commit = request        # <commit/>, <optimize/> etc
+                else:
+                    requests.append(request)
+            read.append(name)
+        if commit is not None:
+            requests.append(commit)
+        return codec, requests, read
+
+    def load(self, name):
+        """ read the given file and return its contents along with the
+            codec used to encode the requests;  anything unexpected in it
+            raises an exception """
+        input = open(join(self.path, name), 'rb')
+        try:
+            codec, requests = load(input)
+        finally:
+            input.close()
+        codec = str(codec)
+        requests = [request.encode('utf-8') for request in requests]
+        format = formats[codec]
+        for request in requests:
+            format.split(request)
+        return (codec, requests), format
+
+    def discard(self, name, reason):
+        """ move a file that cannot be read aside, so that it doesn't
+            block the queue, but can still be inspected """
+        logger.error('unable to read queued updates %s (%r), skipping',
+            name, reason)
+        try:
+            rename(join(self.path, name), join(self.path, name + '.bad'))
+        except OSError:
+            logger.exception('unable to move aside %s', name)
+
+    def process(self, names):
+        """ send the requests stored in the given files to solr """
+        codec, requests, names = self.read(names)
+        if requests:
+            conn = self.pool.checkout()
+            try:
+                for key, value in self.settings.items():
+                    setattr(conn, key, value)
+                conn.codec = formats[codec]
+                conn.setTimeout(self.timeout)
+                for batch in conn.batches(requests):
+                    self.send(conn, batch)
+            finally:
+                self.pool.checkin(conn)
+        for name in names:
+            try:
+                remove(join(self.path, name))
+            except OSError:
+                logger.exception('unable to remove sent updates %s', name)
+        self.stats['sent'] += len(requests)
+        logger.debug('sent %d queued requests from %d transactions',
+            len(requests), len(names))
+
+    def send(self, conn, requests):
+        """ send a batch of requests;  network problems and server errors
+            are raised, so that the batch gets retried later, while
+            requests rejected by solr are dropped after bisecting """
+        try:
+            conn.doSendXML(conn.codec.merge(requests))
+        except SolrException, e:
+            try:
+                status = int(e.httpcode)
+            except (TypeError, ValueError):
+                status = 0
+            if status >= 500:
+                raise
+            if len(requests) == 1:
+                logger.exception('dropping rejected request %r', requests[0])
+                return
+            middle = len(requests) // 2
+            self.send(conn, requests[:middle])
+            self.send(conn, requests[middle:])
+
+    def statistics(self):
+        """ returns the number of queued transactions, the age of the
+            oldest one in seconds as well as the number of sent requests
+            and failed attempts to do so """
+        names = self.pending()
+        lag = names and time() - created(names[0]) or 0
+        return dict(self.stats, length=len(names), lag=int(lag))
+
+
+def getSpool(path, pool, retry=10, timeout=None, settings=None):
+    """ returns the process-wide spool for the given directory, updated
+        with the given pool and settings;  the worker gets started to pick
+        up updates left over from a previous run """
+    spoolsLock.acquire()
+    try:
+        spool = spools.get(path)
+        if spool is None:
+            spool = spools[path] = UpdateSpool(path, pool)
+    finally:
+        spoolsLock.release()
+    spool.pool = pool
+    spool.retry = retry or 10
+    spool.timeout = timeout
+    spool.settings = settings or {}
+    if spool.worker is None:
+        spool.start()
+    return spool
@@ -1,10 +1,14 @@
-# simple benchmarking tests for measuring raw xml parsing speed
+# simple benchmarking tests for measuring raw parsing & serialization speed
 # usage:
 # $ wget -O parts/test/data.xml 'http://localhost:8983/solr/select/?q=foo&rows=...'
+# $ wget -O parts/test/data.json 'http://localhost:8983/solr/select/?q=foo&rows=...&wt=json&json.nl=map'
+# $ wget -O parts/test/data.bin 'http://localhost:8983/solr/select/?q=foo&rows=...&wt=javabin'
 # $ bin/test --tests-pattern=benchmark -v -v
 
 from unittest import TestCase, defaultTestLoader
-from collective.solr.parser import SolrResponse
+from collective.solr.codec import formats
+from collective.solr.parser import SolrResponse, JSONResponse
+from collective.solr.parser import JavaBinResponse
 from collective.solr.iterparse import source
 
 
@@ -31,5 +35,51 @@ class ParserBenchmarks(TestCase):
         SolrResponse(self.data)
 
 
+class JSONParserBenchmarks(TestCase):
+
+    data = open('data.json', 'r').read()
+
+    def test1(self):
+        JSONResponse(self.data)
+
+    def test2(self):
+        JSONResponse(self.data)
+
+    def test3(self):
+        JSONResponse(self.data)
+
+
+class JavaBinParserBenchmarks(TestCase):
+
+    data = open('data.bin', 'rb').read()
+
+    def test1(self):
+        JavaBinResponse(self.data)
+
+    def test2(self):
+        JavaBinResponse(self.data)
+
+    def test3(self):
+        JavaBinResponse(self.data)
+
+
+class CodecBenchmarks(TestCase):
+
+    docs = [dict(UID='uid%05d' % n, Title=u'Document n\xb0 %d' % n,
+        SearchableText=u'some text to be indexed ' * 50,
+        Subject=['foo', 'bar', u'b\xe4z'], getObjPositionInParent=n,
+        modified='2012-05-01T12:34:56.000Z') for n in range(10000)]
+
+    def serialize(self, codec):
+        codec = formats[codec]
+        codec.merge([codec.add(doc) for doc in self.docs])
+
+    def testXML(self):
+        self.serialize('xml')
+
+    def testJSON(self):
+        self.serialize('json')
+
+
 def test_suite():
     return defaultTestLoader.loadTestsFromName(__name__)
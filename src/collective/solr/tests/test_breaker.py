@@ -0,0 +1,100 @@
+from unittest import TestCase
+from socket import error
+
+from zope.component import provideUtility
+
+from collective.solr.breaker import CircuitBreaker
+from collective.solr.exceptions import SolrUnavailableException
+from collective.solr.interfaces import ISolrConnectionConfig
+from collective.solr.manager import SolrConnectionConfig
+from collective.solr.manager import SolrConnectionManager
+from collective.solr.search import Search
+from collective.solr.tests.utils import getData, fakehttp
+
+
+class CircuitBreakerTests(TestCase):
+
+    def testTripping(self):
+        breaker = CircuitBreaker(threshold=3, cooldown=30)
+        breaker.failure()
+        breaker.failure()
+        breaker.success()           # only consecutive failures count
+        breaker.failure()
+        breaker.failure()
+        self.assertEqual(breaker.state, 'closed')
+        self.failUnless(breaker.allow())
+        breaker.failure()
+        self.assertEqual(breaker.state, 'open')
+        self.failIf(breaker.allow())
+        stats = breaker.statistics()
+        self.assertEqual(stats['trips'], 1)
+        self.assertEqual(stats['rejected'], 1)
+        self.assertEqual(stats['failures'], 5)
+
+    def testHalfOpen(self):
+        breaker = CircuitBreaker(threshold=1, cooldown=30)
+        breaker.failure()
+        breaker.opened -= 30        # the cool-down has passed
+        self.failUnless(breaker.allow())
+        self.assertEqual(breaker.state, 'half-open')
+        self.failIf(breaker.allow())    # only one probe at a time
+        breaker.failure()
+        self.assertEqual(breaker.state, 'open')
+        self.failIf(breaker.allow())
+        breaker.opened -= 30
+        self.failUnless(breaker.allow())
+        breaker.success()
+        self.assertEqual(breaker.state, 'closed')
+        self.failUnless(breaker.allow())
+        self.assertEqual(breaker.statistics()['trips'], 2)
+
+    def testSlowResponses(self):
+        breaker = CircuitBreaker(threshold=2, cooldown=30, slow=100)
+        breaker.success(elapsed=50)
+        breaker.success(elapsed=150)
+        self.assertEqual(breaker.state, 'closed')
+        breaker.success(elapsed=200)
+        self.assertEqual(breaker.state, 'open')
+        self.assertEqual(breaker.statistics()['slow'], 2)
+
+
+class SearchBreakerTests(TestCase):
+
+    def setUp(self):
+        self.config = SolrConnectionConfig()
+        provideUtility(self.config, ISolrConnectionConfig)
+        self.mngr = SolrConnectionManager()
+        self.mngr.setHost(active=True)
+        self.config.breaker_threshold = 2
+        self.search = Search()
+        self.search.manager = self.mngr
+
+    def tearDown(self):
+        self.mngr.closeConnection()
+        self.mngr.setHost(active=False)
+
+    def testFailuresTripBreaker(self):
+        conn = self.mngr.getConnection()
+        fakehttp(conn, getData('schema.xml'))
+        self.mngr.getSchema()
+        class Broken(object):
+            def request(self, *args, **kw):
+                raise error('connection refused')
+            close = connect = setTimeout = lambda self, *args: None
+        conn.conn = Broken()
+        self.assertRaises(error, self.search, 'id:foo')
+        self.assertRaises(error, self.search, 'id:foo')
+        self.assertEqual(self.mngr.getBreakerStatistics()['state'], 'open')
+        self.assertRaises(SolrUnavailableException, self.search, 'id:foo')
+        self.assertEqual(self.mngr.getBreakerStatistics()['rejected'], 1)
+
+    def testSuccessfulSearch(self):
+        fakehttp(self.mngr.getConnection(), getData('schema.xml'),
+            getData('search_response.txt'))
+        self.search('id:[* TO *]', rows=10, wt='xml')
+        self.assertEqual(self.mngr.getBreakerStatistics()['state'], 'closed')
+
+    def testDisabled(self):
+        self.config.breaker_threshold = 0
+        self.assertEqual(self.mngr.getBreaker(), None)
+        self.assertEqual(self.mngr.getBreakerStatistics(), {})
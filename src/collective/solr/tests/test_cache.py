@@ -0,0 +1,178 @@
+from unittest import TestCase
+from time import time
+
+from zope.annotation.attribute import AttributeAnnotations
+from zope.annotation.interfaces import IAttributeAnnotatable
+from zope.component import provideAdapter, provideUtility
+from zope.globalrequest import clearRequest, setRequest
+from zope.interface import implements
+
+from collective.solr.cache import SearchCache
+from collective.solr.interfaces import ISolrConnectionConfig
+from collective.solr.manager import SolrConnectionConfig
+from collective.solr.manager import SolrConnectionManager
+from collective.solr.search import Search
+from collective.solr.tests.utils import getData, fakehttp
+
+
+class SearchCacheTests(TestCase):
+
+    def testLeastRecentlyUsedEntriesAreEvicted(self):
+        cache = SearchCache(entries=2)
+        cache.set('foo', 'x', 0)
+        cache.set('bar', 'y', 0)
+        self.assertEqual(cache.get('foo'), ('x', True))
+        cache.set('baz', 'z', 0)
+        self.assertEqual(cache.get('bar'), None)
+        self.assertEqual(cache.get('foo'), ('x', True))
+        stats = cache.statistics()
+        self.assertEqual(stats['entries'], 2)
+        self.assertEqual(stats['bytes'], 2)
+        self.assertEqual(stats['hits'], 2)
+        self.assertEqual(stats['misses'], 1)
+
+    def testSizeLimit(self):
+        cache = SearchCache(entries=10, size=10)
+        cache.set('foo', 'x' * 6, 0)
+        cache.set('bar', 'y' * 6, 0)
+        self.assertEqual(cache.get('foo'), None)
+        cache.set('baz', 'z' * 11, 0)        # too big for the cache
+        self.assertEqual(cache.get('baz'), None)
+        self.assertEqual(cache.get('bar'), ('yyyyyy', True))
+        self.assertEqual(cache.statistics()['bytes'], 6)
+
+    def testDateMathKeys(self):
+        cache = SearchCache()
+        start = int(time() // 60)
+        key = cache.key('xml', '+effective:[* TO NOW/MINUTE]', {})
+        self.failUnless(key.startswith('xml\nq=%2Beffective'))
+        self.failUnless(int(key.split('\n')[-1]) in (start, start + 1))
+
+    def testInvalidation(self):
+        cache = SearchCache()
+        cache.set('foo', 'x', 0)
+        cache.invalidate()
+        self.assertEqual(cache.get('foo'), None)
+        cache.set('foo', 'x', 0)            # fetched before the commit
+        self.assertEqual(cache.get('foo'), None)
+        cache.set('foo', 'x', 1)
+        self.assertEqual(cache.get('foo'), ('x', True))
+
+    def testStaleWhileRevalidate(self):
+        cache = SearchCache(stale=60)
+        cache.set('foo', 'x', 0)
+        cache.invalidate()
+        self.assertEqual(cache.get('foo'), ('x', False))
+        self.failUnless(cache.claim('foo'))
+        self.failIf(cache.claim('foo'))     # only one thread refreshes
+        cache.changed -= 60                 # it's too old by now
+        self.assertEqual(cache.get('foo'), None)
+        self.assertEqual(cache.statistics()['stale'], 1)
+
+    def testIndexVersion(self):
+        cache = SearchCache(poll=10)
+        self.failUnless(cache.due())
+        self.failIf(cache.due())            # the poll is still running
+        cache.polling = False
+        self.failIf(cache.due())            # and it's not due yet
+        cache.update(23)
+        cache.set('foo', 'x', 0)
+        cache.update(23)
+        self.assertEqual(cache.get('foo'), ('x', True))
+        cache.update(42)
+        self.assertEqual(cache.get('foo'), None)
+        self.assertEqual(cache.statistics()['generation'], 1)
+
+
+class CachedSearchTests(TestCase):
+
+    def setUp(self):
+        self.config = SolrConnectionConfig()
+        self.config.search_cache_entries = 10
+        self.config.search_cache_poll = 0
+        provideUtility(self.config, ISolrConnectionConfig)
+        self.mngr = SolrConnectionManager()
+        self.mngr.setHost(active=True)
+        self.search = Search()
+        self.search.manager = self.mngr
+
+    def tearDown(self):
+        self.mngr.closeConnection()
+        self.mngr.setHost(active=False)
+
+    def testRepeatedSearchesAreCached(self):
+        output = fakehttp(self.mngr.getConnection(), getData('schema.xml'),
+            getData('search_response.txt'), getData('search_response.txt'))
+        results = self.search('id:[* TO *]', rows=10, wt='xml').results()
+        self.assertEqual(results[0].id, '500')
+        results = self.search('id:[* TO *]', rows=10, wt='xml').results()
+        self.assertEqual(results[0].id, '500')
+        self.assertEqual(len(output), 2)        # schema and one search
+        self.search('id:[* TO *]', rows=5, wt='xml')
+        self.assertEqual(len(output), 3)
+        stats = self.mngr.getCacheStatistics()
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['misses'], 2)
+
+    def testCommitInvalidates(self):
+        output = fakehttp(self.mngr.getConnection(), getData('schema.xml'),
+            getData('search_response.txt'), getData('search_response.txt'))
+        self.search('id:[* TO *]', rows=10, wt='xml')
+        self.mngr.invalidateCache()
+        self.search('id:[* TO *]', rows=10, wt='xml')
+        self.assertEqual(len(output), 3)
+
+    def testIndexVersion(self):
+        conn = self.mngr.getConnection()
+        output = fakehttp(conn, getData('luke_response.txt'))
+        self.assertEqual(conn.getIndexVersion(), 1318864386527)
+        self.failUnless(output.get().startswith('POST /solr/admin/luke '))
+
+    def testDisabled(self):
+        self.config.search_cache_entries = 0
+        self.assertEqual(self.mngr.getSearchCache(), None)
+        self.assertEqual(self.mngr.getCacheStatistics(), {})
+
+
+class Request(dict):
+    implements(IAttributeAnnotatable)
+
+
+class RequestMemoTests(TestCase):
+
+    def setUp(self):
+        provideAdapter(AttributeAnnotations)
+        setRequest(Request())
+        self.config = SolrConnectionConfig()
+        provideUtility(self.config, ISolrConnectionConfig)
+        self.mngr = SolrConnectionManager()
+        self.mngr.setHost(active=True)
+        self.search = Search()
+        self.search.manager = self.mngr
+
+    def tearDown(self):
+        self.mngr.closeConnection()
+        self.mngr.setHost(active=False)
+        clearRequest()
+
+    def testSearchesAreMemoized(self):
+        output = fakehttp(self.mngr.getConnection(), getData('schema.xml'),
+            getData('search_response.txt'), getData('search_response.txt'))
+        first = self.search('id:[* TO *]', rows=10, wt='xml')
+        first.results().append(None)        # e.g. padding the results
+        second = self.search('id:[* TO *]', rows=10, wt='xml')
+        self.assertEqual(len(output), 2)    # schema and one search
+        self.assertEqual(len(second.results()), 1)
+        self.assertEqual(second.results()[0].id, '500')
+        self.assertEqual(second.results().numFound, '1')
+        self.mngr.invalidateCache()
+        self.search('id:[* TO *]', rows=10, wt='xml')
+        self.assertEqual(len(output), 3)
+
+    def testNoRequest(self):
+        clearRequest()
+        output = fakehttp(self.mngr.getConnection(), getData('schema.xml'),
+            getData('search_response.txt'), getData('search_response.txt'))
+        self.search('id:[* TO *]', rows=10, wt='xml')
+        self.search('id:[* TO *]', rows=10, wt='xml')
+        self.assertEqual(len(output), 3)
@@ -0,0 +1,180 @@
+from unittest import TestCase
+from os.path import exists, join
+from shutil import rmtree
+from tempfile import mkdtemp
+
+from zope.component import provideUtility
+
+from collective.solr.commands import _options, _partition, _split
+from collective.solr.commands import _state_path, _compare, _index_partition
+from collective.solr.interfaces import ISolrConnectionConfig
+from collective.solr.interfaces import ISolrConnectionManager
+from collective.solr.manager import SolrConnectionConfig
+from collective.solr.manager import SolrConnectionManager
+from collective.solr.tests.test_indexer import Foo
+from collective.solr.tests.utils import getData, fakehttp
+from collective.solr.utils import loadState, saveState
+
+
+class PartitionTests(TestCase):
+
+    def testPartitioning(self):
+        uids = ['%032x' % i for i in range(1000)]
+        counts = [0] * 4
+        for uid in uids:
+            counts[_partition(uid, 4)] += 1
+        self.assertEqual(sum(counts), 1000)
+        self.failIf([count for count in counts if count < 200])
+        # the partitions are stable, also for unicode keys
+        self.assertEqual(_partition(u'foo', 4), _partition('foo', 4))
+        self.assertEqual(_partition('foo', 1), 0)
+
+    def testSplit(self):
+        uids = ['%032x' % i for i in range(100)]
+        parts = _split(uids, 4)
+        self.assertEqual(len(parts), 4)
+        self.assertEqual(sorted(sum(parts, [])), uids)
+        for number, part in enumerate(parts):
+            self.assertEqual(part, sorted(part))
+            self.failIf([uid for uid in part if _partition(uid, 4) != number])
+
+    def testCompare(self):
+        indexed = dict(a=10, b=20, c=None, x=30)
+        cataloged = [('a', 1), ('b', 2), ('c', 3), ('d', 4)]
+        modified = dict([(1, 10), (2, 21), (3, None), (4, None)]).get
+        uids, delete = _compare(indexed, cataloged, modified)
+        # "b" was modified, "d" is missing in solr, "x" in the catalog
+        self.assertEqual(uids, ['b', 'd'])
+        self.assertEqual(delete, ['x'])
+        self.assertEqual(len(indexed), 4)       # the mapping is kept intact
+
+    def testOptions(self):
+        options, args = _options('solr_reindex', ['Plone', '-p', '8',
+            '--partition', '3', '--resume'])
+        self.assertEqual(args, ['Plone'])
+        self.assertEqual(options.partitions, 8)
+        self.assertEqual(options.partition, 3)
+        self.assertEqual(options.resume, True)
+        options, args = _options('solr_sync', [])
+        self.assertEqual(options.partition, None)
+        self.assertEqual(options.batch, 1000)
+
+
+class CheckpointTests(TestCase):
+
+    def setUp(self):
+        self.tmpdir = mkdtemp()
+
+    def tearDown(self):
+        rmtree(self.tmpdir)
+
+    def testStateFiles(self):
+        options, args = _options('solr_reindex', ['-p', '2', '-s',
+            self.tmpdir, '--partition', '1'])
+        path = _state_path(options, 'solr_reindex', options.partition)
+        self.assertEqual(path, join(self.tmpdir, 'solr_reindex-1-of-2'))
+        self.assertEqual(loadState(path), None)
+        saveState(path, dict(last='abc', processed=42))
+        self.assertEqual(loadState(path), dict(last='abc', processed=42))
+        self.failIf(exists(path + '.tmp'))
+
+
+class FakeIndex(object):
+
+    def __init__(self, index):
+        self._index = index
+
+
+class FakeCatalog(object):
+
+    def __init__(self, objects):
+        self.paths = dict([(rid, obj.id) for rid, obj in enumerate(objects)])
+        self.index = dict([(obj.id, rid) for rid, obj in enumerate(objects)])
+
+    def getIndex(self, name):
+        return FakeIndex(self.index)
+
+
+class FakeJar(object):
+
+    def cacheGC(self):
+        pass
+
+
+class FakeSite(object):
+
+    _p_jar = FakeJar()
+
+    def __init__(self, *objects):
+        self.objects = dict([(obj.id, obj) for obj in objects])
+        self.portal_catalog = catalog = FakeCatalog(objects)
+        catalog._catalog = catalog
+
+    def unrestrictedTraverse(self, path, default):
+        return self.objects.get(path, default)
+
+
+class PartitionIndexingTests(TestCase):
+
+    def setUp(self):
+        self.tmpdir = mkdtemp()
+        provideUtility(SolrConnectionConfig(), ISolrConnectionConfig)
+        self.mngr = SolrConnectionManager()
+        self.mngr.setHost(active=True)
+        fakehttp(self.mngr.getConnection(), getData('schema.xml'))
+        self.mngr.getSchema()
+        provideUtility(self.mngr, ISolrConnectionManager)
+        self.site = FakeSite(*[Foo(id=id, name='foo') for id in 'abc'])
+
+    def tearDown(self):
+        self.mngr.closeConnection()
+        self.mngr.setHost(active=False)
+        rmtree(self.tmpdir)
+
+    def index(self, options, uids, delete=(), responses=()):
+        output = fakehttp(self.mngr.getConnection(), *[getData(name)
+            for name in responses])
+        _index_partition(self.site, 'solr_sync', options, uids, delete)
+        self.assertEqual(len(output), len(responses))
+        return [output.get() for name in responses]
+
+    def testIndexPartition(self):
+        options, args = _options('solr_sync', ['-p', '2', '--partition',
+            '1', '-b', '2', '-s', self.tmpdir])
+        requests = self.index(options, ['a', 'b', 'c'], delete=['x'],
+            responses=['delete_response.txt', 'add_response.txt',
+                'add_response.txt', 'commit_response.txt'])
+        self.failUnless('<delete><id>x</id></delete>' in requests[0])
+        self.assertEqual(requests[1].count('<doc>'), 2)
+        self.assertEqual(requests[2].count('<doc>'), 1)
+        self.failUnless('<commit' in requests[3])
+        state = loadState(_state_path(options, 'solr_sync', 1))
+        self.assertEqual((state['last'], state['processed'], state['total'],
+            state['done']), ('c', 3, 3, True))
+
+    def testResumePartition(self):
+        options, args = _options('solr_sync', ['-p', '2', '--partition',
+            '1', '-b', '2', '-s', self.tmpdir, '--resume'])
+        # pretend the partition got interrupted after the first batch...
+        path = _state_path(options, 'solr_sync', 1)
+        saveState(path, dict(last='b', processed=2, started=0, done=False))
+        requests = self.index(options, ['a', 'b', 'c'],
+            responses=['add_response.txt', 'commit_response.txt'])
+        self.assertEqual(requests[0].count('<doc>'), 1)
+        self.failUnless('<field name="id">c</field>' in requests[0])
+        state = loadState(path)
+        self.assertEqual((state['last'], state['processed'], state['total'],
+            state['done']), ('c', 3, 3, True))
+
+    def testFailedPartition(self):
+        options, args = _options('solr_sync', ['-p', '2', '--partition',
+            '1', '-b', '2', '-s', self.tmpdir])
+        output = fakehttp(self.mngr.getConnection(),
+            *[getData('bad_request_response.txt')] * 3)
+        self.assertRaises(SystemExit, _index_partition, self.site,
+            'solr_sync', options, ['a', 'b', 'c'])
+        self.assertEqual(len(output), 3)    # the batch was bisected
+        # the failed batch was neither checkpointed nor followed by others
+        state = loadState(_state_path(options, 'solr_sync', 1))
+        self.assertEqual((state['last'], state['processed'], state['done']),
+            (None, 0, False))
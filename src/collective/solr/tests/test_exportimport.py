@@ -15,11 +15,17 @@ class SetupToolTests(SolrTestCase, TarballTester):
         config.host = 'foo'
         config.port = 23
         config.base = '/bar'
+        config.replicas = ('foo2:24/bar', 'foo3:25/bar')
+        config.replica_retry = 15
+        config.client_mode = 'search-only'
         config.async = False
         config.auto_commit = True
         config.commit_within = 1000
         config.index_timeout = 7
         config.search_timeout = 3.1415
+        config.pool_size = 5
+        config.pool_timeout = 2.5
+        config.pool_max_idle = 30
         config.max_results = 42
         config.required = ('foo', 'bar')
         config.search_pattern = 'foo:{value}'
@@ -27,8 +33,33 @@ class SetupToolTests(SolrTestCase, TarballTester):
         config.filter_queries = ('type', )
         config.slow_query_threshold = 2342
         config.effective_steps = 900
+        config.effective_rounding = 'minute'
         config.exclude_user = True
+        config.split_security_filter = True
         config.levenshtein_distance = 0.2
+        config.update_batch_size = 500
+        config.update_batch_bytes = 1048576
+        config.wire_format = 'json'
+        config.compress_threshold = 65536
+        config.compress_level = 9
+        config.compress_responses = True
+        config.schema_ttl = 600
+        config.schema_retry = 10
+        config.schema_cache_path = '/tmp/schema.xml'
+        config.queue_updates = True
+        config.queue_retry = 5
+        config.breaker_threshold = 3
+        config.breaker_cooldown = 60
+        config.breaker_slow_threshold = 2000
+        config.retry_attempts = 4
+        config.retry_delay = 0.5
+        config.retry_deadline = 20.0
+        config.search_cache_entries = 500
+        config.search_cache_size = 1048576
+        config.search_cache_poll = 5
+        config.search_cache_stale = 30
+        config.terms_threshold = 100
+        config.atomic_updates = True
 
     def testImportStep(self):
         profile = 'profile-collective.solr:default'
@@ -42,19 +73,50 @@ class SetupToolTests(SolrTestCase, TarballTester):
         self.assertEqual(config.host, '127.0.0.1')
         self.assertEqual(config.port, 8983)
         self.assertEqual(config.base, '/solr')
+        self.assertEqual(config.replicas, ())
+        self.assertEqual(config.replica_retry, 30)
+        self.assertEqual(config.client_mode, 'read-write')
         self.assertEqual(config.async, False)
         self.assertEqual(config.auto_commit, True)
         self.assertEqual(config.commit_within, 1000)
         self.assertEqual(config.index_timeout, 0)
         self.assertEqual(config.search_timeout, 0)
+        self.assertEqual(config.pool_size, 10)
+        self.assertEqual(config.pool_timeout, 10.0)
+        self.assertEqual(config.pool_max_idle, 60)
         self.assertEqual(config.max_results, 0)
         self.assertEqual(config.required, ('SearchableText', ))
         self.assertEqual(config.facets, ('portal_type', 'review_state'))
         self.assertEqual(config.filter_queries, ('portal_type', ))
         self.assertEqual(config.slow_query_threshold, 0)
         self.assertEqual(config.effective_steps, 1)
+        self.assertEqual(config.effective_rounding, 'none')
         self.assertEqual(config.exclude_user, False)
+        self.assertEqual(config.split_security_filter, False)
         self.assertEqual(config.levenshtein_distance, 0.0)
+        self.assertEqual(config.update_batch_size, 1000)
+        self.assertEqual(config.update_batch_bytes, 4194304)
+        self.assertEqual(config.wire_format, 'xml')
+        self.assertEqual(config.compress_threshold, 0)
+        self.assertEqual(config.compress_level, 6)
+        self.assertEqual(config.compress_responses, False)
+        self.assertEqual(config.schema_ttl, 3600)
+        self.assertEqual(config.schema_retry, 30)
+        self.assertEqual(config.schema_cache_path, '')
+        self.assertEqual(config.queue_updates, False)
+        self.assertEqual(config.queue_retry, 10)
+        self.assertEqual(config.breaker_threshold, 5)
+        self.assertEqual(config.breaker_cooldown, 30)
+        self.assertEqual(config.breaker_slow_threshold, 0)
+        self.assertEqual(config.retry_attempts, 2)
+        self.assertEqual(config.retry_delay, 0.1)
+        self.assertEqual(config.retry_deadline, 30.0)
+        self.assertEqual(config.search_cache_entries, 0)
+        self.assertEqual(config.search_cache_size, 16777216)
+        self.assertEqual(config.search_cache_poll, 10)
+        self.assertEqual(config.search_cache_stale, 0)
+        self.assertEqual(config.terms_threshold, 0)
+        self.assertEqual(config.atomic_updates, False)
 
     def testExportStep(self):
         tool = self.portal.portal_setup
@@ -95,6 +157,12 @@ SOLR_XML = """\
     <host value="foo" />
     <port value="23" />
     <base value="/bar" />
+    <replicas>
+      <endpoint value="foo2:24/bar" />
+      <endpoint value="foo3:25/bar" />
+    </replicas>
+    <replica-retry value="15" />
+    <client-mode value="search-only" />
   </connection>
   <settings>
     <async value="False" />
@@ -102,6 +170,9 @@ SOLR_XML = """\
     <commit-within value="1000" />
     <index-timeout value="7" />
     <search-timeout value="3.1415" />
+    <pool-size value="5" />
+    <pool-timeout value="2.5" />
+    <pool-max-idle value="30" />
     <max-results value="42" />
     <required-query-parameters>
       <parameter name="foo" />
@@ -117,13 +188,38 @@ SOLR_XML = """\
     </filter-query-parameters>
     <slow-query-threshold value="2342" />
     <effective-steps value="900" />
+    <effective-rounding value="minute" />
     <exclude-user value="True" />
+    <split-security-filter value="True" />
     <highlight_fields />
     <highlight_formatter_pre value="["/>
     <highlight_formatter_post value="]"/>
     <highlight_fragsize value="100"/>
     <field-list/>
     <levenshtein_distance value="0.2"/>
+    <update-batch-size value="500" />
+    <update-batch-bytes value="1048576" />
+    <wire-format value="json" />
+    <compress-threshold value="65536" />
+    <compress-level value="9" />
+    <compress-responses value="True" />
+    <schema-ttl value="600" />
+    <schema-retry value="10" />
+    <schema-cache-path value="/tmp/schema.xml" />
+    <queue-updates value="True" />
+    <queue-retry value="5" />
+    <breaker-threshold value="3" />
+    <breaker-cooldown value="60" />
+    <breaker-slow-threshold value="2000" />
+    <retry-attempts value="4" />
+    <retry-delay value="0.5" />
+    <retry-deadline value="20.0" />
+    <search-cache-entries value="500" />
+    <search-cache-size value="1048576" />
+    <search-cache-poll value="5" />
+    <search-cache-stale value="30" />
+    <terms-threshold value="100" />
+    <atomic-updates value="True" />
   </settings>
 </object>
 """
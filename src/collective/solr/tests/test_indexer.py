@@ -4,9 +4,12 @@ from re import search, findall, DOTALL
 from DateTime import DateTime
 from datetime import datetime
 from datetime import date
-from zope.component import provideUtility
+from zope.component import provideUtility, getGlobalSiteManager
+from transaction import commit, abort, get as getTransaction
 from zope.interface import implements
 from Products.CMFCore.CMFCatalogAware import CMFCatalogAware
+from collective.indexing.interfaces import IIndexQueueProcessor
+from collective.indexing.queue import getQueue
 
 from collective.solr.interfaces import ISolrConnectionConfig
 from collective.solr.interfaces import ICheckIndexable
@@ -15,6 +18,7 @@ from collective.solr.manager import SolrConnectionManager
 from collective.solr.indexer import SolrIndexProcessor
 from collective.solr.indexer import logger as logger_indexer
 from collective.solr.tests.utils import getData, fakehttp, fakemore
+from collective.solr.parser import SolrField
 from collective.solr.solr import SolrConnection
 from collective.solr.utils import prepareData
 
@@ -42,7 +46,8 @@ def sortFields(output):
 class QueueIndexerTests(TestCase):
 
     def setUp(self):
-        provideUtility(SolrConnectionConfig(), ISolrConnectionConfig)
+        self.config = SolrConnectionConfig()
+        provideUtility(self.config, ISolrConnectionConfig)
         self.mngr = SolrConnectionManager()
         self.mngr.setHost(active=True)
         conn = self.mngr.getConnection()
@@ -51,6 +56,7 @@ class QueueIndexerTests(TestCase):
         self.proc = SolrIndexProcessor(self.mngr)
 
     def tearDown(self):
+        abort()             # drop hooks registered by `begin`
         self.mngr.closeConnection()
         self.mngr.setHost(active=False)
 
@@ -103,10 +109,73 @@ class QueueIndexerTests(TestCase):
         # at this point we'd normally check for a partial update:
         #   self.assertEqual(output.find('price'), -1, '"price" data found?')
         #   self.assertEqual(output.find('42'), -1, '"price" data found?')
-        # however, until SOLR-139 has been implemented (re)index operations
-        # always need to provide data for all attributes in the schema...
+        # however, unless atomic updates are enabled (see below) (re)index
+        # operations always need to provide data for all attributes...
         self.assert_(output.find('<field name="price">42.0</field>') > 0, '"price" data not found')
 
+    def enableAtomicUpdates(self):
+        self.config.atomic_updates = True
+        schema = self.mngr.getSchema()
+        for field in schema.fields:
+            field['stored'] = True
+        schema['_version_'] = SolrField(name='_version_', type='long',
+            class_='solr.LongField', indexed=True, stored=True)
+        schema.prepare()
+
+    def testAtomicUpdate(self):
+        self.enableAtomicUpdates()
+        foo = Foo(id='500', name='foo', price=42.0, cat=[])
+        output = fakehttp(self.mngr.getConnection(),
+            getData('add_response.txt'))
+        self.proc.index(foo, attributes=['name', 'cat', 'popularity'])
+        output = str(output)
+        self.failUnless('<field name="id">500</field>' in output)
+        self.failUnless('<field name="_version_">1</field>' in output)
+        self.failUnless('<field name="name" update="set">foo</field>'
+            in output)
+        # empty or missing values remove the field from the document
+        self.failUnless('<field name="cat" update="set" null="true"/>'
+            in output)
+        self.failUnless('<field name="popularity" update="set" null="true"/>'
+            in output)
+        self.failIf('price' in output)
+
+    def testAtomicUpdateOfMissingDocument(self):
+        self.enableAtomicUpdates()
+        foo = Foo(id='500', name='foo', price=42.0)
+        conflict = 'HTTP/1.1 409 Conflict\nContent-Length: 0\n\n'
+        output = fakehttp(self.mngr.getConnection(), conflict,
+            getData('add_response.txt'))
+        self.proc.index(foo, attributes=['name'])
+        self.assertEqual(len(output), 2)
+        self.failUnless('update="set"' in output.get())
+        # solr rejected the update, so the whole document gets added
+        output = output.get()
+        self.failIf('update="set"' in output)
+        self.failIf('_version_' in output)
+        self.failUnless('<field name="price">42.0</field>' in output)
+        self.assertEqual(self.mngr.getConnection().fallbacks, {})
+
+    def testAtomicUpdateFallback(self):
+        self.enableAtomicUpdates()
+        foo = Foo(id='500', name='foo', price=42.0)
+        schema = self.mngr.getSchema()
+        schema.price['stored'] = False      # solr couldn't restore it
+        schema.prepare()
+        output = fakehttp(self.mngr.getConnection(),
+            getData('add_response.txt'))
+        self.proc.index(foo, attributes=['name'])
+        output = str(output)
+        self.failIf('update="set"' in output)
+        self.failUnless('<field name="price">42.0</field>' in output)
+        # the unique key can't be changed by an update either...
+        schema.price['stored'] = True
+        schema.prepare()
+        output = fakehttp(self.mngr.getConnection(),
+            getData('add_response.txt'))
+        self.proc.index(foo, attributes=['id', 'name'])
+        self.failIf('update="set"' in str(output))
+
     def testDateIndexing(self):
         foo = Foo(id='zeidler', name='andi', cat='nerd', timestamp=DateTime('May 11 1972 03:45 GMT'))
         response = getData('add_response.txt')
@@ -131,6 +200,21 @@ class QueueIndexerTests(TestCase):
         required = '<field name="timestamp">1982-08-05T00:00:00.000Z</field>'
         self.assert_(str(output).find(required) > 0, '"date" data not found')
 
+    def testIndexingAfterSchemaChange(self):
+        foo = Foo(id='500', name='python test doc', color='blue')
+        output = fakehttp(self.mngr.getConnection(),
+            getData('add_response.txt'))
+        self.proc.index(foo)
+        self.failIf('name="color"' in str(output))
+        schema = self.mngr.getSchema()
+        schema['color'] = SolrField(name='color', class_='solr.StrField',
+            indexed=True, stored=True)
+        schema.prepare()
+        output = fakehttp(self.mngr.getConnection(),
+            getData('add_response.txt'))
+        self.proc.index(foo)
+        self.failUnless('<field name="color">blue</field>' in str(output))
+
     def testReindexObject(self):
         response = getData('add_response.txt')
         output = fakehttp(self.mngr.getConnection(), response)   # fake add response
@@ -149,6 +233,106 @@ class QueueIndexerTests(TestCase):
         self.proc.commit()                                       # committing sends data
         self.assertEqual(str(output), getData('commit_request.txt'))
 
+    def testCoalescedOperations(self):
+        calls = []
+        def name():
+            calls.append(None)
+            return 'foo'
+        foo = Foo(id='500', name=name)
+        bar = Foo(id='501', name='bar')
+        output = fakehttp(self.mngr.getConnection(),
+            getData('add_response.txt'), getData('delete_response.txt'),
+            getData('commit_response.txt'))
+        self.proc.begin()
+        self.proc.index(foo)
+        self.proc.reindex(foo, attributes=['name'])
+        self.proc.index(bar)
+        self.proc.unindex(bar)          # cancels the pending add
+        self.assertEqual(len(output), 0)
+        self.assertEqual(calls, [])     # nothing was extracted so far
+        self.proc.commit()
+        self.assertEqual(calls, [None])
+        self.assertEqual(len(output), 3)
+        add = output.get()
+        self.failUnless('<field name="id">500</field>' in add)
+        self.failIf('501' in add)
+        self.failUnless('<delete><id>501</id></delete>' in output.get())
+        self.failUnless('<commit' in output.get())
+
+    def testCoalescedPartialUpdates(self):
+        self.enableAtomicUpdates()
+        foo = Foo(id='500', name='foo', cat='nerd', price=42.0)
+        output = fakehttp(self.mngr.getConnection(),
+            getData('add_response.txt'), getData('commit_response.txt'))
+        self.proc.begin()
+        self.proc.reindex(foo, attributes=['name'])
+        self.proc.reindex(foo, attributes=['cat'])
+        self.proc.commit()
+        self.assertEqual(len(output), 2)
+        update = output.get()
+        self.failUnless('<field name="name" update="set">foo</field>'
+            in update)
+        self.failUnless('<field name="cat" update="set">nerd</field>'
+            in update)
+        self.failIf('price' in update)
+
+    def testDeferredUnindexUsesRecordedKey(self):
+        foo = Foo(id='500', name='foo')
+        output = fakehttp(self.mngr.getConnection(),
+            getData('delete_response.txt'), getData('commit_response.txt'))
+        self.proc.begin()
+        # no connection is needed until the transaction is committed
+        self.proc.getConnection = lambda: self.fail('connection used')
+        self.proc.unindex(foo)
+        del self.proc.getConnection
+        foo.id = 'moved'                # e.g. renamed afterwards
+        self.proc.commit()
+        self.assertEqual(len(output), 2)
+        self.failUnless('<delete><id>500</id></delete>' in output.get())
+
+    def testAbortDiscardsDeferredOperations(self):
+        output = fakehttp(self.mngr.getConnection(),
+            getData('commit_response.txt'))
+        self.proc.begin()
+        self.proc.index(Foo(id='500', name='foo'))
+        self.proc.abort()
+        self.proc.commit()
+        self.assertEqual(len(output), 1)
+        self.failIf('<add>' in output.get())
+
+    def testExtractionBeforeVote(self):
+        calls = []
+        def name():
+            calls.append(None)
+            return 'foo'
+        conn = self.mngr.getConnection()
+        output = fakehttp(conn, getData('add_response.txt'),
+            getData('commit_response.txt'))
+        class Voter(object):
+            """ a data manager recording the state at the time of the vote """
+            def tpc_vote(self, txn):
+                self.state = len(calls), len(conn.xmlbody), len(output[:])
+            def sortKey(self):
+                return 'voter'
+            tpc_begin = commit = tpc_finish = tpc_abort = abort = \
+                lambda self, txn: None
+        voter = Voter()
+        gsm = getGlobalSiteManager()
+        gsm.registerUtility(self.proc, IIndexQueueProcessor, name='solr')
+        try:
+            getQueue().index(Foo(id='500', name=name))
+            getTransaction().join(voter)
+            commit()
+        finally:
+            gsm.unregisterUtility(self.proc, IIndexQueueProcessor,
+                name='solr')
+        # the data was extracted before the vote, but only sent afterwards
+        self.assertEqual(voter.state, (1, 1, 0))
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(len(output), 2)
+        self.failUnless('<field name="name">foo</field>' in output.get())
+        self.failUnless('<commit' in output.get())
+
     def testNoIndexingWithoutAllRequiredFields(self):
         response = getData('dummy_response.txt')
         output = fakehttp(self.mngr.getConnection(), response)   # fake add response
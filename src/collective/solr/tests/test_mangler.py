@@ -8,6 +8,7 @@ from collective.solr.mangler import mangleQuery
 from collective.solr.mangler import extractQueryParameters
 from collective.solr.mangler import cleanupQueryParameters
 from collective.solr.mangler import optimizeQueryParameters
+from collective.solr.mangler import securityFilter
 from collective.solr.parser import SolrSchema, SolrField
 
 
@@ -133,6 +134,64 @@ class QueryManglerTests(TestCase):
             'expires': '[1972-05-11T03:45:00.000Z TO *]',
         })
 
+    def testEffectiveRangeDateMath(self):
+        self.config.effective_rounding = 'minute'
+        keywords = dict(effectiveRange=DateTime(), show_inactive=False)
+        mangleQuery(keywords, self.config, {})
+        self.assertEqual(keywords, {
+            'effective': set(['+effective:[* TO NOW/MINUTE]']),
+            'expires': set(['+expires:[NOW/MINUTE TO *]']),
+        })
+        # dates other than the current one are still sent literally
+        date = DateTime('1972/05/11 03:47:02 UTC')
+        keywords = dict(effectiveRange=date, show_inactive=False)
+        mangleQuery(keywords, self.config, {})
+        self.assertEqual(keywords, {
+            'effective': '[* TO 1972-05-11T03:47:02.000Z]',
+            'expires': '[1972-05-11T03:47:02.000Z TO *]',
+        })
+
+    def testSplitSecurityFilter(self):
+        self.config.split_security_filter = True
+        def mangle(**keywords):
+            mangleQuery(keywords, self.config, {})
+            return keywords
+        keywords = mangle(allowedRolesAndUsers=['Anonymous', 'user$joe',
+            'group$staff'])
+        self.assertEqual(keywords, {'allowedRolesAndUsers': set([
+            '{!cache=false}filter(allowedRolesAndUsers:("Anonymous" OR '
+            '"group$staff")) OR allowedRolesAndUsers:("user$joe")'])})
+        keywords = mangle(allowedRolesAndUsers=['group$staff', 'Anonymous'])
+        self.assertEqual(keywords, {'allowedRolesAndUsers': set([
+            'allowedRolesAndUsers:("Anonymous" OR "group$staff")'])})
+        groups = ['group$%d' % n for n in range(11)]
+        self.config.terms_threshold = 10
+        keywords = mangle(allowedRolesAndUsers=groups)
+        self.assertEqual(keywords, {'allowedRolesAndUsers': set([
+            '{!terms f=allowedRolesAndUsers}' + ','.join(sorted(groups))])})
+        keywords = mangle(allowedRolesAndUsers=groups + ['user$joe'])
+        self.assertEqual(keywords, {'allowedRolesAndUsers': set([
+            '{!cache=false}filter(_query_:"{!terms f=allowedRolesAndUsers}'
+            + ','.join(sorted(groups)) + '") OR '
+            'allowedRolesAndUsers:("user$joe")'])})
+
+    def testSecurityFilterThreshold(self):
+        groups = ['group$%d' % n for n in range(3)]
+        boolean = 'allowedRolesAndUsers:("group$0" OR "group$1" OR "group$2")'
+        terms = '{!terms f=allowedRolesAndUsers}group$0,group$1,group$2'
+        self.assertEqual(securityFilter(groups, 2), terms)
+        # a threshold of 0 disables the terms query parser...
+        self.assertEqual(securityFilter(groups, 0), boolean)
+        # ...while the default is only used without any setting
+        self.assertEqual(securityFilter(groups), boolean)
+        many = ['group$%d' % n for n in range(11)]
+        self.assertEqual(securityFilter(many), '{!terms '
+            'f=allowedRolesAndUsers}' + ','.join(sorted(many)))
+        # tokens containing commas cannot be split by the parser
+        self.assertEqual(securityFilter(['group$a,b'] + groups, 2),
+            'allowedRolesAndUsers:("group$0" OR "group$1" OR "group$2" OR '
+            '"group$a,b")')
+
     def testIgnoredParameters(self):
         keywords = mangle(use_solr=True, foo='bar')
         self.assertEqual(keywords, {'foo': 'bar'})
@@ -310,17 +369,25 @@ class QueryParameterTests(TestCase):
         params = cleanup(dict(sort='foo asc'), schema)
         self.assertEqual(params, dict())
         # the same goes when the given index isn't indexed
-        schema['foo'] = SolrField(indexed=False)
+        schema['foo'] = SolrField(name='foo', indexed=False)
+        schema.prepare()
+        params = cleanup(dict(sort='foo asc'), schema)
+        self.assertEqual(params, dict())
+        # or holds multiple values, which solr cannot sort on
+        schema['foo'].update(indexed=True, multiValued=True)
+        schema.prepare()
         params = cleanup(dict(sort='foo asc'), schema)
         self.assertEqual(params, dict())
         # a suitable index will be left intact, of course...
-        schema['foo'].indexed = True
+        schema['foo']['multiValued'] = False
+        schema.prepare()
         params = cleanup(dict(sort='foo asc'), schema)
         self.assertEqual(params, dict(sort='foo asc'))
         # also make sure sort index aliases work, if the alias index exists
         params = cleanup(dict(sort='sortable_title asc'), schema)
         self.assertEqual(params, dict())
-        schema['Title'] = SolrField(indexed=True)
+        schema['Title'] = SolrField(name='Title', indexed=True)
+        schema.prepare()
         params = cleanup(dict(sort='sortable_title asc'), schema)
         self.assertEqual(params, dict(sort='Title asc'))
 
@@ -367,6 +434,46 @@ class QueryParameterTests(TestCase):
         self.assertEqual(optimize(),
             (dict(a='a:23', c='c:(23 42)'), dict(fq=['b:42'])))
 
+    def testCombinedFilterQueryWithLocalParameters(self):
+        config = SolrConnectionConfig()
+        provideUtility(config, ISolrConnectionConfig)
+        config.filter_queries = ['portal_type review_state']
+        query = dict(portal_type='{!terms f=portal_type}A,B,C',
+            review_state='+review_state:published', a='a:23')
+        params = {}
+        optimizeQueryParameters(query, params)
+        self.assertEqual(query, dict(a='a:23'))
+        self.assertEqual(params, dict(fq=['{!terms f=portal_type}A,B,C',
+            '+review_state:published']))
+
+    def testDateMathFilterQuery(self):
+        provideUtility(SolrConnectionConfig(), ISolrConnectionConfig)
+        query = dict(a='+a:23', effective='+effective:[* TO NOW/HOUR]',
+            expires='+expires:[NOW/HOUR TO *]')
+        params = dict(fq='x:13')
+        optimizeQueryParameters(query, params)
+        self.assertEqual(query, dict(a='+a:23'))
+        self.assertEqual(params, dict(fq=['x:13',
+            '+effective:[* TO NOW/HOUR] +expires:[NOW/HOUR TO *]']))
+        # literal dates are kept in the query
+        query = dict(effective='+effective:[* TO 1972-05-11T03:47:02.000Z]')
+        optimizeQueryParameters(query, params)
+        self.assertEqual(query.keys(), ['effective'])
+
+    def testSecurityFilterQuery(self):
+        config = SolrConnectionConfig()
+        provideUtility(config, ISolrConnectionConfig)
+        query = dict(a='+a:23', allowedRolesAndUsers='allowedRolesAndUsers:'
+            '("Anonymous")')
+        optimizeQueryParameters(query, {})
+        self.assertEqual(sorted(query), ['a', 'allowedRolesAndUsers'])
+        config.split_security_filter = True
+        params = {}
+        optimizeQueryParameters(query, params)
+        self.assertEqual(query, dict(a='+a:23'))
+        self.assertEqual(params,
+            dict(fq=['allowedRolesAndUsers:("Anonymous")']))
+
     def testFilterFacetDependencies(self):
         extract = extractQueryParameters
         # any info about facet dependencies must not be passed on to solr
@@ -1,8 +1,15 @@
 from unittest import TestCase
+from datetime import datetime
+from StringIO import StringIO
 from DateTime import DateTime
 
 from collective.solr.parser import SolrResponse
+from collective.solr.parser import JSONResponse
+from collective.solr.parser import JavaBinResponse
+from collective.solr.parser import parse_date_as_datetime
+from collective.solr.parser import unmarshallers
 from collective.solr.parser import SolrSchema
+from collective.solr.parser import SolrField
 from collective.solr.parser import parseDate
 from collective.solr.tests.utils import getData
 
@@ -31,6 +38,79 @@ class ParserTests(TestCase):
         self.assertEqual(headers['params']['rows'], '10')
         self.assertEqual(headers['params']['q'], 'id:[* TO *]')
 
+    def testParseJSONSearchResults(self):
+        schema = SolrSchema(getData('schema.xml').split('\n\n', 1)[1])
+        response = JSONResponse(getData('json_search_response.txt'),
+            schema=schema)
+        results = response.response     # the result set is named 'response'
+        self.assertEqual(results.numFound, '1')
+        self.assertEqual(results.start, '0')
+        self.assertEqual(len(results), 1)
+        match = results[0]
+        self.assertEqual(match.id, '500')
+        self.assertEqual(type(match.id), str)
+        self.assertEqual(match.cat, ['software', u's\xfcche'])
+        self.assertEqual(match.popularity, 0)
+        self.assertEqual(match.inStock, True)
+        self.assertEqual(match.timestamp,
+            DateTime('2008-02-29 16:11:46.998 GMT'))
+        headers = response.responseHeader
+        self.assertEqual(headers['status'], 0)
+        self.assertEqual(headers['params']['wt'], 'json')
+        # without a schema dates cannot be recognized
+        response = JSONResponse(getData('json_search_response.txt'))
+        self.assertEqual(response.response[0].timestamp,
+            '2008-02-29T16:11:46.998Z')
+
+    def testStreamJSONSearchResults(self):
+        response = JSONResponse()
+        flares = response.stream(getData('json_search_response.txt'))
+        self.assertEqual([flare.id for flare in flares], ['500'])
+        self.assertEqual(response.response.numFound, '1')
+        self.assertEqual(len(response), 0)
+
+    def testParseJavaBinSearchResults(self):
+        response = JavaBinResponse(getData('javabin_search_response.bin'))
+        results = response.response     # the result set is named 'response'
+        self.assertEqual(results.numFound, '2')
+        self.assertEqual(results.start, '0')
+        self.assertEqual(results.maxScore, '1.0')
+        self.assertEqual(len(results), 2)
+        first, second = results
+        self.assertEqual(first.id, '500')
+        self.assertEqual(type(first.id), str)
+        self.assertEqual(first.name, 'python test doc')
+        self.assertEqual(first.popularity, 0)
+        self.assertEqual(first.price, 0.4)
+        self.assertEqual(first.timestamp,
+            DateTime('2008-02-29 16:11:46.998 GMT'))
+        self.assertEqual(first.cat, ['software', u's\xfcche'])
+        self.assertEqual(first.inStock, True)
+        self.assertEqual(first.description,
+            'a rather long description text, longer than 31 bytes')
+        self.assertEqual(first.count, -5)
+        self.assertEqual(first.weight, 1000)
+        self.assertEqual(second.id, '501')
+        self.assertEqual(second.timestamp, DateTime('1000/01/01 GMT'))
+        self.assertEqual(second.description, None)
+        self.assertEqual(second.weight, 15)
+        headers = response.responseHeader
+        self.assertEqual(headers['status'], 0)
+        self.assertEqual(headers['QTime'], 3)
+        self.assertEqual(headers['params']['wt'], 'javabin')
+
+    def testStreamJavaBinSearchResults(self):
+        simple = unmarshallers.copy()
+        simple['date'] = parse_date_as_datetime
+        response = JavaBinResponse(unmarshallers=simple)
+        data = StringIO(getData('javabin_search_response.bin'))
+        flares = response.stream(data)
+        self.assertEqual(flares.next().timestamp,
+            datetime(2008, 2, 29, 16, 11, 46, 998000))
+        self.assertEqual(response.response.numFound, '2')
+        self.assertEqual([flare.id for flare in flares], ['501'])
+        self.assertEqual(len(response), 0)
+
     def testParseComplexSearchResults(self):
         complex_xml_response = getData('complex_xml_response.txt')
         response = SolrResponse(complex_xml_response)
@@ -58,6 +138,32 @@ class ParserTests(TestCase):
         self.assertEqual(headers['params']['q'], 'id:[* TO *]')
         self.assertEqual(headers['params']['version'], '2.2')
 
+    def testStreamSearchResults(self):
+        complex_xml_response = getData('complex_xml_response.txt')
+        response = SolrResponse()
+        stream = response.stream(complex_xml_response)
+        first = stream.next()
+        # the result set is available (but empty) while streaming...
+        self.assertEqual(response.response.numFound, '2')
+        self.assertEqual(len(response.response), 0)
+        self.assertEqual(first.id, 'SOLR1000')
+        self.assertEqual(first.cat, ['software', 'search'])
+        self.assertEqual(first.incubationdate_dt, DateTime('2006/01/17 GMT'))
+        ids = [flare.id for flare in stream]
+        self.assertEqual(ids, ['3007WFP'])
+        self.assertEqual(len(response), 0)
+        # ...and the rest of the response gets parsed as usual
+        self.assertEqual(response.responseHeader['params']['q'],
+            'id:[* TO *]')
+
+    def testStreamKeepingSearchResults(self):
+        complex_xml_response = getData('complex_xml_response.txt')
+        response = SolrResponse()
+        ids = [flare.id for flare in response.stream(complex_xml_response,
+            keep=True)]
+        self.assertEqual(ids, ['SOLR1000', '3007WFP'])
+        self.assertEqual([flare.id for flare in response], ids)
+
     def testParseFacetSearchResults(self):
         facet_xml_response = getData('facet_xml_response.txt')
         response = SolrResponse(facet_xml_response)
@@ -151,6 +257,32 @@ class ParserTests(TestCase):
         self.assertEqual(len([f for f in fields if
             getattr(f, 'multiValued', False)]), 3)
 
+    def testSchemaDerivedInformation(self):
+        schema_xml = getData('plone_schema.xml')
+        schema = SolrSchema(schema_xml.split('\n\n', 1)[1])
+        self.assertEqual(schema.epi_indexes, set(['path']))
+        self.assertEqual(schema.stored, set(['id', 'UID', 'Title',
+            'Subject', 'path_string', 'review_state']))
+        self.assertEqual(schema.indexed, set(['id', 'UID', 'Title',
+            'default', 'SearchableText', 'Subject', 'path_depth',
+            'path_parents', 'review_state']))
+        self.assertEqual(schema.sortable, set(['id', 'UID', 'Title',
+            'SearchableText', 'path_depth', 'review_state']))
+        self.assertEqual(schema.dates, set())
+        schema = SolrSchema(getData('schema.xml').split('\n\n', 1)[1])
+        self.assertEqual(schema.epi_indexes, set())
+        self.assertEqual(schema.dates, set(['timestamp']))
+        self.assertEqual(schema.copies, set(['sku', 'incubationdate_s',
+            'text', 'nameSort', 'alphaNameSort', 'manu_exact']))
+        self.assertEqual(schema.updatable, False)
+        for field in schema.fields:
+            if field.name not in schema.copies:
+                field['stored'] = True
+        schema['_version_'] = SolrField(name='_version_',
+            class_='solr.LongField', stored=True)
+        schema.prepare()
+        self.assertEqual(schema.updatable, True)
+
     def testParseQuirkyResponse(self):
         quirky_response = getData('quirky_response.txt')
         response = SolrResponse(quirky_response)
@@ -0,0 +1,146 @@
+from unittest import TestCase
+from threading import Thread
+from time import time
+
+from zope.component import provideUtility
+
+from collective.solr.exceptions import SolrConnectionPoolExhausted
+from collective.solr.interfaces import ISolrConnectionConfig
+from collective.solr.manager import SolrConnectionConfig
+from collective.solr.manager import SolrConnectionManager
+from collective.solr.pool import SolrConnectionPool
+from collective.solr.solr import SolrConnection
+
+
+def factory():
+    return SolrConnection(host='localhost:8983', persistent=True)
+
+
+class PoolTests(TestCase):
+
+    def testReuse(self):
+        pool = SolrConnectionPool(factory, size=2)
+        first = pool.checkout()
+        second = pool.checkout()
+        self.assertNotEqual(first, second)
+        pool.checkin(first)
+        pool.checkin(second)
+        # idle connections are reused last-in-first-out
+        self.assertEqual(pool.checkout(), second)
+        self.assertEqual(pool.checkout(), first)
+        stats = pool.statistics()
+        self.assertEqual(stats['created'], 2)
+        self.assertEqual(stats['reused'], 2)
+        self.assertEqual(stats['used'], 2)
+        self.assertEqual(stats['idle'], 0)
+
+    def testTimeout(self):
+        pool = SolrConnectionPool(factory, size=1, timeout=0.1)
+        pool.checkout()
+        start = time()
+        self.assertRaises(SolrConnectionPoolExhausted, pool.checkout)
+        self.failUnless(time() - start >= 0.1)
+        stats = pool.statistics()
+        self.assertEqual(stats['waits'], 1)
+        self.assertEqual(stats['timeouts'], 1)
+
+    def testWaitForCheckin(self):
+        pool = SolrConnectionPool(factory, size=1, timeout=5)
+        conn = pool.checkout()
+        log = []
+        def runner():
+            log.append(pool.checkout())
+        thread = Thread(target=runner)
+        thread.start()
+        pool.checkin(conn)
+        thread.join()
+        self.assertEqual(log, [conn])
+
+    def testIdleEviction(self):
+        pool = SolrConnectionPool(factory, size=2, max_idle=60)
+        conn = pool.checkout()
+        pool.checkin(conn)
+        pool.idle[0] = conn, time() - 61    # pretend it's been idle for long
+        self.assertNotEqual(pool.checkout(), conn)
+        self.assertEqual(pool.statistics()['evicted'], 1)
+
+    def testReclaimFromEndedThreads(self):
+        pool = SolrConnectionPool(factory, size=1, timeout=0.1)
+        log = []
+        thread = Thread(target=lambda: log.append(pool.checkout()))
+        thread.start()
+        thread.join()
+        # the thread ended without returning its connection...
+        self.assertNotEqual(pool.checkout(), log[0])
+        self.assertEqual(pool.statistics()['reclaimed'], 1)
+
+    def testQueuedRequestsAreDiscarded(self):
+        pool = SolrConnectionPool(factory, size=1)
+        conn = pool.checkout()
+        conn.xmlbody.append('<add/>')
+        pool.checkin(conn)
+        # requests left behind by the last user aren't sent by the next one
+        self.assertEqual(pool.checkout(), conn)
+        self.assertEqual(conn.xmlbody, [])
+
+    def testCheckinAfterClear(self):
+        pool = SolrConnectionPool(factory, size=1)
+        conn = pool.checkout()
+        log = []
+        conn.close = lambda: log.append('closed')
+        pool.clear()
+        # the connection is no longer known to the pool and gets closed
+        pool.checkin(conn)
+        self.assertEqual(log, ['closed'])
+        self.assertEqual(pool.statistics()['idle'], 0)
+
+
+class ManagerPoolTests(TestCase):
+
+    def setUp(self):
+        provideUtility(SolrConnectionConfig(), ISolrConnectionConfig)
+        self.mngr = SolrConnectionManager()
+        self.mngr.setHost(active=True)
+
+    def tearDown(self):
+        self.mngr.closeConnection()
+        self.mngr.setHost(active=False)
+
+    def testConnectionIsKeptUntilClosed(self):
+        conn = self.mngr.getConnection()
+        self.assertEqual(self.mngr.getConnection(), conn)
+        self.mngr.closeConnection()
+        self.assertEqual(self.mngr.getPoolStatistics()['idle'], 1)
+        self.assertEqual(self.mngr.getConnection(), conn)
+        self.assertEqual(self.mngr.getPoolStatistics()['used'], 1)
+
+    def testTimeoutLockIsPerCheckout(self):
+        self.mngr.setTimeout(None, lock=True)
+        log = []
+        def runner():
+            conn = self.mngr.getConnection()
+            self.mngr.setTimeout(42)        # not locked in this thread
+            log.append(conn.conn.timeout)
+            self.mngr.closeConnection()
+        thread = Thread(target=runner)
+        thread.start()
+        thread.join()
+        self.assertEqual(log, [42])
+        self.mngr.setTimeout(23)            # but locked in this one
+        self.assertEqual(self.mngr.getConnection().conn.timeout, None)
+        self.mngr.closeConnection()         # returning the connection...
+        self.mngr.setTimeout(23)            # ...also frees the lock
+        self.assertEqual(self.mngr.getConnection().conn.timeout, 23)
+
+    def testPoolDependsOnConfiguration(self):
+        conn = self.mngr.getConnection()
+        self.mngr.closeConnection()
+        config = SolrConnectionConfig()
+        config.active = True
+        config.host = 'localhost'
+        config.port = 8984
+        config.base = '/solr'
+        provideUtility(config, ISolrConnectionConfig)
+        other = self.mngr.getConnection()
+        self.assertNotEqual(other, conn)
+        self.assertEqual(other.host, 'localhost:8984')
@@ -1,13 +1,18 @@
 # -*- coding: utf-8 -*-
 
 from unittest import TestCase
+from socket import error
+from StringIO import StringIO
+from time import sleep, time
 from DateTime import DateTime
 from Missing import MV
-from zope.component import provideUtility
+from zope.component import provideUtility, queryUtility
 
 from collective.solr.interfaces import ISolrConnectionConfig
 from collective.solr.manager import SolrConnectionConfig
-from collective.solr.manager import SolrConnectionManager
+from collective.solr.manager import SolrConnectionManager, pools
+from collective.solr.pool import SolrConnectionPool
+from collective.solr.solr import SolrConnection
 from collective.solr.tests.utils import getData, fakehttp
 from collective.solr.search import Search
 from collective.solr.queryparser import quote
@@ -179,15 +184,24 @@ class QueryTests(TestCase):
 
     def testMultiValueQueries(self):
         bq = self.bq
-        self.assertEqual(bq(('foo', 'bar')), '+(foo OR bar)')
-        self.assertEqual(bq(('foo', 'bar*')), '+(foo OR bar*)')
+        self.assertEqual(bq(('foo', 'bar')), '+(bar OR foo)')
+        self.assertEqual(bq(('foo', 'bar*')), '+(bar* OR foo)')
         self.assertEqual(bq(('foo bar', 'hmm')), '+("foo bar" OR hmm)')
         self.assertEqual(bq(('foø bar', 'hmm')), '+("fo\xc3\xb8 bar" OR hmm)')
         self.assertEqual(bq(('"foo bar"', 'hmm')), '+("foo bar" OR hmm)')
-        self.assertEqual(bq(name=['foo', 'bar']), '+name:(foo OR bar)')
-        self.assertEqual(bq(name=['foo', 'bar*']), '+name:(foo OR bar*)')
+        self.assertEqual(bq(name=['foo', 'bar']), '+name:(bar OR foo)')
+        self.assertEqual(bq(name=['foo', 'bar*']), '+name:(bar* OR foo)')
         self.assertEqual(bq(name=['foo bar', 'hmm']), '+name:("foo bar" OR hmm)')
 
+    def testTermsQueries(self):
+        bq = self.bq
+        queryUtility(ISolrConnectionConfig).terms_threshold = 2
+        self.assertEqual(bq(id=['c', 'a', u'b']), '{!terms f=id}a,b,c')
+        self.assertEqual(bq(id=['a', 'b']), '+id:(a OR b)')
+        self.assertEqual(bq(id=['a', 'b', 'c*']), '+id:(a OR b OR c*)')
+        self.assertEqual(bq(id=['a', 'b', 'c,d']), '+id:(a OR b OR c,d)')
+        self.assertEqual(bq(name=['a', 'b', 'c']), '+name:(a OR b OR c)')
+
     def testMultiArgumentQueries(self):
         bq = self.bq
         self.assertEqual(bq('foo', name='bar'), '+foo +name:bar')
@@ -217,8 +231,8 @@ class QueryTests(TestCase):
         self.assertEqual(bq(u'foo'), '+foo')
         self.assertEqual(bq(u'foø'), '+fo\xc3\xb8')
         self.assertEqual(bq(u'john@foo.com'), '+john@foo.com')
-        self.assertEqual(bq(name=['foo', u'bar']), '+name:(foo OR bar)')
-        self.assertEqual(bq(name=['foo', u'bär']), '+name:(foo OR b\xc3\xa4r)')
+        self.assertEqual(bq(name=['foo', u'bar']), '+name:(bar OR foo)')
+        self.assertEqual(bq(name=['foo', u'bär']), '+name:(b\xc3\xa4r OR foo)')
         self.assertEqual(bq(name='foo', cat=(u'bar', 'hmm')), '+cat:(bar OR hmm) +name:foo')
         self.assertEqual(bq(name='foo', cat=(u'bär', 'hmm')), '+cat:(b\xc3\xa4r OR hmm) +name:foo')
         self.assertEqual(bq(name=u'john@foo.com', cat='spammer'), '+cat:spammer +name:john@foo.com')
@@ -251,9 +265,9 @@ class QueryTests(TestCase):
     def testComplexQueries(self):
         bq = self.bq
         self.assertEqual(bq('foo', name='"herb*"', cat=(u'bär', '"-hmm"')),
-            '+cat:(b\xc3\xa4r OR "\-hmm") +foo +name:"herb\*"')
+            '+cat:("\-hmm" OR b\xc3\xa4r) +foo +name:"herb\*"')
         self.assertEqual(bq('foo', name='herb*', cat=(u'bär', '-hmm')),
-            '+cat:(b\xc3\xa4r OR -hmm) +foo +name:herb*')
+            '+cat:(-hmm OR b\xc3\xa4r) +foo +name:herb*')
 
     def testBooleanQueries(self):
         bq = self.bq
@@ -329,3 +343,85 @@ class SearchTests(TestCase):
         self.assertEqual(match.sku, '500')
         self.assertEqual(match.timestamp,
             DateTime('2008-02-29 16:11:46.998 GMT'))
+
+    def testCanonicalQueries(self):
+        output = fakehttp(self.conn, getData('schema.xml'),
+            getData('search_response.txt'), getData('search_response.txt'))
+        self.search(dict(name='+name:foo', cat='+cat:(bar OR hmm)'),
+            fq=['review_state:published', 'portal_type:Document'], rows=10)
+        self.search(dict(cat='+cat:(bar OR hmm)', name='+name:foo'),
+            rows=10, fq=['portal_type:Document', 'review_state:published'])
+        first, second = output.get(skip=1), output.get()
+        self.assertEqual(first, second)
+        self.failUnless(first.endswith('&fq=portal_type%3ADocument'
+            '&fq=review_state%3Apublished&q=%2Bcat%3A%28bar+OR+hmm%29'
+            '+%2Bname%3Afoo&rows=10'))
+
+    def testTermsQueriesUseFilterQueries(self):
+        output = fakehttp(self.conn, getData('schema.xml'),
+            getData('search_response.txt'))
+        self.search(dict(id='{!terms f=id}a,b,c'), fq='cat:foo', rows=10)
+        self.failUnless(output.get(skip=1).endswith('&fq=cat%3Afoo'
+            '&fq=%7B%21terms+f%3Did%7Da%2Cb%2Cc&q=%2A%3A%2A&rows=10'))
+
+
+class FakeSearchConnection(SolrConnection):
+    """ connection answering searches like "id:foo" with a document using
+        that id;  ids starting with "slow" are answered after a delay """
+
+    def search(self, **params):
+        id = params['q'].split(':', 1)[1]
+        if id == 'broken':
+            raise error('connection refused')
+        if id == 'buggy':
+            raise KeyError(id)
+        if id.startswith('slow'):
+            sleep(0.5)
+        body = getData('search_response.txt').split('\n\n', 1)[1]
+        return StringIO(body.replace('500', id))
+
+
+class ParallelSearchTests(TestCase):
+
+    def setUp(self):
+        provideUtility(SolrConnectionConfig(), ISolrConnectionConfig)
+        self.mngr = SolrConnectionManager()
+        self.mngr.setHost(active=True)
+        fakehttp(self.mngr.getConnection(), getData('schema.xml'))
+        self.mngr.getSchema()
+        pools['localhost', 8983, '/solr'] = SolrConnectionPool(
+            FakeSearchConnection)
+        self.search = Search()
+        self.search.manager = self.mngr
+
+    def tearDown(self):
+        self.mngr.closeConnection()
+        self.mngr.setHost(active=False)
+
+    def ids(self, responses):
+        return [r and r.results()[0].id for r in responses]
+
+    def testSearchMany(self):
+        responses = self.search.searchMany([('id:foo', {}),
+            ('id:bar', dict(rows=1)), ('id:baz', {})])
+        self.assertEqual(self.ids(responses), ['foo', 'bar', 'baz'])
+
+    def testSearchesRunInParallel(self):
+        start = time()
+        responses = self.search.searchMany([('id:slow%d' % n, {})
+            for n in range(5)])
+        self.failUnless(time() - start < 1.0)
+        self.assertEqual(self.ids(responses),
+            ['slow0', 'slow1', 'slow2', 'slow3', 'slow4'])
+
+    def testFailuresAndTimeouts(self):
+        responses = self.search.searchMany([('id:foo', {}),
+            ('id:broken', {}), ('id:slow', {})], timeout=0.2)
+        self.assertEqual(self.ids(responses), ['foo', None, None])
+
+    def testUnexpectedErrors(self):
+        responses = self.search.searchMany([('id:foo', {}),
+            ('id:buggy', {})])
+        self.assertEqual(self.ids(responses), ['foo', None])
+        pool = pools['localhost', 8983, '/solr']
+        self.assertEqual(pool.statistics()['used'], 0)
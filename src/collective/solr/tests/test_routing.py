@@ -0,0 +1,141 @@
+from unittest import TestCase
+
+from zope.component import provideUtility
+
+from collective.solr.indexer import SolrIndexProcessor
+from collective.solr.interfaces import ISolrConnectionConfig
+from collective.solr.manager import SolrConnectionConfig
+from collective.solr.manager import SolrConnectionManager
+from collective.solr.routing import SolrNode, parseEndpoint, pickNode
+from collective.solr.search import Search
+from collective.solr.tests.utils import getData, fakehttp
+
+
+class FakePool(object):
+
+    def __init__(self, inflight=0, conn=None):
+        self.inflight = inflight
+        self.conn = conn
+
+    def checkout(self):
+        return self.conn
+
+    def checkin(self, conn):
+        pass
+
+
+class RoutingTests(TestCase):
+
+    def testParseEndpoint(self):
+        self.assertEqual(parseEndpoint('foo:1234/bar'), ('foo', 1234, '/bar'))
+        self.assertEqual(parseEndpoint(' foo:1234/ '), ('foo', 1234, '/solr'))
+        self.assertEqual(parseEndpoint('foo/a/b/'), ('foo', 8983, '/a/b'))
+        self.assertEqual(parseEndpoint('foo'), ('foo', 8983, '/solr'))
+
+    def testPickNode(self):
+        one = SolrNode(('one', 8983, '/solr'), FakePool(inflight=2))
+        two = SolrNode(('two', 8983, '/solr'), FakePool(inflight=1))
+        three = SolrNode(('three', 8983, '/solr'), FakePool(inflight=3))
+        self.failUnless(pickNode([one, two, three]) is two)
+        two.healthy = False
+        self.failUnless(pickNode([one, two, three]) is one)
+        one.healthy = three.healthy = False
+        self.assertEqual(pickNode([one, two, three]), None)
+        self.assertEqual(pickNode([]), None)
+
+    def testProbe(self):
+        manager = SolrConnectionManager()
+        provideUtility(SolrConnectionConfig(), ISolrConnectionConfig)
+        manager.setHost(active=True)
+        conn = manager.getConnection()
+        manager.closeConnection()
+        node = SolrNode(('localhost', 8983, '/solr'), FakePool(conn=conn))
+        node.healthy = False
+        output = fakehttp(conn, getData('dummy_response.txt'))
+        node.recover(0)
+        self.failUnless(node.healthy)
+        self.failUnless(output.get().startswith('GET /solr/admin/ping '))
+        manager.setHost(active=False)
+
+
+class ReplicaTests(TestCase):
+
+    def setUp(self):
+        self.config = SolrConnectionConfig()
+        provideUtility(self.config, ISolrConnectionConfig)
+        self.mngr = SolrConnectionManager()
+        self.mngr.setHost(active=True)
+        self.config.replicas = ['localhost:1/solr']     # nothing listening
+        self.config.replica_retry = 3600
+        self.mngr.pinToMaster(False)    # other tests may have sent updates
+
+    def tearDown(self):
+        self.mngr.closeConnection()
+        self.mngr.pinToMaster(False)
+        self.mngr.setHost(active=False)
+
+    def testReadWriteSplit(self):
+        master = self.mngr.getConnection()
+        replica = self.mngr.getConnection(readonly=True)
+        self.assertEqual(master.host, 'localhost:8983')
+        self.assertEqual(replica.host, 'localhost:1')
+        self.failUnless(self.mngr.getConnection() is master)
+        self.failUnless(self.mngr.getConnection(readonly=True) is replica)
+        self.mngr.closeConnection()
+        self.assertEqual(self.mngr.getPool(('localhost', 1, '/solr')).used, {})
+
+    def testOutstandingRequests(self):
+        replica = self.mngr.getConnection(readonly=True)
+        node, = self.mngr.getReplicas()
+        log = []
+        def request(*args):
+            log.append(node.outstanding())
+        replica.sendPost = request
+        self.assertEqual(node.outstanding(), 0)     # checked out, but idle
+        replica.doPost('/solr/select', '', {})
+        self.assertEqual(log, [1])
+        self.assertEqual(node.outstanding(), 0)
+
+    def testPinAfterWrites(self):
+        proc = SolrIndexProcessor(self.mngr)
+        master = self.mngr.getConnection()
+        replica = self.mngr.getConnection(readonly=True)
+        fakehttp(master, getData('delete_response.txt'),
+            getData('commit_response.txt'))
+        master.xmlbody.append('<delete><id>foo</id></delete>')
+        proc.commit()
+        self.failUnless(self.mngr.getConnection(readonly=True) is master)
+
+    def testNoReplicas(self):
+        self.config.replicas = []
+        master = self.mngr.getConnection()
+        self.failUnless(self.mngr.getConnection(readonly=True) is master)
+
+    def testPinToMaster(self):
+        master = self.mngr.getConnection()
+        self.assertEqual(self.mngr.getConnection(readonly=True).host,
+            'localhost:1')
+        self.mngr.pinToMaster()
+        self.failUnless(self.mngr.getConnection(readonly=True) is master)
+        self.mngr.pinToMaster(False)
+        self.assertEqual(self.mngr.getConnection(readonly=True).host,
+            'localhost:1')
+
+    def testFailover(self):
+        master = self.mngr.getConnection()
+        replica = self.mngr.getConnection(readonly=True)
+        self.failIf(self.mngr.failover(master))
+        self.failUnless(self.mngr.failover(replica))
+        node, = self.mngr.getReplicas()
+        self.failIf(node.healthy)
+        self.failUnless(self.mngr.getConnection(readonly=True) is master)
+
+    def testSearchFailsOver(self):
+        search = Search()
+        search.manager = self.mngr
+        master = self.mngr.getConnection()
+        fakehttp(master, getData('schema.xml'), getData('search_response.txt'))
+        results = search('id:[* TO *]', rows=10, wt='xml').results()
+        self.assertEqual(results.numFound, '1')
+        node, = self.mngr.getReplicas()
+        self.failIf(node.healthy)
@@ -0,0 +1,105 @@
+from unittest import TestCase
+from glob import glob
+from os import remove
+from tempfile import mktemp
+from threading import Thread
+from time import time, sleep
+
+from zope.component import provideUtility
+
+from collective.solr.interfaces import ISolrConnectionConfig
+from collective.solr.manager import SolrConnectionConfig
+from collective.solr.manager import SolrConnectionManager
+from collective.solr.manager import schemas, schemaCachePath
+from collective.solr.tests.utils import getData, fakehttp
+
+
+class SchemaCacheTests(TestCase):
+
+    def setUp(self):
+        self.config = SolrConnectionConfig()
+        provideUtility(self.config, ISolrConnectionConfig)
+        self.mngr = SolrConnectionManager()
+        self.mngr.setHost(active=True)
+        self.path = mktemp()
+
+    def tearDown(self):
+        self.mngr.closeConnection()
+        self.mngr.setHost(active=False)
+        for path in glob(self.path + '*'):
+            remove(path)
+
+    def entry(self):
+        return schemas[self.config.host, self.config.port, self.config.base]
+
+    def testSchemaIsShared(self):
+        fakehttp(self.mngr.getConnection(), getData('schema.xml'))
+        schema = self.mngr.getSchema()
+        self.assertEqual(schema.uniqueKey, 'id')
+        log = []
+        def runner():
+            log.append(self.mngr.getSchema())   # no request is sent...
+            self.mngr.closeConnection()
+        thread = Thread(target=runner)
+        thread.start()
+        thread.join()
+        self.failUnless(log[0] is schema)
+
+    def testFailuresAreCached(self):
+        self.config.schema_retry = 60
+        self.assertEqual(self.mngr.getSchema(), None)   # nothing listening
+        conn = self.mngr.getConnection()
+        fakehttp(conn, getData('schema.xml'))
+        self.assertEqual(self.mngr.getSchema(), None)
+        self.assertEqual(len(conn.conn.fakedata), 1)    # nothing was sent
+        self.entry().retry = time()                     # after the back-off
+        self.assertEqual(self.mngr.getSchema().uniqueKey, 'id')
+
+    def testBackgroundRefresh(self):
+        fakehttp(self.mngr.getConnection(), getData('schema.xml'))
+        schema = self.mngr.getSchema()
+        # set up an idle connection for the refreshing thread...
+        pool = self.mngr.getPool()
+        conn = pool.checkout()
+        fakehttp(conn, getData('plone_schema.xml'))
+        pool.checkin(conn)
+        entry = self.entry()
+        entry.expires = time()
+        # ...the old schema will be used until it has been replaced
+        self.failUnless(self.mngr.getSchema() is schema)
+        for n in range(100):
+            if not entry.refreshing:
+                break
+            sleep(0.01)
+        self.failIf(self.mngr.getSchema() is schema)
+        self.assertEqual(self.mngr.getSchema().uniqueKey, 'UID')
+
+    def testSchemaCopy(self):
+        self.config.schema_cache_path = self.path
+        fakehttp(self.mngr.getConnection(), getData('schema.xml'))
+        self.mngr.getSchema()
+        self.assertEqual(glob(self.path + '*'), [self.path +
+            '.localhost-8983-solr'])
+        self.mngr.closeConnection(clearSchema=True)
+        schema = self.mngr.getSchema()  # solr isn't needed anymore
+        self.assertEqual(schema.uniqueKey, 'id')
+        # the copy isn't used for other servers
+        self.mngr.closeConnection(clearSchema=True)
+        self.config.port = 8984
+        self.assertEqual(self.mngr.getSchema(), None)   # nothing listening
+
+    def testSchemaCopyPath(self):
+        self.assertEqual(schemaCachePath('', ('localhost', 8983, '/solr')),
+            '')
+        self.assertEqual(schemaCachePath('/tmp/schema.xml',
+            ('localhost', 8983, '/solr/core1')),
+            '/tmp/schema.xml.localhost-8983-solr-core1')
+
+    def testSolrErrorsAreCached(self):
+        self.config.schema_retry = 60
+        conn = self.mngr.getConnection()
+        fakehttp(conn, getData('not_found.txt'), getData('schema.xml'))
+        self.assertEqual(self.mngr.getSchema(), None)
+        self.assertEqual(self.mngr.getSchema(), None)
+        self.assertEqual(len(conn.conn.fakedata), 1)    # nothing was sent
+        self.failUnless(self.entry().retry > time())
@@ -16,6 +16,7 @@ from collective.solr.tests.base import SolrTestCase, DEFAULT_OBJS
 from collective.solr.interfaces import ISolrConnectionConfig
 from collective.solr.interfaces import ISolrConnectionManager
 from collective.solr.interfaces import ISearch
+from collective.solr.interfaces import ICheckIndexable
 from collective.solr.dispatcher import solrSearchResults, FallBackException
 from collective.solr.indexer import SolrIndexProcessor
 from collective.solr.indexer import logger as logger_indexer
@@ -23,8 +24,10 @@ from collective.solr.manager import logger as logger_manager
 from collective.solr.flare import PloneFlare
 from collective.solr.parser import SolrResponse
 from collective.solr.search import Search
+from collective.solr.solr import SolrConnection
 from collective.solr.solr import logger as logger_solr
 from collective.solr.utils import activate
+from collective.solr.utils import loadState, saveState, findObjects
 from collective.indexing.queue import getQueue, processQueue
 
 
@@ -102,6 +105,90 @@ class SolrMaintenanceTests(SolrTestCase):
         self.assertEqual(len(log), 3)
         self.assertEqual(numFound(self.search()), 8)
 
+    def testPipelinedReindex(self):
+        maintenance = self.portal.unrestrictedTraverse('solr-maintenance')
+        log = []
+        def write(msg):
+            if 'items/s' in msg or 'sender(s)' in msg:
+                log.append(msg)
+        self.response.write = write
+        maintenance.reindex(batch=3, senders=3)
+        self.assertEqual(len(log), 4)   # three batches and the summary
+        self.failUnless('sent 3 batches' in log[-1])
+        self.assertEqual(numFound(self.search()), 8)
+        # sending the updates on the current thread still works, too
+        log[:] = []
+        maintenance.clear()
+        maintenance.reindex(senders=0)
+        self.assertEqual(log, [])
+        self.assertEqual(numFound(self.search()), 8)
+
+    def testFailedUpdatesDuringReindex(self):
+        maintenance = self.portal.unrestrictedTraverse('solr-maintenance')
+        log = []
+        def write(msg):
+            if 'sender(s)' in msg:
+                log.append(msg)
+        self.response.write = write
+        def sendBatch(conn, requests):
+            conn.failures += 1      # solr rejected the batch
+            return []
+        original, SolrConnection.sendBatch = SolrConnection.sendBatch, \
+            sendBatch
+        try:
+            maintenance.reindex(batch=3, senders=2)
+        finally:
+            SolrConnection.sendBatch = original
+        self.failUnless('3 errors' in log[-1])
+        self.assertEqual(numFound(self.search()), 0)
+        # the run isn't finished, and nothing was checkpointed either
+        self.failIf('reindex finished' in maintenance.progress())
+        state = loadState(maintenance.checkpointPath())
+        self.failIf(state and state['processed'])
+
+    def testResumableReindex(self):
+        maintenance = self.portal.unrestrictedTraverse('solr-maintenance')
+        maintenance.reindex(batch=3, walk='catalog')
+        self.failUnless('reindex finished' in maintenance.progress())
+        path = maintenance.checkpointPath()
+        state = loadState(path)
+        self.assertEqual((state['processed'], state['done']), (8, True))
+        # pretend the run got interrupted after the first batch...
+        uids = self.portal.portal_catalog._catalog.uids
+        paths = list(uids.keys(min='/plone/', max='/plone0'))
+        saveState(path, dict(state, path=paths[2], count=3, processed=3,
+            done=False))
+        self.failUnless('eta' in maintenance.progress())
+        maintenance.clear()
+        maintenance.reindex(resume='0')     # as given in the url
+        self.assertEqual(loadState(path)['processed'], 8)
+        saveState(path, dict(state, path=paths[2], count=3, processed=3,
+            done=False))
+        maintenance.clear()
+        maintenance.reindex(resume='1')
+        self.assertEqual(numFound(self.search()), len(paths) - 3)
+        self.assertEqual(loadState(path)['processed'], 3 + len(paths) - 3)
+
+    def testResumableTreeReindex(self):
+        maintenance = self.portal.unrestrictedTraverse('solr-maintenance')
+        maintenance.reindex(batch=3)
+        path = maintenance.checkpointPath()
+        state = loadState(path)
+        self.assertEqual((state['walk'], state['done']), ('tree', True))
+        total = state['processed']
+        # pretend the run got interrupted after the first batch...
+        origin = '/'.join(self.portal.getPhysicalPath())
+        paths = [origin + (id and '/' + id) for id, obj in
+            findObjects(self.portal) if ICheckIndexable(obj)()]
+        saveState(path, dict(state, path=paths[2], count=3, processed=3,
+            done=False))
+        maintenance.clear()
+        # the walk continues after the checkpoint, and `skip` doesn't apply
+        maintenance.reindex(resume='1', skip=2)
+        self.assertEqual(numFound(self.search()), total - 3)
+        state = loadState(path)
+        self.assertEqual((state['processed'], state['done']), (total, True))
+
     def testPartialReindex(self):
         maintenance = self.portal.unrestrictedTraverse('news/solr-maintenance')
         # initially the solr index should be empty
@@ -1,7 +1,11 @@
 from unittest import TestCase
+from json import loads
+from zlib import compress, decompress, MAX_WBITS
 from xml.etree.cElementTree import fromstring
-from collective.solr.solr import SolrConnection
-from collective.solr.tests.utils import getData, fakehttp
+from collective.solr.codec import formats
+from collective.solr.compression import gzip
+from collective.solr.solr import SolrConnection, SolrException, retries
+from collective.solr.tests.utils import getData, fakehttp, fakemore
 
 
 class TestSolr(TestCase):
@@ -38,6 +42,84 @@ class TestSolr(TestCase):
         res = res[0]
         self.failUnlessEqual(str(output), add_request)
 
+    def test_add_batched(self):
+        add_response = getData('add_response.txt')
+        c = SolrConnection(host='localhost:8983', persistent=True)
+        output = fakehttp(c, add_response, add_response)
+        c.add(id='500', name='python test doc')
+        c.add(id='501', name='another test doc')
+        c.delete('502')
+        res = c.flush()
+        self.assertEqual(len(res), 2)   # adds and delete were sent
+        self.assertEqual(output.get().split('\n\n')[1],
+            '<add><doc><field name="id">500</field><field name="name">'
+            'python test doc</field></doc><doc><field name="id">501</field>'
+            '<field name="name">another test doc</field></doc></add>')
+        self.assertEqual(output.get().split('\n\n')[1],
+            '<delete><id>502</id></delete>')
+
+    def test_add_batch_limits(self):
+        add_response = getData('add_response.txt')
+        c = SolrConnection(host='localhost:8983', persistent=True,
+            maxBatchSize=2)
+        output = fakehttp(c, add_response, add_response)
+        for id in '500', '501', '502':
+            c.add(id=id)
+        self.assertEqual(len(c.flush()), 2)
+        self.assertEqual(output.get().count('<doc>'), 2)
+        self.assertEqual(output.get().count('<doc>'), 1)
+        c.maxBatchBytes = 90
+        fakemore(c, add_response, add_response)
+        for id in '500', '501', '502':
+            c.add(id=id)
+        self.assertEqual(len(c.flush()), 2)
+        self.assertEqual(output.get().count('<doc>'), 2)
+        self.assertEqual(output.get().count('<doc>'), 1)
+
+    def test_add_batch_with_different_commit_within(self):
+        add_response = getData('add_response.txt')
+        c = SolrConnection(host='localhost:8983', persistent=True)
+        output = fakehttp(c, add_response, add_response)
+        c.add(id='500', commitWithin=1000)
+        c.add(id='501', commitWithin=1000)
+        c.add(id='502')
+        self.assertEqual(len(c.flush()), 2)
+        self.failUnless(output.get().endswith('<add commitWithin="1000">'
+            '<doc><field name="id">500</field></doc>'
+            '<doc><field name="id">501</field></doc></add>'))
+        self.failUnless(output.get().endswith(
+            '<add><doc><field name="id">502</field></doc></add>'))
+
+    def test_add_batch_bisected_on_error(self):
+        add_response = getData('add_response.txt')
+        bad_request = getData('bad_request_response.txt')
+        c = SolrConnection(host='localhost:8983', persistent=True)
+        output = fakehttp(c, bad_request, add_response, bad_request,
+            bad_request, add_response)
+        for id in '500', '501', '502':
+            c.add(id=id)
+        self.assertEqual(len(c.flush()), 2)     # all but one doc were sent
+        self.assertEqual(c.failures, 1)
+        self.assertEqual(len(output), 5)
+        self.assertEqual(output.get().count('<doc>'), 3)
+        self.assertEqual(output.get().count('<doc>'), 1)    # 500 is fine
+        self.assertEqual(output.get().count('<doc>'), 2)
+        self.failUnless('>501<' in output.get())    # rejected
+        self.failUnless('>502<' in output.get())
+
+    def test_add_batch_not_bisected_while_unavailable(self):
+        bad_gateway = 'HTTP/1.1 502 Bad Gateway\nContent-Length: 0\n\n'
+        c = SolrConnection(host='localhost:8983', persistent=True,
+            maxBatchSize=2)
+        output = fakehttp(c, bad_gateway, getData('add_response.txt'))
+        for id in '500', '501', '502':
+            c.add(id=id)
+        self.assertEqual(c.flush(), [])
+        self.assertEqual(c.failures, 3)     # the whole flush failed...
+        self.assertEqual(len(output), 1)    # ...after the first request
+        self.assertEqual(output.get().count('<doc>'), 2)
+        self.assertEqual(c.xmlbody, [])
+
     def test_commit(self):
         commit_request = getData('commit_request.txt')
         commit_response = getData('commit_response.txt')
@@ -119,3 +201,171 @@ class TestSolr(TestCase):
         self.failUnlessEqual(node.attrib['name'], 'QTime')
         self.failUnlessEqual(node.text, '0')
         res.find('QTime')
+
+    def test_add_json(self):
+        add_response = getData('json_add_response.txt')
+        c = SolrConnection(host='localhost:8983', persistent=True,
+            codec=formats['json'])
+        output = fakehttp(c, add_response)
+        boost = {'': 2, 'name': 5}
+        c.add(boost_values=boost, commitWithin=1000, id='500',
+            name=u'python t\xe4st doc', cat=['foo', 'bar'], popularity=3)
+        res = c.flush()
+        self.assertEqual(len(res), 1)   # one request was sent
+        self.assertEqual(res[0]['responseHeader']['QTime'], 4)
+        headers, body = output.get().split('\n\n')
+        self.failUnless('POST /solr/update/json HTTP/1.1' in headers)
+        self.failUnless('Content-Type: application/json; charset=utf-8'
+            in headers)
+        self.assertEqual(loads(body), {'add': {'boost': 2.0,
+            'commitWithin': 1000, 'doc': {'id': '500', 'cat': ['foo', 'bar'],
+            'popularity': 3, 'name': {'value': u'python t\xe4st doc',
+            'boost': 5.0}}}})
+
+    def test_update_json(self):
+        add_response = getData('json_add_response.txt')
+        c = SolrConnection(host='localhost:8983', persistent=True,
+            codec=formats['json'])
+        output = fakehttp(c, add_response)
+        c.update({'name': 'set', 'cat': 'set'}, id='500', _version_=1,
+            name='foo', cat=None)
+        c.flush()
+        body = output.get().split('\n\n')[1]
+        self.assertEqual(loads(body), {'add': {'doc': {'id': '500',
+            '_version_': 1, 'name': {'set': 'foo'}, 'cat': {'set': None}}}})
+
+    def test_add_json_batched(self):
+        add_response = getData('json_add_response.txt')
+        c = SolrConnection(host='localhost:8983', persistent=True,
+            codec=formats['json'])
+        output = fakehttp(c, add_response, add_response)
+        c.add(id='500')
+        c.delete('501')
+        c.add(id='502')
+        c.commit(waitSearcher=False)
+        self.assertEqual(output.get().split('\n\n')[1],
+            '{"add": {"doc": {"id": "500"}}, "delete": {"id": "501"}, '
+            '"add": {"doc": {"id": "502"}}}')
+        self.assertEqual(output.get().split('\n\n')[1],
+            '{"commit": {"waitSearcher": false}}')
+
+    def test_search_json(self):
+        search_response = getData('search_response.txt')
+        c = SolrConnection(host='localhost:8983', persistent=True,
+            codec=formats['json'])
+        output = fakehttp(c, search_response, search_response)
+        c.search(q='+id:[* TO *]').read()
+        params = output.get().split('\n\n')[1].split('&')
+        self.failUnless('wt=json' in params)
+        self.failUnless('json.nl=map' in params)
+        c.search(q='+id:[* TO *]', wt='xml')    # explicit format is kept
+        params = output.get().split('\n\n')[1].split('&')
+        self.failUnless('wt=xml' in params)
+
+    def test_add_compressed(self):
+        add_request = getData('add_request.txt')
+        add_response = getData('add_response.txt')
+        c = SolrConnection(host='localhost:8983', persistent=True,
+            compressThreshold=100)
+        output = fakehttp(c, add_response, add_response)
+        c.add(id='500', name='python test doc')
+        c.flush()           # the request is below the threshold...
+        self.assertEqual(str(output), add_request)
+        c.compressThreshold = 50
+        c.add(id='500', name='python test doc')
+        c.flush()           # ...but not anymore
+        headers, body = ''.join(output[1]).split('\r\n\r\n', 1)
+        self.failUnless('Content-Encoding: gzip' in headers)
+        self.failUnless('Content-Length: %d' % len(body) in headers)
+        self.assertEqual(decompress(body, 16 + MAX_WBITS),
+            add_request.split('\n\n', 1)[1])
+
+    def test_search_compressed_response(self):
+        search_response = getData('search_response.txt')
+        headers, body = search_response.split('\n\n', 1)
+        headers = headers.replace('Content-Length: 560',
+            'Content-Encoding: %s\nContent-Length: %d')
+        gzipped = headers % ('gzip', len(gzip(body))) + '\n\n' + gzip(body)
+        deflated = headers % ('deflate', len(compress(body))) + '\n\n' + \
+            compress(body)
+        c = SolrConnection(host='localhost:8983', persistent=True,
+            compressResponses=True)
+        output = fakehttp(c, gzipped, deflated)
+        for encoding in 'gzip', 'deflate':
+            res = c.search(q='+id:[* TO *]')
+            self.failUnless('Accept-Encoding: gzip, deflate' in output.get())
+            self.assertEqual(res.read(10), body[:10])    # partial reads...
+            self.assertEqual(res.read(), body[10:])      # ...work as well
+
+    def test_retry_unavailable(self):
+        unavailable = 'HTTP/1.1 503 Service Unavailable\nContent-Length: 0\n\n'
+        c = SolrConnection(host='localhost:8983', persistent=True,
+            retryAttempts=3)
+        before = dict(retries)
+        fakehttp(c, unavailable, unavailable, getData('search_response.txt'))
+        self.failUnless('<result' in c.search(q='+id:[* TO *]').read())
+        self.assertEqual(retries['retries'], before['retries'] + 2)
+        fakehttp(c, unavailable, unavailable, unavailable)
+        self.assertRaises(SolrException, c.search, q='+id:[* TO *]')
+        self.assertEqual(retries['exhausted'], before['exhausted'] + 1)
+        self.assertEqual(len(c.conn.fakedata), 0)
+
+    def test_retry_deadline(self):
+        unavailable = 'HTTP/1.1 503 Service Unavailable\nContent-Length: 0\n\n'
+        c = SolrConnection(host='localhost:8983', persistent=True,
+            retryAttempts=3, retryDelay=10, retryDeadline=1)
+        before = dict(retries)
+        fakehttp(c, unavailable, getData('search_response.txt'))
+        self.assertRaises(SolrException, c.search, q='+id:[* TO *]')
+        self.assertEqual(retries['expired'], before['expired'] + 1)
+
+    def test_no_retry_for_delete_by_query(self):
+        unavailable = 'HTTP/1.1 503 Service Unavailable\nContent-Length: 0\n\n'
+        c = SolrConnection(host='localhost:8983', persistent=True,
+            retryAttempts=3)
+        before = dict(retries)
+        fakehttp(c, unavailable, getData('delete_response.txt'))
+        c.deleteByQuery('id:foo')
+        self.assertEqual(c.flush(), [])     # the failure is logged
+        self.assertEqual(retries['skipped'], before['skipped'] + 1)
+        self.assertEqual(len(c.conn.fakedata), 1)
+
+    def test_no_retry_for_compressed_delete_by_query(self):
+        unavailable = 'HTTP/1.1 503 Service Unavailable\nContent-Length: 0\n\n'
+        c = SolrConnection(host='localhost:8983', persistent=True,
+            retryAttempts=3, compressThreshold=10)
+        before = dict(retries)
+        output = fakehttp(c, unavailable, getData('delete_response.txt'))
+        c.deleteByQuery('id:foo')
+        self.assertEqual(c.flush(), [])     # the failure is logged
+        self.failUnless('Content-Encoding: gzip' in output.get())
+        self.assertEqual(retries['skipped'], before['skipped'] + 1)
+        self.assertEqual(len(c.conn.fakedata), 1)
+
+    def test_reconnect_for_delete_by_query(self):
+        c = SolrConnection(host='localhost:8983', persistent=True,
+            retryAttempts=3)
+        before = dict(retries)
+        output = fakehttp(c, '', getData('delete_response.txt'), '', '')
+        c.conn.connect = lambda: None
+        c.deleteByQuery('id:foo')     # the stale connection is replaced...
+        self.assertEqual(len(c.flush()), 1)
+        self.assertEqual(c.reconnects, 1)
+        self.assertEqual(len(output), 2)
+        self.assertEqual(retries['skipped'], before['skipped'])
+        c.deleteByQuery('id:foo')     # ...but only once for each request
+        self.assertEqual(c.flush(), [])
+        self.assertEqual(c.reconnects, 2)
+        self.assertEqual(retries['skipped'], before['skipped'] + 1)
+        self.assertEqual(len(c.conn.fakedata), 0)
+
+    def test_idempotent_requests(self):
+        for name in 'xml', 'json':
+            codec = formats[name]
+            self.failUnless(codec.idempotent(codec.add({'id': 'foo'})))
+            self.failUnless(codec.idempotent(codec.delete('foo')))
+            self.failUnless(codec.idempotent(codec.commit()))
+            self.failIf(codec.idempotent(codec.deleteByQuery('id:foo')))
+            self.failIf(codec.idempotent(codec.commit(optimize=True)))
+            self.failIf(codec.idempotent(codec.merge([codec.delete('foo'),
+                codec.deleteByQuery('id:foo')])))
@@ -0,0 +1,181 @@
+from unittest import TestCase
+from os import listdir
+from os.path import join
+from shutil import rmtree
+from socket import error
+from tempfile import mkdtemp
+from cPickle import dumps
+from time import sleep
+
+from zope.component import provideUtility
+from App.config import getConfiguration
+
+from collective.solr.interfaces import ISolrConnectionConfig
+from collective.solr.manager import SolrConnectionConfig
+from collective.solr.manager import SolrConnectionManager
+from collective.solr.indexer import SolrIndexProcessor
+from collective.solr.solr import SolrConnection
+from collective.solr.spool import UpdateSpool, spools, queuePath
+from collective.solr.tests.test_indexer import Foo
+from collective.solr.tests.utils import getData, fakehttp
+
+
+class FakePool(object):
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def checkout(self):
+        return self.conn
+
+    def checkin(self, conn):
+        pass
+
+
+class ManualSpool(UpdateSpool):
+    """ a spool without a worker thread """
+
+    def start(self):
+        pass
+
+
+add = '<add><doc><field name="id">%s</field></doc></add>'
+
+
+class SpoolTests(TestCase):
+
+    def setUp(self):
+        self.path = mkdtemp()
+        self.conn = SolrConnection(host='localhost:8983', persistent=True)
+
+    def tearDown(self):
+        rmtree(self.path)
+
+    def testQueuedTransactionsAreMerged(self):
+        spool = ManualSpool(self.path, FakePool(self.conn))
+        spool.put('xml', [add % 1, '<commit/>'])
+        spool.put('xml', [add % 2, '<delete><id>3</id></delete>', '<commit/>'])
+        self.assertEqual(spool.statistics()['length'], 2)
+        output = fakehttp(self.conn, getData('add_response.txt'),
+            getData('delete_response.txt'), getData('commit_response.txt'))
+        spool.process(spool.pending())
+        self.assertEqual(output.get().split('\n\n')[1],
+            '<add><doc><field name="id">1</field></doc>'
+            '<doc><field name="id">2</field></doc></add>')
+        self.assertEqual(output.get().split('\n\n')[1],
+            '<delete><id>3</id></delete>')
+        self.assertEqual(output.get().split('\n\n')[1], '<commit/>')
+        self.assertEqual(spool.pending(), [])
+        self.assertEqual(spool.statistics()['sent'], 4)
+
+    def testFailedTransactionsAreKept(self):
+        spool = ManualSpool(self.path, FakePool(self.conn))
+        spool.put('xml', [add % 1])
+        class Broken(object):
+            def request(self, *args, **kw):
+                raise error('connection refused')
+            close = connect = setTimeout = lambda self, *args: None
+        self.conn.conn = Broken()
+        self.assertRaises(error, spool.process, spool.pending())
+        stats = spool.statistics()
+        self.assertEqual(stats['length'], 1)
+        self.assertEqual(stats['sent'], 0)
+        self.failUnless(stats['lag'] >= 0)
+
+    def testUnreadableFilesAreMovedAside(self):
+        spool = ManualSpool(self.path, FakePool(self.conn))
+        spool.put('xml', [add % 1])
+        spool.put('yaml', [add % 2])                # unknown codec
+        spool.put('xml', [add % 3])
+        first, second, third = spool.pending()
+        open(join(self.path, third), 'wb').write(dumps('garbage'))
+        output = fakehttp(self.conn, getData('add_response.txt'))
+        spool.process(spool.pending())
+        self.assertEqual(output.get().split('\n\n')[1],
+            '<add><doc><field name="id">1</field></doc></add>')
+        self.assertEqual(spool.pending(), [])
+        self.assertEqual(sorted(listdir(self.path)),
+            [second + '.bad', third + '.bad'])
+
+    def testWorkerSurvivesUnexpectedErrors(self):
+        spool = UpdateSpool(self.path, FakePool(self.conn), retry=0.01)
+        log = []
+        def process(names):
+            log.append(names)
+            if len(log) == 1:
+                raise KeyError('foo')
+            spool.process = original
+            original(names)
+        original, spool.process = spool.process, process
+        output = fakehttp(self.conn, getData('add_response.txt'))
+        spool.put('xml', [add % 1])
+        for n in range(100):
+            if not spool.pending():
+                break
+            sleep(0.01)
+        self.assertEqual(spool.pending(), [])
+        self.assertEqual(len(log), 2)
+        self.assertEqual(spool.statistics()['failures'], 1)
+        self.assertEqual(output.get().split('\n\n')[1],
+            '<add><doc><field name="id">1</field></doc></add>')
+
+    def testWorker(self):
+        spool = UpdateSpool(self.path, FakePool(self.conn))
+        output = fakehttp(self.conn, getData('add_response.txt'))
+        spool.put('xml', [add % 1])
+        for n in range(100):
+            if not spool.pending():
+                break
+            sleep(0.01)
+        self.assertEqual(spool.pending(), [])
+        self.assertEqual(output.get().split('\n\n')[1],
+            '<add><doc><field name="id">1</field></doc></add>')
+
+
+class QueuedIndexingTests(TestCase):
+
+    def setUp(self):
+        self.path = mkdtemp()
+        self.home = getConfiguration().clienthome
+        getConfiguration().clienthome = self.path
+        self.config = SolrConnectionConfig()
+        self.config.queue_updates = True
+        provideUtility(self.config, ISolrConnectionConfig)
+        self.mngr = SolrConnectionManager()
+        self.mngr.setHost(active=True)
+        conn = self.mngr.getConnection()
+        fakehttp(conn, getData('schema.xml'))       # fake schema response
+        self.mngr.getSchema()                       # read and cache the schema
+        self.spool = spools[queuePath()] = ManualSpool(queuePath(), None)
+        self.proc = SolrIndexProcessor(self.mngr)
+
+    def tearDown(self):
+        self.mngr.closeConnection()
+        self.mngr.setHost(active=False)
+        del spools[queuePath()]
+        getConfiguration().clienthome = self.home
+        rmtree(self.path)
+
+    def testQueueIsKeptPerInstance(self):
+        self.assertEqual(queuePath(), join(self.path, 'solr-queue'))
+        self.assertEqual(self.mngr.getSpool(), self.spool)
+        self.config.queue_updates = False
+        self.assertEqual(self.mngr.getSpool(), None)
+
+    def testCommitQueuesUpdates(self):
+        output = fakehttp(self.mngr.getConnection())    # no requests
+        self.proc.index(Foo(id='500', name='python test doc'))
+        self.proc.commit()
+        self.assertEqual(str(output), '')
+        codec, requests, names = self.spool.read(self.spool.pending())
+        self.assertEqual(codec, 'xml')
+        self.assertEqual(len(requests), 2)
+        self.failUnless(requests[0].startswith('<add><doc>'))
+        self.assertEqual(requests[1], '<commit waitSearcher="false"/>')
+        self.assertEqual(self.mngr.getQueueStatistics()['length'], 1)
+
+    def testEmptyTransactionsAreSkipped(self):
+        output = fakehttp(self.mngr.getConnection())
+        self.proc.commit()
+        self.assertEqual(str(output), '')
+        self.assertEqual(self.spool.pending(), [])
@@ -2,10 +2,12 @@
 
 from unittest import TestCase
 from Testing import ZopeTestCase as ztc
+from Products.ZCatalog.ZCatalog import ZCatalog
 
 from collective.solr.tests.utils import getData
 from collective.solr.parser import SolrResponse
 from collective.solr.utils import findObjects, isSimpleTerm, isSimpleSearch
+from collective.solr.utils import findCatalogObjects
 from collective.solr.utils import isWildCard, splitSimpleSearch
 from collective.solr.utils import setupTranslationMap, prepareData
 from collective.solr.utils import padResults
@@ -41,6 +43,47 @@ class UtilsTests(ztc.ZopeTestCase):
         # but the rest should be the same...
         self.assertEqual(self.ids(found[1:]), self.good)
 
+    def testFindObjectsOrder(self):
+        found = [path for path, obj in findObjects(self.portal.foo)]
+        self.assertEqual(found, ['', 'bar', 'bar/doc1', 'bar/file1'])
+
+    def testFindObjectsAfterStart(self):
+        found = [path for path, obj in findObjects(self.portal,
+            start='/portal/bar/foo/doc2')]
+        self.assertEqual(found, ['bar/foo/file2', 'foo', 'foo/bar',
+            'foo/bar/doc1', 'foo/bar/file1'])
+        found = [path for path, obj in findObjects(self.portal,
+            start='/portal/foo')]
+        self.assertEqual(found, ['foo/bar', 'foo/bar/doc1', 'foo/bar/file1'])
+        # subtrees before the starting point aren't loaded at all
+        getOb = self.portal._getOb
+        def _getOb(id, default):
+            self.assertNotEqual(id, 'bar')
+            return getOb(id, default)
+        self.portal._getOb = _getOb
+        found = [path for path, obj in findObjects(self.portal,
+            start='/portal/foo/bar/doc1')]
+        self.assertEqual(found, ['foo/bar/file1'])
+
+    def testFindCatalogObjects(self):
+        catalog = ZCatalog('portal_catalog')
+        for rid, path in enumerate(('foo', 'foo/bar', 'foo/bar/doc1',
+                'bar/foo/doc2', 'foo/bar/gone')):
+            catalog._catalog.uids['/portal/' + path] = rid
+        found = list(findCatalogObjects(self.portal, catalog))
+        self.assertEqual([path for path, obj in found],
+            ['bar/foo/doc2', 'foo', 'foo/bar', 'foo/bar/doc1'])
+        self.assertEqual(found[-1][1].getPhysicalPath(),
+            self.portal.foo.bar.doc1.getPhysicalPath())
+        found = list(findCatalogObjects(self.portal.foo, catalog))
+        self.assertEqual(found[0], ('', self.portal.foo))
+        self.assertEqual(len(found), 3)
+        # uncataloged containers are still reached via their ancestors
+        del catalog._catalog.uids['/portal/foo/bar']
+        found = list(findCatalogObjects(self.portal, catalog))
+        self.assertEqual([path for path, obj in found],
+            ['bar/foo/doc2', 'foo', 'foo/bar/doc1'])
+
     def testSimpleTerm(self):
         self.failUnless(isSimpleTerm('foo'))
         self.failUnless(isSimpleTerm('foo '))
@@ -1,12 +1,22 @@
+from collections import deque
+from cPickle import dumps, loads
+from logging import getLogger
+from os import fsync, rename
 from string import maketrans
 from re import compile, UNICODE
+from urllib import urlencode
 
 from Acquisition import aq_base
+from Products.CMFCore.utils import getToolByName
 from unidecode import unidecode
+from zope.annotation.interfaces import IAnnotations
 from zope.component import queryUtility
+from zope.globalrequest import getRequest
 
 from collective.solr.interfaces import ISolrConnectionConfig
 
+logger = getLogger('collective.solr.utils')
+
 
 def isActive():
     """ indicate if the solr connection should/can be used """
@@ -22,6 +32,27 @@ def activate(active=True):
     config.active = active
 
 
+def getRequestMemo(name):
+    """ returns a dictionary for memoizing values for the duration of the
+        current request or `None` if there's no (annotatable) request """
+    request = getRequest()
+    if request is None:
+        return None
+    annotations = IAnnotations(request, None)
+    if annotations is None:
+        return None
+    return annotations.setdefault('collective.solr.' + name, {})
+
+
+def serializeQuery(query, parameters):
+    """ serialize a search in a canonical way, i.e. with the parameters in
+        a deterministic order, e.g. for sending it or as a cache key """
+    items = parameters.items()
+    if query is not None:
+        items.append(('q', query))
+    return urlencode(sorted(items), doseq=True)
+
+
 def setupTranslationMap():
     """ prepare translation map to remove all control characters except
         tab, new-line and carriage-return """
@@ -147,19 +178,118 @@ def prepare_wildcard(value):
     return str(unidecode(value).lower())
 
 
-def findObjects(origin):
+def findObjects(origin, start=None):
     """ generator to recursively find and yield all zope objects below
-        the given start point """
+        the given start point;  the tree is walked depth-first using a
+        stack, getting each object from its (already loaded) parent, with
+        siblings being visited in the order of their ids;  `start` can be
+        the (absolute) path of an object processed earlier, in which case
+        only the objects after it are returned, while the subtrees before
+        it aren't loaded at all """
     traverse = origin.unrestrictedTraverse
     base = '/'.join(origin.getPhysicalPath())
     cut = len(base) + 1
-    paths = [base]
-    for idx, path in enumerate(paths):
-        obj = traverse(path)
-        yield path[cut:], obj
+    last = start and tuple(start.split('/')) or None
+    stack = deque([(base, None, None)])
+    while stack:
+        path, parent, id = stack.pop()
+        if parent is None:
+            obj = traverse(path)
+        else:
+            obj = parent._getOb(id, None)
+            if obj is None:
+                obj = traverse(path)
+        if last is None or tuple(path.split('/')) > last:
+            yield path[cut:], obj
         if hasattr(aq_base(obj), 'objectIds'):
-            for id in obj.objectIds():
-                paths.insert(idx + 1, path + '/' + id)
+            for id in sorted(obj.objectIds(), reverse=True):
+                child = path + '/' + id
+                if last is not None:
+                    parts = tuple(child.split('/'))
+                    if parts < last and last[:len(parts)] != parts:
+                        continue    # the whole subtree was handled before
+                stack.append((child, obj, id))
+
+
+def findCatalogObjects(origin, catalog=None, start=None):
+    """ generator to find and yield all cataloged objects below the given
+        start point in the order of their paths;  only the catalog's path
+        mapping is iterated, and the containers on the way to the current
+        object are kept, so that its siblings and children are reached
+        from them directly;  `start` can be the (absolute) path of an
+        object processed earlier, in which case only the objects after it
+        are returned """
+    if catalog is None:
+        catalog = getToolByName(origin, 'portal_catalog')
+    traverse = origin.unrestrictedTraverse
+    base = '/'.join(origin.getPhysicalPath())
+    cut = len(base) + 1
+    uids = catalog._catalog.uids
+    if start is None and uids.has_key(base):
+        yield '', origin
+    def child(container, name):
+        if container is not None:
+            try:
+                return container._getOb(name, None)
+            except AttributeError:      # not a folderish object
+                pass
+        return None
+    parents = [(base, origin)]      # the ancestors of the current object
+    # the paths of all children are between "base/" and "base0"
+    if start is None:
+        paths = uids.keys(min=base + '/', max=base + '0')
+    else:
+        paths = uids.keys(min=max(start, base + '/'), max=base + '0',
+            excludemin=True)
+    for path in paths:
+        parent, id = path.rsplit('/', 1)
+        while parents[-1][0] != parent and \
+                not parent.startswith(parents[-1][0] + '/'):
+            parents.pop()
+        prefix, container = parents[-1]
+        if prefix != parent:
+            for name in parent[len(prefix) + 1:].split('/'):
+                prefix += '/' + name
+                container = child(container, name)
+                parents.append((prefix, container))
+        obj = child(container, id)
+        if obj is None:
+            obj = traverse(path, None)
+        if obj is None:
+            logger.warning('skipping stale catalog entry for %r', path)
+            continue
+        yield path[cut:], obj
+
+
+def countCatalogObjects(origin, catalog):
+    """ returns the number of cataloged objects below the given start point,
+        i.e. the number of objects `findCatalogObjects` would yield """
+    base = '/'.join(origin.getPhysicalPath())
+    uids = catalog._catalog.uids
+    return len(uids.keys(min=base + '/', max=base + '0')) + \
+        int(bool(uids.has_key(base)))
+
+
+def loadState(path):
+    """ read the state or checkpoint of a long-running task from the given
+        file;  `None` is returned if there's none yet """
+    try:
+        data = open(path, 'rb').read()
+    except IOError:
+        return None
+    return loads(data)
+
+
+def saveState(path, state):
+    """ write the state of a long-running task, replacing the previous one
+        atomically, so that it survives the process getting killed """
+    temp = path + '.tmp'
+    output = open(temp, 'wb')
+    output.write(dumps(state, 2))
+    output.flush()
+    fsync(output.fileno())
+    output.close()
+    rename(temp, path)
 
 
 def padResults(results, start=0, **kw):